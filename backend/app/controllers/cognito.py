@@ -1,10 +1,10 @@
 import os
-import boto3
 import hmac
 import hashlib
 import base64
 import uuid
 from app.models.user import UserSignup
+from app.utils.aws import get_client
 from dotenv import load_dotenv
 
 
@@ -17,21 +17,19 @@ AWS_COGNITO_CLIENT_SECRET = os.getenv("AWS_COGNITO_CLIENT_SECRET", "").replace('
 
 class AWSCognito:
     def __init__(self):
-        self.client = boto3.client('cognito-idp', region_name=AWS_REGION_NAME)
+        self.client = get_client('cognito-idp', AWS_REGION_NAME)
         self.client_id = AWS_COGNITO_APP_CLIENT_ID
         self.client_secret = AWS_COGNITO_CLIENT_SECRET
+        # HMAC gia' inizializzato con il client secret: per ogni hash basta copiarlo
+        self._secret_hmac = hmac.new(self.client_secret.encode('utf-8'), digestmod=hashlib.sha256)
         
     def _calculate_secret_hash(self, username):
         """
         Calculate SECRET_HASH using HMAC SHA256
         """
-        message = username + self.client_id
-        dig = hmac.new(
-            key=self.client_secret.encode('utf-8'),
-            msg=message.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).digest()
-        return base64.b64encode(dig).decode()
+        mac = self._secret_hmac.copy()
+        mac.update((username + self.client_id).encode('utf-8'))
+        return base64.b64encode(mac.digest()).decode()
 
     def sign_up(self, user: UserSignup):
         username = user.username
@@ -1,18 +1,33 @@
 ###
-from fastapi import APIRouter, File, UploadFile, Depends, Header, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, File, UploadFile, Depends, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import hashlib
 import json
 import os
-import boto3
 import time
 from app.services.file import save_file, list_uploaded_files, get_file_transcription, get_user_total_duration
-from ..utils.auth import get_username_from_token
-from boto3.dynamodb.conditions import Attr
-from app.services import ServiceLLM
+from app.services.file import file_object_key, reuse_original_results
+from app.services.stats import get_user_stats, get_language_counts, get_daily_uploads
+from app.services.tables import FILES_TABLE
+from ..utils.auth import get_current_username
+from app.services import ServiceLLM, get_service_llm
+from app.services.llm import LLMError, LLMRateLimited, LLMUnavailable, LLMBadRequest
+from app.services.presign import presign_get_urls, PRESIGN_REFRESH_FRACTION
+from app.services.uploads import initiate_upload, complete_upload, abort_upload
+from app.services.deletion import delete_files
+from app.services.jobs import enqueue_transcription
+from app.services.summaries import enqueue_summary, summarize_file
+from app.services.queue import jobs_enabled
+from app.models import UploadInitiate, UploadComplete, UploadAbort, FilesDelete
+from app.services.transcription import start_transcription, get_transcription_starter, TranscriptionAlreadyRunning
+from app.services.transcription import check_transcription_status, get_status_broker
+from app.services.events import StatusBroker, is_final
+from ..utils.aws import get_client, get_table
+from ..utils.concurrency import run_blocking
 from botocore.exceptions import ClientError
-from datetime import datetime, timedelta
-from collections import defaultdict
-from decimal import Decimal
+from datetime import datetime
 from dotenv import load_dotenv
 
 ###
@@ -21,73 +36,97 @@ load_dotenv()
 
 router = APIRouter()
 
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv("AWS_REGION", "").replace('"', ''))
-files_table = dynamodb.Table('files')
-lambda_client = boto3.client(
-    'lambda',
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
-)
-
-transcribe_client = boto3.client(
-    'transcribe',
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
-)
+files_table = get_table(FILES_TABLE)
+
+# Validita' degli URL firmati nelle liste dei file: 2 ore
+DASHBOARD_URL_EXPIRATION = 7200
 
 @router.post("/upload/")
 async def upload_file(
     file: UploadFile = File(...),
-    authorization: str = Header(None)
+    username: str = Depends(get_current_username)
 ):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
     return await save_file(file, username)
 
+@router.post("/upload/initiate")
+async def initiate_direct_upload(
+    data: UploadInitiate,
+    username: str = Depends(get_current_username)
+):
+    """
+    Upload diretto su S3: restituisce gli URL firmati (PUT) delle parti del
+    multipart upload; il client li carica e chiude con /upload/complete
+    """
+    return await initiate_upload(username, data.filename, data.size)
+
+@router.post("/upload/complete")
+async def complete_direct_upload(
+    data: UploadComplete,
+    username: str = Depends(get_current_username)
+):
+    if not data.parts:
+        raise HTTPException(status_code=400, detail="No uploaded parts")
+    parts = [(part.part_number, part.etag) for part in data.parts]
+    return await complete_upload(username, data.file_id, data.upload_id, data.filename, parts, data.sha256)
+
+@router.post("/upload/abort")
+async def abort_direct_upload(
+    data: UploadAbort,
+    username: str = Depends(get_current_username)
+):
+    await abort_upload(username, data.file_id, data.upload_id, data.filename)
+    return {"message": "Upload aborted", "file_id": data.file_id}
+
 @router.get("/files/")
-def get_files(authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
+def get_files(
+    username: str = Depends(get_current_username),
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = Query(None)
+):
+    """
+    Senza `limit` restituisce tutti i file dell'utente; con `limit` una pagina
+    nella forma {"files": [...], "next_cursor": ...}, da passare come `cursor`
+    """
+    files_data, next_cursor = list_uploaded_files(username, limit=limit, cursor=cursor)
     
     try:
-        files_data = list_uploaded_files(username)
-        
-        bucket_name = os.getenv("S3_BUCKET_NAME", "").replace('"', '')
-        
-        for file in files_data:
-            if file.get('url'):
-                object_key = f"{username}/{file['id']}_{file['filename']}"
-                signed_url = generate_presigned_url(bucket_name, object_key, expiration=7200)  # 2 ore
-                
-                if signed_url:
-                    file['url'] = signed_url
-                else:
-                    file['url'] = None
+        sign_file_urls(username, files_data)
                 
+        if limit:
+            return {"files": files_data, "next_cursor": next_cursor}
         return files_data
         
     except Exception as e:
         raise HTTPException(status_code=500, detail="Errore nel recupero dei file")
 
+def sign_file_urls(username: str, files_data: list) -> list:
+    """
+    Sostituisce l'URL pubblico di ogni file con un URL firmato valido 2 ore
+    """
+    bucket_name = os.getenv("S3_BUCKET_NAME", "").replace('"', '')
+    
+    # La chiave si ricava dall'URL salvato: i duplicati puntano all'oggetto dell'originale
+    object_keys = {
+        file['id']: file['url'].split('.amazonaws.com/', 1)[-1]
+        for file in files_data if file.get('url')
+    }
+    signed_urls = presign_get_urls(bucket_name, list(object_keys.values()), expiration=DASHBOARD_URL_EXPIRATION)
+    
+    for file in files_data:
+        if file.get('url'):
+            file['url'] = signed_urls.get(object_keys[file['id']])
+    return files_data
+
 @router.post("/transcribe/{file_id}")
 async def transcribe_file(
     file_id: str,
-    authorization: str = Header(None)
+    username: str = Depends(get_current_username),
+    starter = Depends(get_transcription_starter)
 ):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
-    
     try:
         try:
-            response = files_table.get_item(
+            response = await run_blocking(
+                files_table.get_item,
                 Key={
                     'user_id': username,
                     'file_id': file_id
@@ -103,50 +142,66 @@ async def transcribe_file(
             if not filename:
                 raise HTTPException(status_code=404, detail="Filename not found in database")
                 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail="Error retrieving file metadata")
         
+        # Duplicato di un file gia' trascritto: si riusano i risultati senza un nuovo job
+        origin_file_id = file_item.get('origin_file_id')
+        if origin_file_id:
+            origin = (await run_blocking(
+                files_table.get_item,
+                Key={'user_id': username, 'file_id': origin_file_id}
+            )).get('Item')
+            if origin and origin.get('status') == 'COMPLETED' and \
+                    await run_blocking(reuse_original_results, username, file_id, origin):
+                return {"status": "COMPLETED", "file_id": file_id, "origin_file_id": origin_file_id}
+        
         bucket_name = os.getenv("S3_BUCKET_NAME", "cc-bucket-audio")
-        file_key = f"{username}/{file_id}_{filename}"
+        file_key = file_object_key(username, file_item)
         
-        s3 = boto3.client('s3')
+        s3 = get_client('s3')
         try:
-            s3.head_object(Bucket=bucket_name, Key=file_key)
+            await run_blocking(s3.head_object, Bucket=bucket_name, Key=file_key)
         except ClientError as e:
             if e.response['Error']['Code'] == '404':
                 raise HTTPException(status_code=404, detail=f"File not found in S3: {file_key}")
             else:
                 raise HTTPException(status_code=500, detail=f"Error accessing S3: {str(e)}")
         
-        payload = {
-            "body": {
-                "bucket": bucket_name,
-                "key": file_key,
-                "username": username
-            }
-        }
-        
-        lambda_response = lambda_client.invoke(
-            FunctionName=os.getenv("LAMBDA_FUNCTION_NAME", "lambda-audio-transcribe"),
-            InvocationType='RequestResponse',
-            Payload=json.dumps(payload)
-        )
+        if jobs_enabled():
+            # L'avvio del job lo esegue un worker: la risposta non attende la Lambda
+            try:
+                queued = await run_blocking(enqueue_transcription, username, file_id, bucket_name, file_key)
+            except TranscriptionAlreadyRunning:
+                raise HTTPException(status_code=409, detail="Transcription already queued or in progress")
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "status": "QUEUED",
+                    "job_id": queued["job_id"],
+                    "job_name": queued["job_name"],
+                    "file_id": file_id,
+                    "file_key": file_key
+                }
+            )
         
-        response_payload = json.loads(lambda_response['Payload'].read())
+        try:
+            job_name = await run_blocking(start_transcription, username, file_id, bucket_name, file_key, starter)
+        except TranscriptionAlreadyRunning:
+            raise HTTPException(status_code=409, detail="Transcription already queued or in progress")
         
-        if response_payload.get('statusCode') == 200:
-            body = json.loads(response_payload.get('body', '{}'))
-            return {
-                "status": "processing",
-                "job_name": body.get('job_name'),
+        # Il job prosegue in background: lo stato si legge da /transcription/{file_id}?check_status=true
+        return JSONResponse(
+            status_code=202,
+            content={
+                "status": "IN_PROGRESS",
+                "job_name": job_name,
                 "file_id": file_id,
-                "file_key": file_key  
+                "file_key": file_key
             }
-        else:
-            raise HTTPException(
-                status_code=500, 
-                detail="Error starting transcription"
-            )
+        )
     
     except HTTPException:
         raise
@@ -156,45 +211,12 @@ async def transcribe_file(
 @router.get("/transcription/{file_id}")
 def get_transcription(
     file_id: str,
-    authorization: str = Header(None),
+    username: str = Depends(get_current_username),
     check_status: bool = Query(False)
 ):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
-    
     if check_status:
         try:
-            jobs_response = transcribe_client.list_transcription_jobs(
-                MaxResults=100
-            )
-            
-            target_key = f"{username}/{file_id}.json"
-            matching_jobs = [
-                job for job in jobs_response.get('TranscriptionJobSummaries', [])
-                if job.get('OutputLocations', [{}])[0].get('OutputLocation', '').endswith(target_key)
-            ]
-            
-            if matching_jobs:
-                job = matching_jobs[0]
-                status = job.get('TranscriptionJobStatus')
-                
-                if status == 'COMPLETED':
-                    transcription = get_file_transcription(file_id, username)
-                    if transcription:
-                        return transcription
-                    else:
-                        return {"status": status, "message": "Trascrizione in corso..."}
-                else:
-                    return {"status": status, "message": f"Processing in progress: {status}"}
-            
-            transcription = get_file_transcription(file_id, username)
-            if transcription:
-                return transcription
-            else:
-                return {"status": "UNKNOWN", "message": "Trascrizione in corso..."}
+            return check_transcription_status(username, file_id)
                 
         except Exception as e:
             return {"status": "ERROR", "message": f"Error checking status: {str(e)}"}
@@ -205,79 +227,182 @@ def get_transcription(
     
     return JSONResponse(status_code=404, content={"detail": "Trascrizione non trovata"})
 
+# Ogni quanto inviare un commento SSE per tenere aperta la connessione
+SSE_KEEPALIVE = 15
+
+@router.get("/transcription/{file_id}/events")
+async def transcription_events(
+    file_id: str,
+    request: Request,
+    username: str = Depends(get_current_username),
+    broker: StatusBroker = Depends(get_status_broker)
+):
+    """
+    Stream Server-Sent Events dello stato della trascrizione: un evento a ogni
+    cambio di stato, lo stream si chiude dopo lo stato finale
+    """
+    async def stream():
+        queue = broker.subscribe(username, file_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+                if is_final(event):
+                    return
+        finally:
+            broker.unsubscribe(username, file_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/transcription/{file_id}/wait")
+async def wait_transcription(
+    file_id: str,
+    username: str = Depends(get_current_username),
+    since: str = Query(None),
+    timeout: float = Query(25, gt=0, le=60),
+    broker: StatusBroker = Depends(get_status_broker)
+):
+    """
+    Long-poll: risponde appena lo stato e' diverso da `since` (o finale),
+    al piu' dopo `timeout` secondi con l'ultimo stato noto
+    """
+    event = await broker.wait(username, file_id, since=since, timeout=timeout)
+    if event is None:
+        return {"status": since or "UNKNOWN", "message": "Nessun aggiornamento"}
+    return event
+
 @router.get("/summarize/{file_id}")
-def summarize_transcription(
+async def summarize_transcription(
     file_id: str,
-    authorization: str = Header(None),
+    username: str = Depends(get_current_username),
+    regenerate: bool = Query(False),
+    background: bool = Query(False),
+    llm_service: ServiceLLM = Depends(get_service_llm),
 ):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
+    """
+    Riassunto della trascrizione: quello gia' salvato se esiste, altrimenti
+    (o con regenerate=true) uno nuovo generato dal modello e salvato su S3.
+    Con background=true e la coda di job configurata il riassunto mancante
+    viene accodato per un worker e si risponde 202, da ricontrollare con una nuova GET
+    """
+    if not regenerate:
+        summary = await run_blocking(llm_service.get_saved_summary, username, file_id)
+        if summary is not None:
+            return {"summary": summary, "file_id": file_id, "cached": True}
     
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
+    if background and jobs_enabled():
+        if not regenerate:
+            # Riassunto gia' in coda (anche quello automatico): non se ne accoda un altro
+            item = (await run_blocking(
+                files_table.get_item,
+                Key={'user_id': username, 'file_id': file_id},
+                ProjectionExpression="summary_status"
+            )).get('Item', {})
+            if item.get('summary_status') == 'PENDING':
+                return JSONResponse(status_code=202, content={"status": "PENDING", "file_id": file_id})
+        job_id = await run_blocking(enqueue_summary, username, file_id, regenerate)
+        return JSONResponse(status_code=202, content={"status": "QUEUED", "job_id": job_id, "file_id": file_id})
     
-    transcription_data = get_file_transcription(file_id, username)
+    try:
+        # Il riassunto salvato e' gia' stato cercato sopra: si genera direttamente
+        summary, cached = await summarize_file(username, file_id, regenerate=True, llm_service=llm_service)
+    except LLMError as e:
+        raise llm_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in summarization request: {str(e)}")
     
-    if not transcription_data or not transcription_data.get("transcription"):
+    if summary is None:
         return JSONResponse(status_code=404, content={"detail": "Trascrizione non trovata"})
     
-    try:
-        llm_service = ServiceLLM()
+    return {
+        "summary": summary,
+        "file_id": file_id,
+        "cached": cached
+    }
+
+
+def llm_http_error(error: LLMError) -> HTTPException:
+    if isinstance(error, LLMRateLimited):
+        return HTTPException(status_code=429, detail="Troppe richieste di riassunto, riprova tra poco")
+    if isinstance(error, LLMUnavailable):
+        return HTTPException(status_code=503, detail="Servizio di riassunto non disponibile")
+    if isinstance(error, LLMBadRequest):
+        return HTTPException(status_code=422, detail=f"Richiesta di riassunto rifiutata: {str(error)}")
+    return HTTPException(status_code=500, detail=f"Error in summarization request: {str(error)}")
+
+@router.get("/summarize/{file_id}/stream")
+async def stream_summary(
+    file_id: str,
+    username: str = Depends(get_current_username),
+    regenerate: bool = Query(False),
+    llm_service: ServiceLLM = Depends(get_service_llm),
+):
+    """
+    Riassunto in streaming (Server-Sent Events): eventi `token` con i frammenti
+    di testo appena generati, poi `done`; il riassunto completo viene salvato su S3
+    """
+    saved = None
+    if not regenerate:
+        saved = await run_blocking(llm_service.get_saved_summary, username, file_id)
+    
+    transcription = None
+    if saved is None:
+        transcription_data = await run_blocking(get_file_transcription, file_id, username)
+        if not transcription_data or transcription_data.get("status") != "COMPLETED" or not transcription_data.get("transcription"):
+            return JSONResponse(status_code=404, content={"detail": "Trascrizione non trovata"})
+        transcription = transcription_data["transcription"]
+    
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    async def events():
+        if saved is not None:
+            yield sse("token", {"text": saved})
+            yield sse("done", {"file_id": file_id, "cached": True})
+            return
         
-        summary = llm_service.summarize_and_save(
-            transcription_data["transcription"], 
-            username, 
-            file_id
-        )
+        # Primo evento subito: il riassunto dei blocchi di una trascrizione lunga richiede tempo
+        yield sse("status", {"status": "SUMMARIZING", "file_id": file_id})
         
-        return {
-            "summary": summary,
-            "file_id": file_id
-        }
+        parts = []
+        try:
+            async for fragment in llm_service.stream_summary(transcription):
+                parts.append(fragment)
+                yield sse("token", {"text": fragment})
+            
+            await run_blocking(llm_service.save_summary, username, file_id, "".join(parts))
+        except LLMError as e:
+            error = llm_http_error(e)
+            yield sse("error", {"status": error.status_code, "detail": error.detail})
+            return
+        except Exception as e:
+            yield sse("error", {"status": 500, "detail": f"Error in summarization request: {str(e)}"})
+            return
+        
+        yield sse("done", {"file_id": file_id, "cached": False})
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error in summarization request: {str(e)}")
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/users/{username}/language-distribution")
 async def get_language_distribution(username: str):
     try:
-        # Query per recuperare tutte le trascrizioni dell'utente con status 'completed'
-        response = files_table.scan(
-            FilterExpression=Attr("user_id").eq(username) & Attr("status").eq("COMPLETED")
-        )
-        items = response.get("Items", [])
-
-        if not items:
-            return JSONResponse(
-                content={
-                    "username": username,
-                    "total_transcriptions": 0,
-                    "languages": {},
-                    "message": "Nessuna trascrizione completata trovata."
-                }
-            )
-
-        total_transcriptions = len(items)
-
-        language_counts = {}
-        for item in items:
-            lang = item.get("language", "unknown")
-            language_counts[lang] = language_counts.get(lang, 0) + 1
-
-        language_distribution = {
-            lang: round((count / total_transcriptions) * 100, 2)
-            for lang, count in language_counts.items()
-        }
-
-        return JSONResponse(
-            content={
-                "username": username,
-                "total_transcriptions": total_transcriptions,
-                "languages": language_distribution,
-                "message": "Dati ottenuti con successo"
-            }
-        )
+        user_stats = await run_blocking(get_user_stats, username)
+        return JSONResponse(content=language_distribution_payload(username, user_stats))
 
     except Exception as e:
         return JSONResponse(
@@ -285,83 +410,44 @@ async def get_language_distribution(username: str):
             content={"message": f"Errore interno al server: {str(e)}"},
         )
 
+def language_distribution_payload(username: str, user_stats: dict) -> dict:
+    # Contatori per lingua dei file 'COMPLETED', mantenuti nelle statistiche dell'utente
+    language_counts = get_language_counts(user_stats)
+
+    if not language_counts:
+        return {
+            "username": username,
+            "total_transcriptions": 0,
+            "languages": {},
+            "message": "Nessuna trascrizione completata trovata."
+        }
+
+    total_transcriptions = sum(language_counts.values())
+
+    language_distribution = {
+        lang: round((count / total_transcriptions) * 100, 2)
+        for lang, count in language_counts.items()
+    }
+
+    return {
+        "username": username,
+        "total_transcriptions": total_transcriptions,
+        "languages": language_distribution,
+        "message": "Dati ottenuti con successo"
+    }
+
 @router.get("/users/{username}/total-duration")
 async def get_total_duration(username: str):
-    return get_user_total_duration(username)
-
+    return await run_blocking(get_user_total_duration, username)
 
-def generate_presigned_url(bucket_name: str, object_key: str, expiration: int = 3600):
-    """
-    Genera un URL firmato per accedere a un oggetto S3
-    """
-    try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_REGION", "").replace('"', '')
-        )
-        
-        response = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': object_key},
-            ExpiresIn=expiration
-        )
-        return response
-    except ClientError as e:
-        return None
-    
 @router.get("/users/{username}/recent-activity")
 async def get_recent_activity(username: str):
     """
     Restituisce l'attività degli upload degli ultimi 30 giorni
     """
     try:
-        
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        thirty_days_ago_timestamp = int(thirty_days_ago.timestamp())
-        
-        response = files_table.scan(
-            FilterExpression=Attr("user_id").eq(username) & Attr("upload_time").gte(thirty_days_ago_timestamp)
-        )
-        items = response.get("Items", [])
-        
-        daily_counts = defaultdict(int)
-        
-        for i in range(30):
-            date = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
-            daily_counts[date] = 0
-        
-        for item in items:
-            upload_timestamp = item.get("upload_time")
-            if upload_timestamp:
-                if isinstance(upload_timestamp, Decimal):
-                    upload_timestamp = int(upload_timestamp)
-                
-                upload_date = datetime.fromtimestamp(upload_timestamp).strftime('%Y-%m-%d')
-                daily_counts[upload_date] += 1
-        
-        activity_data = []
-        for i in range(29, -1, -1):  # Dal più vecchio al più recente
-            date = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
-            day_name = (datetime.utcnow() - timedelta(days=i)).strftime('%d/%m')
-            activity_data.append({
-                "date": date,
-                "day": day_name,
-                "uploads": daily_counts[date]
-            })
-        
-        total_uploads_30_days = sum(daily_counts.values())
-        days_with_activity = sum(1 for count in daily_counts.values() if count > 0)
-        
-        return {
-            "username": username,
-            "period_days": 30,
-            "activity_data": activity_data,
-            "total_uploads": total_uploads_30_days,
-            "active_days": days_with_activity,
-            "message": "Dati attività recuperati con successo"
-        }
+        user_stats = await run_blocking(get_user_stats, username)
+        return recent_activity_payload(username, user_stats)
         
     except Exception as e:
         return JSONResponse(
@@ -369,90 +455,111 @@ async def get_recent_activity(username: str):
             content={"message": f"Errore interno al server: {str(e)}"}
         )
 
+def recent_activity_payload(username: str, user_stats: dict) -> dict:
+    daily_counts = get_daily_uploads(user_stats, days=30)
+    
+    activity_data = []
+    for date, uploads in daily_counts.items():  # Dal più vecchio al più recente
+        activity_data.append({
+            "date": date,
+            "day": datetime.strptime(date, '%Y-%m-%d').strftime('%d/%m'),
+            "uploads": uploads
+        })
+    
+    total_uploads_30_days = sum(daily_counts.values())
+    days_with_activity = sum(1 for count in daily_counts.values() if count > 0)
+    
+    return {
+        "username": username,
+        "period_days": 30,
+        "activity_data": activity_data,
+        "total_uploads": total_uploads_30_days,
+        "active_days": days_with_activity,
+        "message": "Dati attività recuperati con successo"
+    }
+
+@router.get("/users/{username}/dashboard")
+async def get_dashboard(
+    username: str,
+    current_user: str = Depends(get_current_username),
+    if_none_match: str = Header(None),
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = Query(None)
+):
+    """
+    Tutti i dati della dashboard in una sola risposta: lista dei file (con URL firmati),
+    durata totale, distribuzione delle lingue e attivita' recente.
+    Le statistiche e la lista dei file vengono lette in parallelo; la risposta ha un
+    ETag calcolato sui dati prima della firma degli URL, e con If-None-Match uguale
+    si risponde 304 senza corpo (e senza firmare)
+    """
+    if current_user != username:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    
+    user_stats, (files_data, next_cursor) = await asyncio.gather(
+        run_blocking(get_user_stats, username),
+        run_blocking(list_uploaded_files, username, limit, cursor)
+    )
+    
+    payload = jsonable_encoder({
+        "username": username,
+        "files": files_data,
+        "next_cursor": next_cursor,
+        "total_duration": get_user_total_duration(username, user_stats),
+        "language_distribution": language_distribution_payload(username, user_stats),
+        "recent_activity": recent_activity_payload(username, user_stats)
+    })
+    
+    # Gli URL firmati cambiano a ogni nuova firma: l'ETag usa solo i dati stabili
+    # e la finestra di riuso degli URL, cosi' un corpo in cache non contiene mai
+    # URL scaduti (a fine finestra l'ETag cambia e il client li riceve nuovi)
+    url_window = int(time.time() // (DASHBOARD_URL_EXPIRATION * PRESIGN_REFRESH_FRACTION))
+    stable = json.dumps({"payload": payload, "url_window": url_window}, sort_keys=True)
+    digest = hashlib.sha256(stable.encode('utf-8')).hexdigest()
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "private, no-cache"}
+    
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    payload["files"] = await run_blocking(sign_file_urls, username, payload["files"])
+    return JSONResponse(content=payload, headers=headers)
+
+@router.post("/files/delete")
+async def delete_files_bulk(
+    data: FilesDelete,
+    username: str = Depends(get_current_username)
+):
+    """
+    Elimina piu' file dell'utente (S3 e DynamoDB) con chiamate batch;
+    restituisce l'esito per ogni file: deleted, not_found o error
+    """
+    try:
+        results = await delete_files(username, data.file_ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error in file deletion: {str(e)}")
+    return {
+        "deleted": sum(1 for result in results if result["status"] == "deleted"),
+        "results": results
+    }
+
 @router.post("/files/{file_id}/delete")
 async def delete_file(
     file_id: str,
-    authorization: str = Header(None)
+    username: str = Depends(get_current_username)
 ):
     """
     Elimina un file specifico dell'utente sia da S3 che da DynamoDB
     """
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    
-    token = authorization.split(" ")[1]
-    username = get_username_from_token(token)
-    
     try:
-        try:
-            response = files_table.get_item(
-                Key={
-                    'user_id': username,
-                    'file_id': file_id
-                }
-            )
-            
-            if 'Item' not in response:
-                raise HTTPException(status_code=404, detail="File not found")
-                
-            file_item = response['Item']
-            filename = file_item.get('filename')
-            
-            if not filename:
-                raise HTTPException(status_code=404, detail="Filename not found in database")
-                
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="Error retrieving file metadata")
-        
-        bucket_name = os.getenv("S3_BUCKET_NAME", "cc-bucket-audio")
-        file_key = f"{username}/{file_id}_{filename}"
-        
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_REGION", "").replace('"', '')
-        )
-        
-        try:
-            s3_client.head_object(Bucket=bucket_name, Key=file_key)
-            s3_client.delete_object(Bucket=bucket_name, Key=file_key)
-            
-        except Exception as e:
-            if hasattr(e, 'response') and e.response.get('Error', {}).get('Code') == '404':
-                pass
-            else:
-                raise HTTPException(status_code=500, detail=f"Error deleting file from S3: {str(e)}")
-        
-        transcription_key = f"{username}/{file_id}.json"
-        try:
-            s3_client.head_object(Bucket=bucket_name, Key=transcription_key)
-            s3_client.delete_object(Bucket=bucket_name, Key=transcription_key)
-        except Exception as e:
-            if hasattr(e, 'response') and e.response.get('Error', {}).get('Code') == '404':
-                pass
-        
-        try:
-            files_table.delete_item(
-                Key={
-                    'user_id': username,
-                    'file_id': file_id
-                }
-            )
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="Error deleting file record from database")
-        
-
-        return {
-            "message": "File deleted successfully",
-            "file_id": file_id,
-            "filename": filename
-        }
-    
-    except HTTPException:
-        raise
+        result, = await delete_files(username, [file_id])
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error in file deletion: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error in file deletion: {str(e)}")
+
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="File not found")
+    if result["status"] == "error":
+        raise HTTPException(status_code=500, detail=f"Error deleting file: {result['error']}")
+    return {
+        "message": "File deleted successfully",
+        "file_id": file_id,
+        "filename": result["filename"]
+    }
@@ -2,4 +2,8 @@
 
 from .user import UserSignup
 from .user import UserVerify 
-from .user import UserSignin
\ No newline at end of file
+from .user import UserSignin
+from .upload import UploadInitiate
+from .upload import UploadComplete
+from .upload import UploadAbort
+from .upload import FilesDelete
\ No newline at end of file
@@ -0,0 +1,26 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+class UploadInitiate(BaseModel):
+    filename: str = Field(min_length=1)
+    size: int = Field(gt=0)
+
+class UploadedPart(BaseModel):
+    part_number: int = Field(ge=1, le=10000)
+    etag: str
+
+class UploadComplete(BaseModel):
+    file_id: str
+    upload_id: str
+    filename: str = Field(min_length=1)
+    parts: List[UploadedPart]
+    sha256: Optional[str] = None
+
+class UploadAbort(BaseModel):
+    file_id: str
+    upload_id: str
+    filename: str = Field(min_length=1)
+
+class FilesDelete(BaseModel):
+    file_ids: List[str] = Field(min_length=1, max_length=1000)
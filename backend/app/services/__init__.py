@@ -2,4 +2,4 @@
 
 from .auth import ServiceAuth
 
-from .llm import ServiceLLM
\ No newline at end of file
+from .llm import ServiceLLM, get_service_llm
\ No newline at end of file
@@ -0,0 +1,224 @@
+##
+
+import io
+import os
+import logging
+import struct
+
+from mutagen import File as MutagenFile
+from mutagen.mp3 import MP3, BitrateMode
+
+logger = logging.getLogger(__name__)
+
+# Byte letti dall'inizio e dalla fine dello stream per il probe della durata.
+# Bastano per gli header di WAV/FLAC/MP3 e per il moov di un MP4 "faststart";
+# i tag ID3v1/APE e il moov in coda stanno nei byte finali.
+PROBE_HEAD_BYTES = int(os.getenv("AUDIO_PROBE_HEAD_BYTES", 256 * 1024))
+PROBE_TAIL_BYTES = int(os.getenv("AUDIO_PROBE_TAIL_BYTES", 128 * 1024))
+
+# Frame MP3 campionati prima di decidere se uno stream senza header Xing/VBRI e' CBR
+MP3_SAMPLE_FRAMES = 64
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+
+class HeaderStream(io.RawIOBase):
+    """
+    Vista in sola lettura di uno stream audio di cui si conoscono solo
+    i primi e gli ultimi byte. Riporta la dimensione reale del file, cosi'
+    mutagen calcola la durata come sul file completo; se mutagen prova a
+    leggere un intervallo non disponibile, `missed` diventa True.
+    """
+
+    def __init__(self, head: bytes, tail: bytes, size: int, name: str = ""):
+        self.head = head
+        self.tail = tail
+        self.size = size
+        self.tail_start = size - len(tail)
+        self.name = name
+        self.missed = False
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        start = self._pos
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        if start >= end:
+            return b""
+
+        if end <= len(self.head):
+            data = self.head[start:end]
+        elif start >= self.tail_start:
+            data = self.tail[start - self.tail_start:end - self.tail_start]
+        else:
+            self.missed = True
+            raise IOError(f"bytes {start}-{end} not available in header probe")
+
+        self._pos = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def probe_audio_duration(fileobj, filename: str) -> float:
+    """
+    Durata in secondi di uno stream audio seekable (io.BytesIO, UploadFile.file, ...)
+    leggendo solo header e coda. Se servono altri byte si ripiega su mutagen
+    sullo stream completo, sempre senza copie su disco.
+    """
+    fileobj.seek(0, io.SEEK_END)
+    size = fileobj.tell()
+    if size == 0:
+        return 0.0
+
+    tag_size = _id3v2_size(fileobj)
+    head_size = PROBE_HEAD_BYTES + tag_size
+    fileobj.seek(0)
+    head = fileobj.read(head_size)
+    tail = b""
+    if size > len(head):
+        tail_size = min(PROBE_TAIL_BYTES, size - len(head))
+        fileobj.seek(size - tail_size)
+        tail = fileobj.read(tail_size)
+
+    view = HeaderStream(head, tail, size, name=filename)
+    audio_file = _load(view)
+    if audio_file is None and view.missed:
+        logger.info(f"Header di {filename} incompleto, probe sullo stream completo")
+        fileobj.seek(0)
+        audio_file = _load(fileobj)
+
+    if audio_file is None or not hasattr(audio_file, 'info'):
+        return 0.0
+
+    duration = float(audio_file.info.length)
+    if isinstance(audio_file, MP3) and audio_file.info.bitrate_mode == BitrateMode.UNKNOWN:
+        scanned = scan_mp3_duration(fileobj, tag_size)
+        if scanned is not None:
+            duration = scanned
+    return duration
+
+
+def _load(fileobj):
+    try:
+        return MutagenFile(fileobj)
+    except Exception as e:
+        logger.debug(f"mutagen non riesce a leggere lo stream: {e}")
+        return None
+
+
+def _id3v2_size(fileobj) -> int:
+    """ Dimensione del tag ID3v2 iniziale (0 se assente) """
+    fileobj.seek(0)
+    header = fileobj.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _parse_mp3_frame_header(header: bytes):
+    """ Restituisce (lunghezza frame, campioni, sample rate, bitrate) o None se non valido """
+    if len(header) < 4:
+        return None
+    value = struct.unpack(">I", header)[0]
+    if (value >> 21) & 0x7FF != 0x7FF:
+        return None
+
+    version = {0: 2.5, 2: 2, 3: 1}.get((value >> 19) & 0x3)
+    layer = {1: 3, 2: 2, 3: 1}.get((value >> 17) & 0x3)
+    bitrate_index = (value >> 12) & 0xF
+    sample_rate_index = (value >> 10) & 0x3
+    padding = (value >> 9) & 0x1
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return length, samples, sample_rate, bitrate
+
+
+def scan_mp3_duration(fileobj, start: int = 0):
+    """
+    Durata di un MP3 senza header Xing/VBRI sommando i campioni dei frame.
+    Legge solo i 4 byte di header di ciascun frame e salta il resto; se i primi
+    frame hanno tutti lo stesso bitrate lo stream e' trattato come CBR e
+    restituisce None (la stima di mutagen e' gia' corretta).
+    """
+    fileobj.seek(start)
+    window = fileobj.read(64 * 1024)
+    sync = next(
+        (i for i in range(len(window) - 3)
+         if _parse_mp3_frame_header(window[i:i + 4]) is not None),
+        None,
+    )
+    if sync is None:
+        return None
+
+    position = start + sync
+    bitrates = set()
+    frames = 0
+    total_samples = 0
+    sample_rate = None
+
+    while True:
+        fileobj.seek(position)
+        frame = _parse_mp3_frame_header(fileobj.read(4))
+        if frame is None:
+            break
+        length, samples, sample_rate, bitrate = frame
+        total_samples += samples
+        frames += 1
+        position += length
+
+        if frames <= MP3_SAMPLE_FRAMES:
+            bitrates.add(bitrate)
+            if frames == MP3_SAMPLE_FRAMES and len(bitrates) == 1:
+                return None
+
+    if not frames or (frames <= MP3_SAMPLE_FRAMES and len(bitrates) == 1):
+        return None
+    return total_samples / sample_rate
@@ -3,21 +3,23 @@
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 import botocore
-import boto3
-import os
 
 from ..controllers.cognito import AWSCognito
 from ..models.user import UserSignup, UserVerify, UserSignin
+from .tables import USERS_TABLE
+from ..utils.aws import get_table
+from ..utils.concurrency import run_blocking
 
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv("AWS_REGION", "").replace('"', ''))
-users_table = dynamodb.Table('users')
+users_table = get_table(USERS_TABLE)
 
 class ServiceAuth:
-    def signup(user: UserSignup, cognito: AWSCognito):
+    async def signup(user: UserSignup, cognito: AWSCognito):
+        # Le chiamate AWS girano nel pool di thread; la scrittura del profilo
+        # dipende dall'esito di sign_up, quindi le due non si sovrappongono
         try:
-            response = cognito.sign_up(user)
+            response = await run_blocking(cognito.sign_up, user)
             if response['ResponseMetadata']['HTTPStatusCode'] == 200:
-                users_table.put_item(Item={
+                await run_blocking(users_table.put_item, Item={
                     "username": user.username,
                     "email": user.email,
                     "first_name": user.first_name,
@@ -53,9 +55,9 @@ class ServiceAuth:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
     
-    def verify_account(data: UserVerify, cognito: AWSCognito):
+    async def verify_account(data: UserVerify, cognito: AWSCognito):
         try:
-            response = cognito.verify_account(data.username, data.confirmation_code)
+            response = await run_blocking(cognito.verify_account, data.username, data.confirmation_code)
             
             if response['ResponseMetadata']['HTTPStatusCode'] == 200:
                 content = {
@@ -68,9 +70,9 @@ class ServiceAuth:
         except Exception as e:
             raise HTTPException(status_code=400, detail=str(e))
     
-    def signin(data: UserSignin, cognito: AWSCognito):
+    async def signin(data: UserSignin, cognito: AWSCognito):
         try:
-            response = cognito.sign_in(data.username, data.password)
+            response = await run_blocking(cognito.sign_in, data.username, data.password)
             
             if 'AuthenticationResult' in response:
                 content = {
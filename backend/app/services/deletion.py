@@ -0,0 +1,150 @@
+##
+
+import os
+import asyncio
+import logging
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from . import stats
+from .file import bucket_name, output_bucket, file_object_key, objects_in_use
+from .llm import ServiceLLM, invalidate_saved_summary
+from .presign import invalidate_presigned_url
+from .tables import FILES_TABLE
+from .transcripts import invalidate_transcript
+from ..utils.aws import get_client, get_resource, get_table
+from ..utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+summaries_bucket = os.getenv("S3_SUMMARIES_BUCKET")
+
+# Limiti delle API batch
+S3_DELETE_BATCH = 1000
+DYNAMODB_GET_BATCH = 100
+
+s3 = get_client('s3')
+files_table = get_table(FILES_TABLE)
+
+
+def load_items(username: str, file_ids: list) -> dict:
+    """ Item dei file richiesti (file_id -> item) con batch_get_item, 100 chiavi per chiamata """
+    dynamodb = get_resource('dynamodb')
+    items = {}
+    for start in range(0, len(file_ids), DYNAMODB_GET_BATCH):
+        request = {FILES_TABLE: {'Keys': [
+            {'user_id': username, 'file_id': file_id} for file_id in file_ids[start:start + DYNAMODB_GET_BATCH]
+        ]}}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(FILES_TABLE, []):
+                items[item['file_id']] = item
+            request = response.get('UnprocessedKeys')
+    return items
+
+
+def delete_objects(bucket: str, keys: list) -> dict:
+    """
+    Cancella le chiavi con delete_objects (1000 per chiamata).
+    Restituisce le chiavi non cancellate con il codice d'errore.
+    """
+    errors = {}
+    for start in range(0, len(keys), S3_DELETE_BATCH):
+        batch = keys[start:start + S3_DELETE_BATCH]
+        try:
+            response = s3.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except ClientError as e:
+            logger.error(f"Error deleting {len(batch)} objects from {bucket}: {str(e)}")
+            errors.update({key: e.response['Error']['Code'] for key in batch})
+            continue
+        for error in response.get('Errors', []):
+            errors[error['Key']] = error.get('Code', 'Error')
+    return errors
+
+
+def delete_items(username: str, file_ids: list):
+    # batch_writer raggruppa le delete a 25 per batch_write_item e ritenta gli UnprocessedItems
+    with files_table.batch_writer() as batch:
+        for file_id in file_ids:
+            batch.delete_item(Key={'user_id': username, 'file_id': file_id})
+
+
+async def shared_audio_keys(username: str, items: list) -> set:
+    """ Chiavi audio ancora usate da duplicati che non fanno parte della cancellazione """
+    deleting = {item['file_id'] for item in items}
+    hashes = {item['hash'] for item in items if item.get('hash')}
+    in_use = await asyncio.gather(*(
+        run_blocking(objects_in_use, username, sha256_hash, deleting) for sha256_hash in hashes
+    ))
+    return set().union(*in_use)
+
+
+async def delete_files(username: str, file_ids: list) -> list:
+    """
+    Cancella piu' file dell'utente: audio, trascrizioni e riassunti con
+    delete_objects (i tre bucket in parallelo), poi gli item con
+    batch_write_item. Un file il cui oggetto non si riesce a cancellare
+    resta in tabella, cosi' la cancellazione si puo' ripetere.
+    Restituisce un risultato per file, nell'ordine richiesto.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    items = await run_blocking(load_items, username, file_ids)
+    found = [items[file_id] for file_id in file_ids if file_id in items]
+
+    shared = await shared_audio_keys(username, found)
+    objects = {file_id: [] for file_id in items}
+    keys = {bucket: [] for bucket in (bucket_name, output_bucket, summaries_bucket) if bucket}
+    for item in found:
+        file_id = item['file_id']
+        audio_key = file_object_key(username, item)
+        owned = [(output_bucket, f"{username}/{file_id}.json")]
+        if summaries_bucket:
+            owned.append((summaries_bucket, ServiceLLM.summary_key(username, file_id)))
+        # L'audio condiviso con dei duplicati resta finche' qualcuno lo usa
+        if audio_key not in shared:
+            owned.append((bucket_name, audio_key))
+        for bucket, key in owned:
+            keys[bucket].append(key)
+            objects[file_id].append((bucket, key))
+
+    buckets = [bucket for bucket in keys if keys[bucket]]
+    failures = await asyncio.gather(*(run_blocking(delete_objects, bucket, keys[bucket]) for bucket in buckets))
+    errors = dict(zip(buckets, failures))
+
+    results = {}
+    deleted = []
+    for item in found:
+        file_id = item['file_id']
+        failed = [f"{bucket}/{key}: {errors[bucket][key]}" for bucket, key in objects[file_id]
+                  if key in errors.get(bucket, {})]
+        if failed:
+            results[file_id] = {"file_id": file_id, "status": "error", "error": "; ".join(failed)}
+        else:
+            deleted.append(item)
+
+    try:
+        await run_blocking(delete_items, username, [item['file_id'] for item in deleted])
+    except ClientError as e:
+        logger.error(f"Error deleting file records of {username}: {str(e)}")
+        for item in deleted:
+            results[item['file_id']] = {"file_id": item['file_id'], "status": "error",
+                                        "error": "Error deleting file record from database"}
+        deleted = []
+
+    for item in deleted:
+        file_id = item['file_id']
+        invalidate_transcript(output_bucket, f"{username}/{file_id}.json")
+        invalidate_saved_summary(summaries_bucket, ServiceLLM.summary_key(username, file_id))
+        invalidate_presigned_url(bucket_name, file_object_key(username, item))
+        results[file_id] = {"file_id": file_id, "status": "deleted", "filename": item.get('filename')}
+    if deleted:
+        await run_blocking(stats.record_deletes, username, deleted)
+
+    logger.info(f"Deleted {len(deleted)}/{len(file_ids)} files of {username}")
+    return [results.get(file_id, {"file_id": file_id, "status": "not_found"}) for file_id in file_ids]
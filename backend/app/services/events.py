@@ -0,0 +1,171 @@
+##
+
+import os
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+from ..utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Ogni quanto il watcher di un file ricontrolla lo stato se non arrivano notifiche
+STATUS_WATCH_INTERVAL = float(os.getenv("STATUS_WATCH_INTERVAL", 5))
+
+# Dopo uno di questi stati non arrivano altri cambi: watcher e stream si chiudono
+FINAL_STATES = ('COMPLETED', 'FAILED', 'ERROR')
+
+
+class InMemoryNotifier:
+    """
+    Bus in-process delle notifiche di cambio stato dei file: prende il posto
+    di EventBridge/SNS in locale e nei test. I listener ricevono
+    (username, file_id, status) e vengono chiamati anche da thread del pool AWS.
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def publish(self, username: str, file_id: str, *args):
+        for listener in list(self.listeners):
+            try:
+                listener(username, file_id, *args)
+            except Exception as e:
+                logger.error(f"Error notifying status of {file_id}: {str(e)}")
+
+
+notifier = InMemoryNotifier()
+# Solo i passaggi a COMPLETED: i listener ricevono (username, file_id, transcription)
+# con il testo se chi completa il file lo ha gia' in memoria, altrimenti None
+completion_notifier = InMemoryNotifier()
+
+
+def publish_status_change(username: str, file_id: str, status: str):
+    notifier.publish(username, file_id, status)
+
+
+def publish_completion(username: str, file_id: str, transcription: str = None):
+    completion_notifier.publish(username, file_id, transcription)
+
+
+def is_final(event: dict) -> bool:
+    return event.get('status') in FINAL_STATES
+
+
+class _Watch:
+    def __init__(self):
+        self.queues = set()
+        self.wake = asyncio.Event()
+        self.last = None
+        self.task = None
+
+
+class StatusBroker:
+    """
+    Pub/sub dello stato della trascrizione per file: tutti i client in attesa
+    sullo stesso file condividono un solo watcher, che esegue `check` quando
+    arriva una notifica (o ogni `interval` secondi) e inoltra i risultati.
+    """
+
+    def __init__(self, check, notifier: InMemoryNotifier = notifier, interval: float = STATUS_WATCH_INTERVAL):
+        self.check = check
+        self.interval = interval
+        self._watches = {}
+        self._loop = None
+        notifier.subscribe(self.notify)
+
+    def notify(self, username: str, file_id: str, status: str = None):
+        # Chiamato da qualsiasi thread: il risveglio avviene sul loop dei watcher
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        key = (username, file_id)
+        if key in self._watches:
+            loop.call_soon_threadsafe(self._wake, key)
+
+    def _wake(self, key):
+        watch = self._watches.get(key)
+        if watch is not None:
+            watch.wake.set()
+
+    def subscribe(self, username: str, file_id: str) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        key = (username, file_id)
+        watch = self._watches.get(key)
+        if watch is None:
+            watch = self._watches[key] = _Watch()
+            watch.task = asyncio.create_task(self._run(key, watch))
+
+        queue = asyncio.Queue()
+        watch.queues.add(queue)
+        if watch.last is not None:
+            queue.put_nowait(watch.last)
+        return queue
+
+    def unsubscribe(self, username: str, file_id: str, queue: asyncio.Queue):
+        watch = self._watches.get((username, file_id))
+        if watch is None:
+            return
+        watch.queues.discard(queue)
+        if not watch.queues:
+            # Nessuno in attesa: il watcher si ferma al prossimo giro
+            watch.wake.set()
+
+    async def wait(self, username: str, file_id: str, since: str = None, timeout: float = 25) -> dict:
+        """
+        Long-poll: primo stato diverso da `since` (o finale) entro `timeout`
+        secondi, altrimenti l'ultimo stato noto (None se non ancora controllato)
+        """
+        queue = self.subscribe(username, file_id)
+        event = None
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return event
+                try:
+                    event = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return event
+                if is_final(event) or event.get('status') != since:
+                    return event
+        finally:
+            self.unsubscribe(username, file_id, queue)
+
+    async def _run(self, key, watch: _Watch):
+        username, file_id = key
+        try:
+            while watch.queues:
+                watch.wake.clear()
+                try:
+                    event = await run_blocking(self.check, username, file_id)
+                except Exception as e:
+                    logger.error(f"Error checking status of {file_id}: {str(e)}")
+                    event = {"status": "ERROR", "message": f"Error checking status: {str(e)}"}
+
+                if event != watch.last:
+                    watch.last = event
+                    for queue in list(watch.queues):
+                        queue.put_nowait(event)
+                if is_final(event):
+                    break
+
+                try:
+                    await asyncio.wait_for(watch.wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._watches.get(key) is watch:
+                del self._watches[key]
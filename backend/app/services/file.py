@@ -12,13 +12,15 @@ import hashlib
 import time
 import mimetypes
 import io
-import tempfile
+import base64
 from decimal import Decimal
-from mutagen import File as MutagenFile
-from mutagen.mp3 import MP3
-from mutagen.wave import WAVE
-from mutagen.flac import FLAC
-from mutagen.mp4 import MP4
+from .audio import probe_audio_duration
+from . import stats
+from .events import publish_status_change, publish_completion
+from .transcripts import get_transcript
+from .tables import FILES_TABLE, HASH_INDEX, query_all
+from ..utils.aws import get_client, get_table
+from ..utils.concurrency import run_blocking
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,15 +30,11 @@ load_dotenv()
 aws_region = os.getenv("AWS_REGION", "").replace('"', '')
 bucket_name = os.getenv("S3_BUCKET_NAME", "").replace('"', '')
 output_bucket = os.getenv("S3_OUTPUT_BUCKET", "cc-transcribe-output")
-dynamodb = boto3.resource('dynamodb', region_name=os.getenv("AWS_REGION", "").replace('"', ''))
-files_table = dynamodb.Table('files')
+# Dimensione dei blocchi di upload (S3 richiede almeno 5 MiB per parte, tranne l'ultima)
+upload_chunk_size = max(int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+files_table = get_table(FILES_TABLE)
+s3 = get_client('s3')
 try:
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=aws_region
-    )
     s3.head_bucket(Bucket=bucket_name)
     logger.info(f"Connection to S3 established, bucket '{bucket_name}' accessible")
 except Exception as e:
@@ -47,38 +45,24 @@ except Exception as e:
 async def save_file(file, username):
     file_id = str(uuid4())
     file_key = f"{username}/{file_id}_{file.filename}"
-    extension = os.path.splitext(file.filename)[-1].lower()
-    upload_time = int(time.time())
-    file_bytes = await file.read()
-    file.file.seek(0)  
-    sha256_hash = hashlib.sha256(file_bytes).hexdigest()
-    duration_seconds = 0
-    duration_seconds = get_audio_duration(file_bytes, file.filename)
 
-    try:
-        s3.upload_fileobj(
-            file.file,
-            bucket_name,
-            file_key,
-        )
+    duration_seconds = await run_blocking(get_audio_duration, file.file, file.filename)
 
-        file_url = f"https://{bucket_name}.s3.{aws_region}.amazonaws.com/{file_key}"
+    try:
+        # L'hash si calcola durante l'upload (una sola lettura del file)
+        sha256_hash = await stream_to_s3(file, bucket_name, file_key)
         logger.info(f"File uploaded successfully: {file_key}")
 
-        response=files_table.put_item(Item={
-            'user_id': username,
-            'file_id': file_id,
-            'filename': file.filename,  
-            'extension': extension,
-            'upload_time': upload_time,
-            'hash': sha256_hash,
-            'duration': int(duration_seconds) if duration_seconds > 0 else None,
-            'status': 'PENDING',
-            'url': file_url  
-
-        })
-        logger.info(f"File metadata saved to DynamoDB: {response}")
-        return {"filename": file.filename, "id": file_id, "url": file_url}
+        # Lo stesso contenuto gia' caricato dall'utente: si tiene l'oggetto esistente
+        original = await run_blocking(find_original, username, sha256_hash)
+        if original:
+            await run_blocking(s3.delete_object, Bucket=bucket_name, Key=file_key)
+            return await save_duplicate(file.filename, username, original, sha256_hash)
+
+        return await register_file(username, file_id, file.filename, file_key, sha256_hash, duration_seconds)
+
+    except HTTPException:
+        raise
     
     except NoCredentialsError:
         logger.error("Invalid or missing AWS credentials")
@@ -103,19 +87,270 @@ async def save_file(file, username):
         raise HTTPException(status_code=500, 
             detail=f"Error loading file: {str(e)}")
 
-def list_uploaded_files(username):
+async def register_file(username: str, file_id: str, filename: str, file_key: str,
+                        sha256_hash: str, duration_seconds: float) -> dict:
     """
-    Lista i file caricati da un utente leggendo da DynamoDB
-    per ottenere tutti i metadati incluso lo status
+    Salva in DynamoDB i metadati di un file appena caricato su S3
+    """
+    upload_time = int(time.time())
+    file_url = f"https://{bucket_name}.s3.{aws_region}.amazonaws.com/{file_key}"
+
+    item = {
+        'user_id': username,
+        'file_id': file_id,
+        'filename': filename,
+        'extension': os.path.splitext(filename)[-1].lower(),
+        'upload_time': upload_time,
+        'duration': int(duration_seconds) if duration_seconds > 0 else None,
+        'status': 'PENDING',
+        'url': file_url
+    }
+    # Senza hash (upload diretto senza sha256 dal client) il file resta fuori dall'indice
+    if sha256_hash:
+        item['hash'] = sha256_hash
+
+    response = await run_blocking(files_table.put_item, Item=item)
+    logger.info(f"File metadata saved to DynamoDB: {response}")
+    await run_blocking(stats.record_upload, username, upload_time)
+    return {"filename": filename, "id": file_id, "url": file_url}
+
+def file_object_key(username: str, item: dict) -> str:
+    """
+    Chiave S3 dell'audio di un file: i duplicati puntano all'oggetto dell'originale
+    """
+    return item.get('s3_key') or f"{username}/{item['file_id']}_{item['filename']}"
+
+def find_original(username: str, sha256_hash: str) -> dict:
+    """
+    File dell'utente con lo stesso contenuto (hash), preferendo uno gia' trascritto;
+    None se il contenuto e' nuovo o se l'indice non e' interrogabile
+    (es. GSI in creazione): in quel caso il file si salva come nuovo
+    """
+    try:
+        items = query_all(
+            files_table,
+            IndexName=HASH_INDEX,
+            KeyConditionExpression=(
+                boto3.dynamodb.conditions.Key('user_id').eq(username)
+                & boto3.dynamodb.conditions.Key('hash').eq(sha256_hash)
+            ),
+        )
+    except ClientError as e:
+        logger.warning(f"Duplicate lookup on {HASH_INDEX} failed, treating upload as new: {str(e)}")
+        return None
+    if not items:
+        return None
+    completed = [item for item in items if item.get('status') == 'COMPLETED']
+    return (completed or items)[0]
+
+async def save_duplicate(filename: str, username: str, original: dict, sha256_hash: str) -> dict:
+    """
+    Registra un nuovo file che riusa l'oggetto S3 di `original`; se l'originale
+    e' gia' trascritto, trascrizione e riassunto vengono copiati senza nuovi job
+    """
+    file_id = str(uuid4())
+    upload_time = int(time.time())
+    file_key = file_object_key(username, original)
+    file_url = original.get('url') or f"https://{bucket_name}.s3.{aws_region}.amazonaws.com/{file_key}"
+
+    item = {
+        'user_id': username,
+        'file_id': file_id,
+        'filename': filename,
+        'extension': os.path.splitext(filename)[-1].lower(),
+        'upload_time': upload_time,
+        'hash': sha256_hash,
+        'duration': original.get('duration'),
+        'status': 'PENDING',
+        'url': file_url,
+        's3_key': file_key,
+        'origin_file_id': original['file_id'],
+    }
+    try:
+        await run_blocking(files_table.put_item, Item=item)
+    except ClientError as e:
+        logger.error(f"Error saving duplicate of {original['file_id']}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error loading file: {str(e)}")
+    logger.info(f"File {file_id} is a duplicate of {original['file_id']}, S3 object reused")
+    await run_blocking(stats.record_upload, username, upload_time)
+
+    status = item['status']
+    if original.get('status') == 'COMPLETED' and await run_blocking(reuse_original_results, username, file_id, original):
+        status = 'COMPLETED'
+
+    return {"filename": filename, "id": file_id, "url": file_url, "status": status, "origin_file_id": original['file_id']}
+
+def reuse_original_results(username: str, file_id: str, original: dict) -> bool:
+    """
+    Copia (lato S3) trascrizione e riassunto di `original` sul file duplicato e
+    lo porta in COMPLETED. False se la trascrizione dell'originale non esiste.
+    """
+    output_bucket = os.getenv("S3_OUTPUT_BUCKET", "cc-transcribe-output")
+    summaries_bucket = os.getenv("S3_SUMMARIES_BUCKET")
+    original_id = original['file_id']
+
+    try:
+        s3.copy_object(
+            Bucket=output_bucket,
+            Key=f"{username}/{file_id}.json",
+            CopySource={'Bucket': output_bucket, 'Key': f"{username}/{original_id}.json"},
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return False
+        raise
+
+    if summaries_bucket:
+        try:
+            s3.copy_object(
+                Bucket=summaries_bucket,
+                Key=f"{username}/{file_id}_summary.txt",
+                CopySource={'Bucket': summaries_bucket, 'Key': f"{username}/{original_id}_summary.txt"},
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                logger.warning(f"Error copying summary of {original_id}: {str(e)}")
+
+    if original.get('language'):
+        save_file_language(username, file_id, original['language'])
+    update_file_status(username, file_id, 'COMPLETED')
+    logger.info(f"Transcription of {original_id} reused for {file_id}")
+    return True
+
+def objects_in_use(username: str, sha256_hash: str, excluding=()) -> set:
+    """ Chiavi S3 usate dai file dell'utente con questo hash, esclusi i file_id in `excluding` """
+    others = query_all(
+        files_table,
+        IndexName=HASH_INDEX,
+        KeyConditionExpression=(
+            boto3.dynamodb.conditions.Key('user_id').eq(username)
+            & boto3.dynamodb.conditions.Key('hash').eq(sha256_hash)
+        ),
+    )
+    return {file_object_key(username, other) for other in others if other['file_id'] not in excluding}
+
+def object_shared(username: str, item: dict) -> bool:
+    """ True se l'oggetto S3 del file e' usato anche da altri file dell'utente """
+    if not item.get('hash'):
+        return False
+    return file_object_key(username, item) in objects_in_use(username, item['hash'], {item['file_id']})
+
+async def read_chunks(file, chunk_size: int = None):
+    """
+    Legge un UploadFile a blocchi di dimensione fissa (l'ultimo puo' essere piu' corto)
+    """
+    chunk_size = chunk_size or upload_chunk_size
+    buffer = bytearray()
+    while True:
+        data = await file.read(chunk_size - len(buffer))
+        if not data:
+            break
+        buffer += data
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+async def stream_to_s3(file, bucket: str, key: str, chunk_size: int = None) -> str:
+    """
+    Carica un UploadFile su S3 in un solo passaggio, a blocchi, calcolando lo SHA-256
+    in modo incrementale. La memoria occupata e' limitata a un blocco per upload.
+    Restituisce l'hash esadecimale del contenuto.
     """
+    chunk_size = chunk_size or upload_chunk_size
+    sha256 = hashlib.sha256()
+    chunks = read_chunks(file, chunk_size)
+    first = await anext(chunks, b"")
+    sha256.update(first)
+
+    if len(first) < chunk_size:
+        # Il file sta in un solo blocco: niente multipart
+        await run_blocking(s3.put_object, Bucket=bucket, Key=key, Body=first)
+        return sha256.hexdigest()
+
+    upload_id = (await run_blocking(s3.create_multipart_upload, Bucket=bucket, Key=key))['UploadId']
+    parts = []
     try:
-        response = files_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('user_id').eq(username),
-            ScanIndexForward=False  
+        chunk = first
+        while chunk:
+            part_number = len(parts) + 1
+            part = await run_blocking(
+                s3.upload_part,
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=chunk,
+            )
+            parts.append({'ETag': part['ETag'], 'PartNumber': part_number})
+            chunk = await anext(chunks, b"")
+            sha256.update(chunk)
+
+        await run_blocking(
+            s3.complete_multipart_upload,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts},
         )
+    except BaseException:
+        try:
+            await run_blocking(s3.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as abort_error:
+            logger.warning(f"Impossibile annullare il multipart upload {upload_id}: {abort_error}")
+        raise
+
+    return sha256.hexdigest()
+
+# Attributi letti per la lista dei file (ProjectionExpression)
+FILE_LIST_ATTRIBUTES = ['file_id', 'filename', 'status', 'upload_time', 'extension', 'duration', 'url', 'summary_status']
+
+def encode_cursor(last_evaluated_key: dict) -> str:
+    """ Cursore opaco a partire dal LastEvaluatedKey di DynamoDB """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=lambda v: int(v) if v % 1 == 0 else float(v))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    """ ExclusiveStartKey di DynamoDB a partire da un cursore """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def list_uploaded_files(username, limit: int = None, cursor: str = None):
+    """
+    Lista i file caricati da un utente leggendo da DynamoDB
+    per ottenere tutti i metadati incluso lo status.
+    Con `limit` restituisce una sola pagina; la seconda componente
+    del risultato e' il cursore della pagina successiva (None se finita)
+    """
+    query_args = {
+        'KeyConditionExpression': boto3.dynamodb.conditions.Key('user_id').eq(username),
+        'ScanIndexForward': False,
+        'ProjectionExpression': ', '.join(f"#{name}" for name in FILE_LIST_ATTRIBUTES),
+        'ExpressionAttributeNames': {f"#{name}": name for name in FILE_LIST_ATTRIBUTES},
+    }
+    if cursor:
+        start_key = decode_cursor(cursor)
+        if start_key.get('user_id') != username:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query_args['ExclusiveStartKey'] = start_key
+
+    try:
+        next_cursor = None
+        if limit:
+            response = files_table.query(Limit=limit, **query_args)
+            items = response.get('Items', [])
+            next_cursor = encode_cursor(response.get('LastEvaluatedKey'))
+        else:
+            items = query_all(files_table, **query_args)
         
         files = []
-        for item in response.get('Items', []):
+        for item in items:
             file_data = {
                 "id": item['file_id'],
                 "filename": item.get('filename', 'Unknown'),
@@ -123,12 +358,13 @@ def list_uploaded_files(username):
                 "upload_time": item.get('upload_time'),
                 "extension": item.get('extension', ''),
                 "duration": item.get('duration'),
-                "url": item.get('url')
+                "url": item.get('url'),
+                "summary_status": item.get('summary_status')
             }
             files.append(file_data)
         
         logger.info(f"Retrieved {len(files)} files for user {username}")
-        return files
+        return files, next_cursor
         
     except Exception as e:
         logger.error(f"Error retrieving files from DynamoDB: {str(e)}")
@@ -144,50 +380,47 @@ def update_file_status(username: str, file_id: str, status: str, duration: int =
         expression_attribute_values = {":status": status}
         
         if duration is not None:
-            update_expression += ", duration = :duration"
+            update_expression += ", #duration = :duration"
+            expression_attribute_names["#duration"] = "duration"
             expression_attribute_values[":duration"] = duration
         
-        files_table.update_item(
+        response = files_table.update_item(
             Key={
                 'user_id': username,
                 'file_id': file_id
             },
             UpdateExpression=update_expression,
             ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues='ALL_OLD'
         )
         logger.info(f"Updated file {file_id} status to {status}")
         
+        old_item = response.get('Attributes', {})
+        new_item = {**old_item, 'status': status}
+        if duration is not None:
+            new_item['duration'] = duration
+        stats.record_status_change(username, old_item, new_item)
+        publish_status_change(username, file_id, status)
+        if status == 'COMPLETED' and old_item and old_item.get('status') != 'COMPLETED':
+            publish_completion(username, file_id)
+        
     except Exception as e:
         logger.error(f"Error updating file status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating file status: {str(e)}")
 
 def get_file_transcription(file_id: str, username: str):
-    """ Recupera la trascrizione di un file da S3 e aggiorna i metadati in DynamoDB """
+    """ Recupera la trascrizione di un file (da S3 o dalla cache) e salva la lingua in DynamoDB """
 
     output_bucket = os.getenv("S3_OUTPUT_BUCKET", "cc-transcribe-output")
     key = f"{username}/{file_id}.json"
     
     try:
-        response = s3.get_object(Bucket=output_bucket, Key=key)
-        content = response['Body'].read().decode('utf-8')
-        transcription_data = json.loads(content)
+        transcript, language, cached = get_transcript(output_bucket, key)
         
-        language = transcription_data.get('results', {}).get('language_code', 'und')
-        transcript = ""
-        if 'results' in transcription_data and 'transcripts' in transcription_data['results']:
-            transcript = transcription_data['results']['transcripts'][0].get('transcript', '')
-        
-        files_table.update_item(
-            Key={
-                'user_id': username,
-                'file_id': file_id
-            },
-            UpdateExpression="SET #lang = :language",
-            ExpressionAttributeNames={"#lang": "language"},
-            ExpressionAttributeValues={":language": language}
-        )
-        logger.info(f"Lingua rilevata salvata: {language} per file {file_id}")
+        # La lingua si scrive solo quando l'output e' nuovo e solo se cambia
+        if not cached:
+            save_file_language(username, file_id, language)
         
         return {
             "transcription": transcript,
@@ -206,6 +439,47 @@ def get_file_transcription(file_id: str, username: str):
             "file_id": file_id
         }
 
+def set_summary_status(username: str, file_id: str, status: str):
+    """ Stato del riassunto sull'item del file (PENDING, COMPLETED, FAILED) """
+    try:
+        files_table.update_item(
+            Key={'user_id': username, 'file_id': file_id},
+            UpdateExpression="SET summary_status = :status",
+            ConditionExpression="attribute_exists(file_id)",
+            ExpressionAttributeValues={":status": status}
+        )
+    except ClientError as e:
+        # File cancellato nel frattempo
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+def get_completed_transcription(file_id: str, username: str) -> str:
+    """ Testo della trascrizione completata (None se non ancora disponibile) """
+    transcription_data = get_file_transcription(file_id, username)
+    if transcription_data and transcription_data.get("status") == "COMPLETED":
+        return transcription_data.get("transcription")
+    return None
+
+def save_file_language(username: str, file_id: str, language: str):
+    try:
+        update = files_table.update_item(
+            Key={
+                'user_id': username,
+                'file_id': file_id
+            },
+            UpdateExpression="SET #lang = :language",
+            ConditionExpression="attribute_exists(file_id) AND (attribute_not_exists(#lang) OR #lang <> :language)",
+            ExpressionAttributeNames={"#lang": "language"},
+            ExpressionAttributeValues={":language": language},
+            ReturnValues='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return
+        raise
+    logger.info(f"Lingua rilevata salvata: {language} per file {file_id}")
+    stats.record_language_change(username, update.get('Attributes', {}), language)
+
 async def save_transcription_result(file_id: str, username: str, transcription: str, detected_language: str = None):
     """
     Salva il risultato della trascrizione e aggiorna i metadati
@@ -219,72 +493,59 @@ async def save_transcription_result(file_id: str, username: str, transcription:
             update_expression += ", detected_language = :lang"
             expression_attribute_values[":lang"] = detected_language
         
-        files_table.update_item(
+        response = await run_blocking(
+            files_table.update_item,
             Key={'user_id': username, 'file_id': file_id},
             UpdateExpression=update_expression,
             ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues='ALL_OLD'
         )
         
         logger.info(f"Transcription result saved for file {file_id}")
         
+        old_item = response.get('Attributes', {})
+        await run_blocking(stats.record_status_change, username, old_item, {**old_item, 'status': 'COMPLETED'})
+        publish_status_change(username, file_id, 'COMPLETED')
+        if old_item.get('status') != 'COMPLETED':
+            publish_completion(username, file_id, transcription)
+        
     except Exception as e:
         logger.error(f"Error saving transcription result: {str(e)}")
         raise
 
-def get_audio_duration(file_bytes: bytes, filename: str) -> float:
+def get_audio_duration(fileobj, filename: str) -> float:
     """
-    Calcola la durata di un file audio in secondi
+    Calcola la durata di un file audio in secondi leggendo solo
+    gli header dallo stream (seekable) dell'upload
     """
-    temp_file_path = None
     try:
-        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as temp_file:
-            temp_file.write(file_bytes)
-            temp_file.flush()
-            temp_file_path = temp_file.name
-        
-        audio_file = MutagenFile(temp_file_path)
+        duration = probe_audio_duration(fileobj, filename)
         
-        if audio_file is not None and hasattr(audio_file, 'info'):
-            duration = float(audio_file.info.length)
+        if duration > 0:
             logger.info(f"Durata rilevata per {filename}: {duration:.2f} secondi")
-            return duration
         else:
             logger.warning(f"Impossibile rilevare la durata per {filename}")
-            return 0.0
+        return duration
                 
     except Exception as e:
         logger.error(f"Errore nel calcolo della durata per {filename}: {str(e)}")
         return 0.0
     finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except Exception as cleanup_error:
-                logger.warning(f"Impossibile eliminare file temporaneo {temp_file_path}: {cleanup_error}")
+        fileobj.seek(0)
 
-def get_user_total_duration(username: str) -> dict:
+def get_user_total_duration(username: str, user_stats: dict = None) -> dict:
     """
     Calcola la durata totale di tutti i file audio di un utente
     e restituisce la data di trascrizione dell'ultimo audio
     """
     try:
-        response = files_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('user_id').eq(username)
-        )
-        
-        total_seconds = 0
-        audio_files_count = 0
-        latest_upload_time = 0
+        if user_stats is None:
+            user_stats = stats.get_user_stats(username)
         
-        for item in response.get('Items', []):
-            if item.get('duration') and item.get('status') == 'COMPLETED':
-                total_seconds += int(item['duration'])
-                audio_files_count += 1
-                
-                upload_time = int(item.get('upload_time', 0))
-                if upload_time > latest_upload_time:
-                    latest_upload_time = upload_time
+        total_seconds = int(user_stats.get('total_seconds', 0))
+        audio_files_count = int(user_stats.get('audio_files_count', 0))
+        latest_upload_time = int(user_stats.get('latest_upload_time', 0))
         
         hours = total_seconds // 3600
         minutes = (total_seconds % 3600) // 60
@@ -0,0 +1,203 @@
+##
+
+import os
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+from .file import set_summary_status
+from .llm import LLMBadRequest
+from .queue import Job, get_job_queue
+from .summaries import summarize_file
+from .transcription import (
+    claim_transcription, launch_transcription, release_claim, transcription_job_name,
+)
+from ..utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Job eseguiti in parallelo da un worker
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 4))
+# Esecuzioni di un job prima della dead-letter queue
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+# Attesa prima del primo retry, raddoppiata a ogni tentativo fino a JOB_RETRY_MAX_DELAY
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 10))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", 600))
+# Attesa massima di una receive senza job (long polling)
+JOB_POLL_WAIT = float(os.getenv("JOB_POLL_WAIT", 20))
+
+
+class JobFailed(Exception):
+    """ Errore definitivo: il job va subito nella dead-letter queue senza retry """
+
+
+def enqueue_transcription(username: str, file_id: str, bucket: str, key: str) -> dict:
+    """
+    Porta il file in QUEUED (solleva TranscriptionAlreadyRunning come
+    start_transcription) e accoda l'avvio del job per il worker
+    """
+    job_name = transcription_job_name(file_id)
+    old_item = claim_transcription(username, file_id, job_name)
+    payload = {
+        "username": username,
+        "file_id": file_id,
+        "bucket": bucket,
+        "key": key,
+        "job_name": job_name,
+        "previous_status": old_item.get('status', 'PENDING'),
+    }
+    try:
+        job_id = get_job_queue().enqueue("transcribe", payload)
+    except Exception:
+        release_claim(username, file_id, job_name, payload["previous_status"])
+        raise
+    return {"job_id": job_id, "job_name": job_name}
+
+
+async def run_transcribe_job(payload: dict):
+    await run_blocking(
+        launch_transcription,
+        payload["username"], payload["file_id"], payload["bucket"], payload["key"], payload["job_name"]
+    )
+
+
+async def transcribe_job_failed(payload: dict, error: str):
+    # Come un avvio inline fallito: il file torna allo stato precedente e si puo' ritentare
+    await run_blocking(
+        release_claim, payload["username"], payload["file_id"], payload["job_name"], payload["previous_status"]
+    )
+
+
+async def run_summarize_job(payload: dict):
+    username, file_id = payload["username"], payload["file_id"]
+    try:
+        summary, _ = await summarize_file(username, file_id, regenerate=payload.get("regenerate", False))
+    except LLMBadRequest as e:
+        raise JobFailed(str(e))
+    if summary is None:
+        await run_blocking(set_summary_status, username, file_id, 'FAILED')
+        raise JobFailed(f"No completed transcription for {file_id}")
+
+
+# tipo -> (esecuzione, callback dopo l'ultimo tentativo fallito)
+JOB_HANDLERS = {
+    "transcribe": (run_transcribe_job, transcribe_job_failed),
+    "summarize": (run_summarize_job, None),
+}
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_MAX_DELAY, JOB_RETRY_DELAY * 2 ** attempts)
+
+
+class Worker:
+    """
+    Consuma la coda eseguendo fino a `concurrency` job insieme. Un job fallito
+    torna in coda con backoff esponenziale; dopo `max_attempts` esecuzioni (o
+    con JobFailed) finisce nella dead-letter queue. Mentre un job e' in corso
+    la sua visibilita' viene rinnovata, cosi' un riassunto lungo non viene
+    riconsegnato a un altro worker.
+    """
+
+    def __init__(self, queue=None, handlers: dict = JOB_HANDLERS, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, poll_wait: float = JOB_POLL_WAIT):
+        self.queue = queue or get_job_queue()
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_wait = poll_wait
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    async def run(self):
+        logger.info(f"Worker started ({type(self.queue).__name__}, concurrency {self.concurrency})")
+        while not self._stopping:
+            await self._slots.acquire()
+            free = 1
+            # Si chiedono tanti job quanti sono gli slot liberi in quel momento
+            while free < self.concurrency and not self._slots.locked():
+                await self._slots.acquire()
+                free += 1
+            try:
+                jobs = await run_blocking(self.queue.receive, free, self.poll_wait)
+            except Exception as e:
+                logger.error(f"Error receiving jobs: {str(e)}")
+                jobs = []
+                await asyncio.sleep(1)
+            for _ in range(free - len(jobs)):
+                self._slots.release()
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        # Arresto: i job in corso terminano, quelli non ricevuti restano in coda
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("Worker stopped")
+
+    async def _execute(self, job: Job):
+        try:
+            await self.process(job)
+        finally:
+            self._slots.release()
+
+    async def _run_visible(self, job: Job, handler):
+        timeout = self.queue.visibility_timeout
+        if not timeout:
+            return await handler(job.payload)
+
+        done = asyncio.Event()
+
+        async def keep_visible():
+            # Rinnovo a meta' della visibilita' residua, finche' l'handler non termina
+            while True:
+                try:
+                    await asyncio.wait_for(done.wait(), timeout / 2)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await run_blocking(self.queue.extend, job, timeout)
+                except Exception as e:
+                    logger.warning(f"Error extending visibility of {job}: {str(e)}")
+
+        heartbeat = asyncio.create_task(keep_visible())
+        try:
+            return await handler(job.payload)
+        finally:
+            # Si attende un eventuale rinnovo in corso prima di ack/retry
+            done.set()
+            await heartbeat
+
+    async def process(self, job: Job):
+        handler, on_failure = self.handlers.get(job.type, (None, None))
+        try:
+            if handler is None:
+                raise JobFailed(f"Unknown job type {job.type}")
+            await self._run_visible(job, handler)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, JobFailed) or job.attempts + 1 >= self.max_attempts:
+                logger.error(f"{job} failed permanently: {error}")
+                await run_blocking(self.queue.dead_letter, job, error)
+                if on_failure:
+                    try:
+                        await on_failure(job.payload, error)
+                    except Exception as callback_error:
+                        logger.error(f"Error handling failure of {job}: {str(callback_error)}")
+            else:
+                delay = retry_delay(job.attempts)
+                logger.warning(f"{job} failed, retrying in {delay:.0f}s: {error}")
+                await run_blocking(self.queue.retry, job, delay, error)
+            return
+
+        await run_blocking(self.queue.ack, job)
+        logger.info(f"{job} completed")
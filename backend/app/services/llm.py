@@ -1,67 +1,408 @@
 ##
 
 import os
-import boto3
+import re
+import random
+import asyncio
+import hashlib
+import logging
+from functools import lru_cache
 from botocore.exceptions import ClientError
+from dotenv import load_dotenv
 
-from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient
 from azure.ai.inference.models import SystemMessage, UserMessage
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+from ..utils.aws import get_client
+from ..utils.cache import LRUCache
+from ..utils.concurrency import run_blocking, SingleFlight
+from ..utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Budget (token stimati) di ogni blocco della trascrizione nel riassunto map-reduce
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", 3000))
+# Completion parallele per i blocchi di uno stesso riassunto
+SUMMARY_MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", 4))
+# Completion in corso al massimo nell'intero processo
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Quota Azure del deployment (token al minuto, prompt + max_tokens)
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 150000))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 4096))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 5))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 30))
+SUMMARY_CHUNK_CACHE_SIZE = int(os.getenv("SUMMARY_CHUNK_CACHE_SIZE", 5000))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 1000))
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", 3600))
+
+_summary_cache = LRUCache(max_size=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+# Riassunti parziali per hash del contenuto: rigenerare un riassunto rifa' solo i blocchi cambiati
+_chunk_cache = LRUCache(max_size=SUMMARY_CHUNK_CACHE_SIZE)
+
+SUMMARY_PROMPT = "You are a helpful assistant. Summarize the following transcription."
+CHUNK_PROMPT = (
+    "You are a helpful assistant. The following text is one part of a longer transcription. "
+    "Summarize it, keeping every relevant fact, name and decision."
+)
+REDUCE_PROMPT = (
+    "You are a helpful assistant. The following texts are summaries of consecutive parts "
+    "of one transcription. Combine them into a single summary of the whole transcription."
+)
+
+# Fine dei frammenti di una completion in streaming
+_STREAM_END = object()
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caratteri per token: stima sufficiente per dimensionare i blocchi
+    return len(text) // 4 + 1
+
+
+def split_sentences(text: str) -> list:
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+def chunk_transcription(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> list:
+    """
+    Divide il testo in blocchi di al piu' `max_tokens` token stimati, tagliando
+    tra una frase e l'altra (e tra parole solo per frasi piu' lunghe del budget).
+    I tagli dipendono dal contenuto (vedi pack_anchored): un testo inserito o
+    modificato cambia solo i blocchi vicini e gli altri restano nella cache.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = []
+        for word in sentence.split():
+            if words and estimate_tokens(" ".join(words + [word])) > max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+
+    return pack_anchored(pieces, max_tokens)
+
+
+def _is_anchor(piece: str, tokens: int, target_tokens: int) -> bool:
+    # Decisione che dipende solo dal pezzo: probabilita' proporzionale alla sua lunghezza
+    value = int.from_bytes(hashlib.blake2b(piece.encode("utf-8"), digest_size=8).digest(), "big")
+    return value < 2 ** 64 * min(1.0, tokens / target_tokens)
+
+
+def pack_anchored(pieces: list, max_tokens: int, separator: str = " ") -> list:
+    """
+    Come pack_texts, ma un blocco (lungo almeno un terzo del budget) si chiude
+    dopo un pezzo "ancora" scelto dal suo hash. Poiche' i tagli seguono il
+    contenuto e non la posizione, dopo un inserimento i confini tornano gli
+    stessi alla prima ancora successiva; al budget si taglia comunque.
+    """
+    min_tokens = max_tokens // 3
+    target_tokens = max(1, max_tokens // 2)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += tokens
+        if current_tokens >= min_tokens and _is_anchor(piece, tokens, target_tokens):
+            chunks.append(separator.join(current))
+            current = []
+            current_tokens = 0
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def pack_texts(pieces: list, max_tokens: int, separator: str = " ") -> list:
+    """ Unisce in ordine pezzi consecutivi finche' restano entro `max_tokens` """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+class LLMError(Exception):
+    """ Errore nella generazione di un riassunto """
+
+
+class LLMRateLimited(LLMError):
+    """ Quota Azure esaurita (429) anche dopo i tentativi """
+
+
+class LLMUnavailable(LLMError):
+    """ Servizio non raggiungibile o in errore (5xx, rete) anche dopo i tentativi """
+
+
+class LLMBadRequest(LLMError):
+    """ Richiesta rifiutata dal modello (es. contenuto filtrato, contesto troppo lungo) """
 
 
 class ServiceLLM:
-    def __init__(self):
+    def __init__(self, client=None, chunk_tokens: int = SUMMARY_CHUNK_TOKENS):
 
-        # Azure OpenAI client
-        self.client = ChatCompletionsClient(
+        # Azure OpenAI client asincrono, riusato per tutta la vita del processo
+        # (sostituibile con un client chat-completions finto)
+        self.client = client or ChatCompletionsClient(
             endpoint=os.getenv("AZURE_OAI_ENDPOINT"),
             credential=AzureKeyCredential(os.getenv("AZURE_OAI_KEY")),
         )
         self.model_name = "gpt-4o"
+        self.chunk_tokens = chunk_tokens
+
+        # Limiti condivisi da tutte le richieste del processo
+        self._in_flight = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._quota = TokenBucket(rate=LLM_TOKENS_PER_MINUTE / 60, capacity=LLM_TOKENS_PER_MINUTE)
 
         # S3 client
-        self.s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_REGION"),
-        )
+        self.s3_client = get_client("s3")
         self.summaries_bucket = os.getenv("S3_SUMMARIES_BUCKET")
 
-    def summarize_and_save(self, transcription: str, username: str, file_id: str) -> str:
+        self._generating = SingleFlight()
+
+    async def close(self):
+        if hasattr(self.client, "close"):
+            await self.client.close()
+
+    @staticmethod
+    def summary_key(username: str, file_id: str) -> str:
+        return f"{username}/{file_id}_summary.txt"
+
+    def get_saved_summary(self, username: str, file_id: str) -> str:
+        """
+        Riassunto gia' salvato su S3 (None se non esiste), con una LRU in processo davanti
+        """
+        key = self.summary_key(username, file_id)
+        summary = _summary_cache.get((self.summaries_bucket, key))
+        if summary is not None:
+            return summary
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.summaries_bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        summary = response['Body'].read().decode('utf-8')
+        _summary_cache.set((self.summaries_bucket, key), summary)
+        return summary
+
+    def invalidate_summary(self, username: str, file_id: str):
+        invalidate_saved_summary(self.summaries_bucket, self.summary_key(username, file_id))
+
+    async def get_or_create_summary(self, username: str, file_id: str, load_transcription,
+                                    regenerate: bool = False) -> tuple:
+        """
+        (summary, cached): il riassunto salvato se esiste, altrimenti (o con
+        regenerate) uno nuovo. Le richieste concorrenti per lo stesso file
+        condividono una sola generazione. `load_transcription` e' una funzione
+        sincrona che restituisce il testo da riassumere (None se non disponibile).
+        """
+        if not regenerate:
+            summary = await run_blocking(self.get_saved_summary, username, file_id)
+            if summary is not None:
+                return summary, True
+
+        async def generate():
+            transcription = await run_blocking(load_transcription)
+            if not transcription:
+                return None, False
+            summary = await self.summarize_and_save(transcription, username, file_id)
+            return summary, False
+
+        return await self._generating.do((username, file_id), generate)
+
+    async def _request(self, prompt: str, content: str, stream: bool = False):
+        """
+        Una completion entro i limiti del processo (semaforo e quota token al
+        minuto), ritentata con backoff esponenziale e jitter su 429, 5xx ed
+        errori di rete. Gli errori arrivano come sottoclassi di LLMError.
+        """
+        await self._quota.acquire(estimate_tokens(prompt) + estimate_tokens(content) + LLM_MAX_TOKENS)
+
+        for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+            retry_after = None
+            try:
+                return await self.client.complete(
+                    messages=[
+                        SystemMessage(content=prompt),
+                        UserMessage(content=content),
+                    ],
+                    max_tokens=LLM_MAX_TOKENS,
+                    temperature=1.0,
+                    top_p=1.0,
+                    model=self.model_name,
+                    stream=stream,
+                )
+            except HttpResponseError as e:
+                status = e.status_code or 0
+                if status == 429:
+                    error = LLMRateLimited(str(e))
+                    retry_after = _retry_after(e)
+                elif status >= 500:
+                    error = LLMUnavailable(str(e))
+                else:
+                    raise LLMBadRequest(str(e)) from e
+            except (ServiceRequestError, ServiceResponseError, asyncio.TimeoutError) as e:
+                error = LLMUnavailable(str(e))
+
+            if attempt == LLM_MAX_ATTEMPTS:
+                raise error
+            # Full jitter: i client che ritentano insieme non si risincronizzano
+            delay = retry_after or random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (attempt - 1)))
+            logger.warning(f"LLM request failed ({error.__class__.__name__}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _complete(self, prompt: str, content: str) -> str:
+        async with self._in_flight:
+            response = await self._request(prompt, content)
+        return response.choices[0].message.content
+
+    async def _stream(self, prompt: str, content: str):
+        """
+        Frammenti di testo della completion man mano che arrivano dal modello.
+        I frammenti passano da una coda: lo slot di _in_flight si libera appena
+        il modello ha finito, anche se il client li sta ancora ricevendo.
+        """
+        fragments = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(prompt, content, fragments))
+        try:
+            while True:
+                fragment = await fragments.get()
+                if fragment is _STREAM_END:
+                    break
+                yield fragment
+            # Propaga l'eventuale errore della completion
+            await reader
+        finally:
+            # Client disconnesso: si interrompe la completion
+            if not reader.done():
+                reader.cancel()
+
+    async def _read_stream(self, prompt: str, content: str, fragments: asyncio.Queue):
+        try:
+            async with self._in_flight:
+                response = await self._request(prompt, content, stream=True)
+                try:
+                    async for update in response:
+                        if update.choices and update.choices[0].delta and update.choices[0].delta.content:
+                            fragments.put_nowait(update.choices[0].delta.content)
+                except (HttpResponseError, ServiceResponseError) as e:
+                    raise LLMUnavailable(str(e)) from e
+                finally:
+                    if hasattr(response, "close"):
+                        await response.close()
+        finally:
+            fragments.put_nowait(_STREAM_END)
+
+    async def _summarize_chunk(self, chunk: str) -> str:
+        key = hashlib.sha256(f"{self.model_name}\n{CHUNK_PROMPT}\n{chunk}".encode("utf-8")).hexdigest()
+        summary = _chunk_cache.get(key)
+        if summary is None:
+            summary = await self._complete(CHUNK_PROMPT, chunk)
+            _chunk_cache.set(key, summary)
+        return summary
+
+    async def _map(self, func, items: list) -> list:
+        # Al piu' SUMMARY_MAP_WORKERS completion alla volta per lo stesso riassunto
+        workers = asyncio.Semaphore(SUMMARY_MAP_WORKERS)
+
+        async def run(item):
+            async with workers:
+                return await func(item)
+
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def _final_request(self, transcription: str) -> tuple:
+        """
+        (prompt, testo) dell'ultima richiesta del riassunto map-reduce: una
+        trascrizione che sta in un blocco va al modello cosi' com'e'; altrimenti
+        i blocchi vengono riassunti in parallelo e i riassunti parziali combinati
+        (a piu' livelli se non stanno in un blocco)
+        """
+        chunks = chunk_transcription(transcription, self.chunk_tokens)
+        if len(chunks) <= 1:
+            return SUMMARY_PROMPT, transcription
+
+        logger.info(f"Summarizing transcription in {len(chunks)} chunks")
+        partials = await self._map(self._summarize_chunk, chunks)
+        groups = pack_texts(partials, self.chunk_tokens, "\n\n")
+        while 1 < len(groups) < len(partials):
+            partials = await self._map(lambda group: self._complete(REDUCE_PROMPT, group), groups)
+            groups = pack_texts(partials, self.chunk_tokens, "\n\n")
+        return REDUCE_PROMPT, "\n\n".join(partials)
+
+    async def summarize(self, transcription: str) -> str:
+        return await self._complete(*await self._final_request(transcription))
+
+    async def stream_summary(self, transcription: str):
+        """
+        Come summarize, ma restituisce i frammenti dell'ultima completion
+        (l'unica nel caso di trascrizioni brevi) appena arrivano
+        """
+        async for fragment in self._stream(*await self._final_request(transcription)):
+            yield fragment
+
+    def save_summary(self, username: str, file_id: str, summary: str):
+        summary_key = self.summary_key(username, file_id)
+        self.s3_client.put_object(
+            Bucket=self.summaries_bucket,
+            Key=summary_key,
+            Body=summary,
+            ContentType="text/plain",
+        )
+        _summary_cache.set((self.summaries_bucket, summary_key), summary)
+
+    async def summarize_and_save(self, transcription: str, username: str, file_id: str) -> str:
         """
         Summarize the transcription and save the result to S3.
         """
         assert isinstance(transcription, str)
         assert len(transcription) > 0
 
-        try:
-            messages = [
-                SystemMessage(content="You are a helpful assistant. Summarize the following transcription."),
-                UserMessage(content=transcription),
-            ]
-
-            response = self.client.complete(
-                messages=messages,
-                max_tokens=4096,
-                temperature=1.0,
-                top_p=1.0,
-                model=self.model_name,
-            )
-
-            summary = response.choices[0].message.content
-
-            summary_key = f"{username}/{file_id}_summary.txt"
-            self.s3_client.put_object(
-                Bucket=self.summaries_bucket,
-                Key=summary_key,
-                Body=summary,
-                ContentType="text/plain",
-            )
+        summary = await self.summarize(transcription)
+        await run_blocking(self.save_summary, username, file_id, summary)
+        return summary
 
-            return summary
 
-        except ClientError as e:
-            return "Error generating or saving summary."
-        except Exception as e:
-            return "Error generating summary."
+def invalidate_saved_summary(bucket: str, key: str):
+    _summary_cache.pop((bucket, key))
+
+
+def _retry_after(error: HttpResponseError):
+    try:
+        return min(float(error.response.headers.get("retry-after")), LLM_BACKOFF_MAX)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_service_llm() -> ServiceLLM:
+    """
+    ServiceLLM condiviso dal processo (client Azure e S3 riutilizzati tra le richieste)
+    """
+    return ServiceLLM()
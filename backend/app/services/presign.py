@@ -0,0 +1,127 @@
+##
+
+import os
+import hmac
+import hashlib
+import logging
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import quote, urlsplit
+
+from dotenv import load_dotenv
+
+from ..utils.aws import get_client, get_credentials
+from ..utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PRESIGN_EXPIRATION = int(os.getenv("PRESIGN_EXPIRATION", 7200))
+# Un URL viene riusato finche' non e' trascorsa questa frazione della sua validita'
+PRESIGN_REFRESH_FRACTION = float(os.getenv("PRESIGN_REFRESH_FRACTION", 0.5))
+PRESIGN_CACHE_SIZE = int(os.getenv("PRESIGN_CACHE_SIZE", 10000))
+
+# Chiave usata per chiedere al client S3 la forma degli URL di un bucket
+_PROBE_KEY = "presign-probe"
+
+_url_cache = LRUCache(max_size=PRESIGN_CACHE_SIZE)
+
+
+def presign_get_urls(bucket: str, keys, expiration: int = PRESIGN_EXPIRATION) -> dict:
+    """
+    URL firmati (GET) per una lista di chiavi dello stesso bucket.
+    Gli URL ancora "freschi" arrivano dalla cache, gli altri vengono firmati
+    tutti insieme con una sola signing key derivata.
+    """
+    urls = {}
+    missing = []
+    for key in keys:
+        url = _url_cache.get((bucket, key))
+        if url is None:
+            missing.append(key)
+        else:
+            urls[key] = url
+
+    if missing:
+        signed = sign_get_urls(bucket, missing, expiration)
+        for key, url in signed.items():
+            _url_cache.set((bucket, key), url, ttl=expiration * PRESIGN_REFRESH_FRACTION)
+        urls.update(signed)
+
+    return urls
+
+
+def invalidate_presigned_url(bucket: str, key: str):
+    _url_cache.pop((bucket, key))
+
+
+@lru_cache(maxsize=16)
+def _signing_key(secret_key: str, datestamp: str, region: str) -> bytes:
+    key = ("AWS4" + secret_key).encode("utf-8")
+    for part in (datestamp, region, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+    return key
+
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+@lru_cache(maxsize=256)
+def _bucket_endpoint(bucket: str, region: str = None) -> tuple:
+    """
+    (scheme, host, prefisso del path, regione) degli URL di `bucket`, ricavati da
+    un URL firmato dal client S3 condiviso: endpoint (anche personalizzato),
+    addressing style e bucket con il punto sono quelli che userebbe botocore
+    """
+    client = get_client('s3', region)
+    url = urlsplit(client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': _PROBE_KEY}))
+    prefix = url.path[:-len(_PROBE_KEY) - 1]
+    return url.scheme, url.netloc, prefix, client.meta.region_name or "us-east-1"
+
+
+def sign_get_urls(bucket: str, keys, expiration: int = PRESIGN_EXPIRATION,
+                  region: str = None, credentials=None, now: datetime = None) -> dict:
+    """
+    Firma in locale (SigV4, query string) URL GET per piu' oggetti S3,
+    senza passare per la pipeline di richiesta di botocore per ogni chiave
+    """
+    credentials = credentials or get_credentials()
+    if credentials is None:
+        logger.error("Nessuna credenziale AWS disponibile per firmare gli URL")
+        return {}
+
+    scheme, host, prefix, client_region = _bucket_endpoint(bucket, region)
+    region = region or client_region
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    datestamp = now.strftime("%Y%m%d")
+    scope = f"{datestamp}/{region}/s3/aws4_request"
+    signing_key = _signing_key(credentials.secret_key, datestamp, region)
+
+    params = {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{credentials.access_key}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(expiration),
+        "X-Amz-SignedHeaders": "host",
+    }
+    if credentials.token:
+        params["X-Amz-Security-Token"] = credentials.token
+    query = "&".join(f"{_uri_encode(k)}={_uri_encode(v)}" for k, v in sorted(params.items()))
+
+    urls = {}
+    for key in keys:
+        path = f"{prefix}/{_uri_encode(key, safe='/-_.~')}"
+        canonical_request = f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        urls[key] = f"{scheme}://{host}{path}?{query}&X-Amz-Signature={signature}"
+
+    return urls
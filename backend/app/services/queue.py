@@ -0,0 +1,287 @@
+##
+
+import os
+import json
+import time
+import heapq
+import sqlite3
+import logging
+import itertools
+import threading
+from uuid import uuid4
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from ..utils.aws import get_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "inline": nessuna coda, gli endpoint eseguono le operazioni nella richiesta
+# "memory": coda in processo con worker nello stesso processo (sviluppo e test)
+# "sqlite": coda su file condivisa tra API e `python -m worker` sulla stessa macchina
+# "sqs": coda SQS (produzione), API e worker scalano separatamente
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "inline")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.db")
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "")
+JOB_DEAD_LETTER_QUEUE_URL = os.getenv("JOB_DEAD_LETTER_QUEUE_URL", "")
+# Secondi in cui un job ricevuto resta invisibile agli altri worker (se il worker muore torna in coda).
+# Il worker la rinnova finche' il job e' in corso: non serve coprire il job piu' lungo
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+
+
+class Job:
+    """
+    Job ricevuto dalla coda. `attempts` conta le esecuzioni gia' fallite,
+    `receipt` e' il riferimento del backend per ack/retry.
+    """
+
+    def __init__(self, job_id: str, job_type: str, payload: dict, attempts: int = 0, receipt=None):
+        self.id = job_id
+        self.type = job_type
+        self.payload = payload
+        self.attempts = attempts
+        self.receipt = receipt
+
+    def __repr__(self):
+        return f"Job({self.type} {self.id}, attempts={self.attempts})"
+
+
+class MemoryJobQueue:
+    """ Coda in processo: i job esistono solo finche' il processo e' vivo """
+
+    # Un job ricevuto esce dalla coda: non c'e' visibilita' da rinnovare
+    visibility_timeout = None
+
+    def __init__(self):
+        self._ready = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self.dead = []
+
+    def _push(self, job: Job, delay: float = 0):
+        with self._condition:
+            heapq.heappush(self._ready, (time.monotonic() + delay, next(self._counter), job))
+            self._condition.notify()
+
+    def enqueue(self, job_type: str, payload: dict, delay: float = 0) -> str:
+        job = Job(uuid4().hex, job_type, payload)
+        self._push(job, delay)
+        return job.id
+
+    def receive(self, max_jobs: int = 1, wait: float = 0) -> list:
+        deadline = time.monotonic() + wait
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                jobs = []
+                while self._ready and self._ready[0][0] <= now and len(jobs) < max_jobs:
+                    jobs.append(heapq.heappop(self._ready)[2])
+                if jobs or now >= deadline:
+                    return jobs
+                next_at = self._ready[0][0] if self._ready else deadline
+                self._condition.wait(min(next_at, deadline) - now)
+
+    def ack(self, job: Job):
+        pass
+
+    def extend(self, job: Job, timeout: float):
+        pass
+
+    def retry(self, job: Job, delay: float, error: str = None):
+        job.attempts += 1
+        self._push(job, delay)
+
+    def dead_letter(self, job: Job, error: str):
+        self.dead.append((job, error))
+
+
+class SQLiteJobQueue:
+    """
+    Coda su SQLite: un job ricevuto diventa `running` fino alla scadenza della
+    visibilita', dopo la quale torna ricevibile (worker terminato a meta').
+    I job falliti definitivamente restano nella tabella con stato `dead`.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, visibility_timeout: int = JOB_VISIBILITY_TIMEOUT,
+                 poll_interval: float = 0.5):
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, type TEXT NOT NULL, payload TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, "
+            "available_at REAL NOT NULL, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at)")
+
+    def enqueue(self, job_type: str, payload: dict, delay: float = 0) -> str:
+        job_id = uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, type, payload, status, available_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, job_type, json.dumps(payload), time.time() + delay)
+            )
+        return job_id
+
+    def _claim(self, max_jobs: int) -> list:
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE: un solo processo alla volta sceglie e prende i job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, type, payload, attempts FROM jobs "
+                    "WHERE status IN ('queued', 'running') AND available_at <= ? "
+                    "ORDER BY available_at LIMIT ?",
+                    (now, max_jobs)
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE jobs SET status = 'running', available_at = ? WHERE id = ?",
+                    [(now + self.visibility_timeout, row[0]) for row in rows]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [Job(row[0], row[1], json.loads(row[2]), row[3], receipt=row[0]) for row in rows]
+
+    def receive(self, max_jobs: int = 1, wait: float = 0) -> list:
+        deadline = time.monotonic() + wait
+        while True:
+            jobs = self._claim(max_jobs)
+            if jobs or time.monotonic() >= deadline:
+                return jobs
+            time.sleep(self.poll_interval)
+
+    def ack(self, job: Job):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def extend(self, job: Job, timeout: float):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET available_at = ? WHERE id = ? AND status = 'running'",
+                (time.time() + timeout, job.id)
+            )
+
+    def retry(self, job: Job, delay: float, error: str = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts + 1, available_at = ?, error = ? "
+                "WHERE id = ?",
+                (time.time() + delay, error, job.id)
+            )
+
+    def dead_letter(self, job: Job, error: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = 'dead', error = ? WHERE id = ?", (error, job.id))
+
+
+class SQSJobQueue:
+    """
+    Coda SQS. Il retry non rispedisce il messaggio: ne cambia la visibilita',
+    e i tentativi sono ApproximateReceiveCount - 1. I job falliti
+    definitivamente vanno nella dead-letter queue (se configurata).
+    """
+
+    # Limiti SQS
+    MAX_BATCH = 10
+    MAX_WAIT = 20
+    MAX_DELAY = 900
+    MAX_VISIBILITY = 12 * 3600
+
+    def __init__(self, queue_url: str = JOB_QUEUE_URL, dead_letter_url: str = JOB_DEAD_LETTER_QUEUE_URL,
+                 visibility_timeout: int = JOB_VISIBILITY_TIMEOUT, client=None):
+        if not queue_url:
+            raise RuntimeError("JOB_QUEUE_URL is required for the sqs job queue")
+        self.client = client or get_client('sqs')
+        self.queue_url = queue_url
+        self.dead_letter_url = dead_letter_url
+        self.visibility_timeout = visibility_timeout
+
+    def enqueue(self, job_type: str, payload: dict, delay: float = 0) -> str:
+        job_id = uuid4().hex
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps({"id": job_id, "type": job_type, "payload": payload}),
+            DelaySeconds=min(int(delay), self.MAX_DELAY),
+        )
+        return job_id
+
+    def receive(self, max_jobs: int = 1, wait: float = 0) -> list:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max(1, min(max_jobs, self.MAX_BATCH)),
+            WaitTimeSeconds=min(int(wait), self.MAX_WAIT),
+            VisibilityTimeout=self.visibility_timeout,
+            AttributeNames=['ApproximateReceiveCount'],
+        )
+        jobs = []
+        for message in response.get('Messages', []):
+            try:
+                body = json.loads(message['Body'])
+                job = Job(body['id'], body['type'], body.get('payload', {}),
+                          int(message['Attributes']['ApproximateReceiveCount']) - 1,
+                          receipt=message['ReceiptHandle'])
+            except (ValueError, KeyError) as e:
+                logger.error(f"Discarding malformed job message {message.get('MessageId')}: {str(e)}")
+                self._forward_dead(message['Body'], f"Malformed job: {str(e)}")
+                self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+                continue
+            jobs.append(job)
+        return jobs
+
+    def ack(self, job: Job):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=job.receipt)
+
+    def extend(self, job: Job, timeout: float):
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=job.receipt,
+            VisibilityTimeout=min(int(timeout), self.MAX_VISIBILITY),
+        )
+
+    def retry(self, job: Job, delay: float, error: str = None):
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=job.receipt,
+            VisibilityTimeout=min(int(delay), self.MAX_VISIBILITY),
+        )
+
+    def _forward_dead(self, body: str, error: str):
+        if self.dead_letter_url:
+            self.client.send_message(
+                QueueUrl=self.dead_letter_url,
+                MessageBody=body,
+                MessageAttributes={'error': {'DataType': 'String', 'StringValue': error[:1024] or 'error'}},
+            )
+
+    def dead_letter(self, job: Job, error: str):
+        self._forward_dead(
+            json.dumps({"id": job.id, "type": job.type, "payload": job.payload, "attempts": job.attempts + 1}),
+            error
+        )
+        self.ack(job)
+
+
+QUEUES = {
+    "memory": MemoryJobQueue,
+    "sqlite": SQLiteJobQueue,
+    "sqs": SQSJobQueue,
+}
+
+
+def jobs_enabled() -> bool:
+    return JOB_QUEUE_BACKEND != "inline"
+
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    """ Coda configurata con JOB_QUEUE_BACKEND, condivisa dal processo """
+    return QUEUES[JOB_QUEUE_BACKEND]()
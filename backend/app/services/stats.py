@@ -0,0 +1,237 @@
+##
+
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .tables import FILES_TABLE, USERS_TABLE, USER_STATS_TABLE, query_all
+from ..utils.aws import get_table
+
+logger = logging.getLogger(__name__)
+
+files_table = get_table(FILES_TABLE)
+stats_table = get_table(USER_STATS_TABLE)
+
+# Statistiche per utente mantenute in modo incrementale (ADD atomici) in un
+# solo item della tabella user_stats:
+#   total_seconds, audio_files_count  -> file COMPLETED con durata
+#   lang_<codice>                     -> file COMPLETED per lingua
+#   day_<YYYY-MM-DD>                  -> upload per giorno
+#   latest_upload_time                -> upload piu' recente tra i COMPLETED con durata
+#   built_at                          -> ultimo ricalcolo completo (rebuild_user_stats)
+LANGUAGE_PREFIX = 'lang_'
+DAY_PREFIX = 'day_'
+
+
+def _language_of(item: dict) -> str:
+    return item.get('language') or 'unknown'
+
+
+def _day_of(upload_time) -> str:
+    return datetime.fromtimestamp(int(upload_time)).strftime('%Y-%m-%d')
+
+
+def _add(username: str, counters: dict):
+    counters = {name: value for name, value in counters.items() if value}
+    if not counters:
+        return
+    names = {f"#c{i}": name for i, name in enumerate(counters)}
+    values = {f":c{i}": Decimal(value) for i, value in enumerate(counters.values())}
+    stats_table.update_item(
+        Key={'user_id': username},
+        UpdateExpression="ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(counters))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def _completion_counters(item: dict, sign: int) -> dict:
+    counters = {LANGUAGE_PREFIX + _language_of(item): sign}
+    if item.get('duration'):
+        counters['total_seconds'] = sign * int(item['duration'])
+        counters['audio_files_count'] = sign
+    return counters
+
+
+def _bump_latest_upload(username: str, upload_time: int):
+    try:
+        stats_table.update_item(
+            Key={'user_id': username},
+            UpdateExpression="SET latest_upload_time = :t",
+            ConditionExpression="attribute_not_exists(latest_upload_time) OR latest_upload_time < :t",
+            ExpressionAttributeValues={':t': upload_time},
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def _safely(action):
+    """
+    Le statistiche sono derivate: un errore non deve far fallire la richiesta
+    (si recuperano con `python -m app.services.stats rebuild`)
+    """
+    def wrapper(username, *args, **kwargs):
+        try:
+            action(username, *args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error updating stats for {username}: {str(e)}")
+    return wrapper
+
+
+@_safely
+def record_upload(username: str, upload_time: int):
+    _add(username, {DAY_PREFIX + _day_of(upload_time): 1})
+
+
+@_safely
+def record_status_change(username: str, old_item: dict, new_item: dict):
+    """ Aggiorna le statistiche quando un file entra o esce dallo stato COMPLETED """
+    was_completed = old_item.get('status') == 'COMPLETED'
+    is_completed = new_item.get('status') == 'COMPLETED'
+
+    if is_completed and not was_completed:
+        _add(username, _completion_counters(new_item, 1))
+        if new_item.get('duration') and new_item.get('upload_time'):
+            _bump_latest_upload(username, int(new_item['upload_time']))
+    elif was_completed and not is_completed:
+        _add(username, _completion_counters(old_item, -1))
+        _refresh_latest_if_removed(username, old_item)
+    elif is_completed and old_item.get('duration') != new_item.get('duration'):
+        counters = _completion_counters(new_item, 1)
+        for name, value in _completion_counters(old_item, -1).items():
+            counters[name] = counters.get(name, 0) + value
+        _add(username, counters)
+        if new_item.get('duration') and new_item.get('upload_time'):
+            _bump_latest_upload(username, int(new_item['upload_time']))
+
+
+@_safely
+def record_language_change(username: str, old_item: dict, language: str):
+    """ Sposta il contatore della lingua di un file gia' COMPLETED """
+    old_language = _language_of(old_item)
+    if old_item.get('status') != 'COMPLETED' or old_language == (language or 'unknown'):
+        return
+    _add(username, {
+        LANGUAGE_PREFIX + old_language: -1,
+        LANGUAGE_PREFIX + (language or 'unknown'): 1,
+    })
+
+
+def record_delete(username: str, item: dict):
+    record_deletes(username, [item])
+
+
+@_safely
+def record_deletes(username: str, items: list):
+    """ Statistiche dopo la cancellazione di piu' file: un solo ADD per tutti """
+    counters = {}
+    for item in items:
+        item_counters = {}
+        if item.get('upload_time'):
+            item_counters[DAY_PREFIX + _day_of(item['upload_time'])] = -1
+        if item.get('status') == 'COMPLETED':
+            item_counters.update(_completion_counters(item, -1))
+        for name, value in item_counters.items():
+            counters[name] = counters.get(name, 0) + value
+    _add(username, counters)
+
+    completed = [item for item in items if item.get('status') == 'COMPLETED']
+    if completed:
+        # Basta controllare il piu' recente tra quelli rimossi
+        _refresh_latest_if_removed(username, max(completed, key=lambda item: int(item.get('upload_time') or 0)))
+
+
+def _refresh_latest_if_removed(username: str, item: dict):
+    # Il massimo non si puo' decrementare: se il file rimosso era il piu' recente si ricalcola
+    stats = stats_table.get_item(Key={'user_id': username}).get('Item', {})
+    if item.get('upload_time') and stats.get('latest_upload_time') == item['upload_time']:
+        rebuild_user_stats(username)
+
+
+def compute_stats(items) -> dict:
+    """ Item delle statistiche calcolato da zero a partire dai file dell'utente """
+    stats = {'total_seconds': 0, 'audio_files_count': 0, 'latest_upload_time': 0}
+    for item in items:
+        if item.get('upload_time'):
+            day = DAY_PREFIX + _day_of(item['upload_time'])
+            stats[day] = stats.get(day, 0) + 1
+        if item.get('status') != 'COMPLETED':
+            continue
+        for name, value in _completion_counters(item, 1).items():
+            stats[name] = stats.get(name, 0) + value
+        if item.get('duration') and item.get('upload_time'):
+            stats['latest_upload_time'] = max(stats['latest_upload_time'], int(item['upload_time']))
+    if not stats['latest_upload_time']:
+        del stats['latest_upload_time']
+    return stats
+
+
+def rebuild_user_stats(username: str) -> dict:
+    """
+    Ricalcola da zero le statistiche di un utente leggendo tutti i suoi file
+    """
+    items = query_all(
+        files_table,
+        KeyConditionExpression=boto3.dynamodb.conditions.Key('user_id').eq(username),
+        ProjectionExpression="#status, #duration, #lang, upload_time",
+        ExpressionAttributeNames={"#status": "status", "#duration": "duration", "#lang": "language"},
+    )
+    stats = compute_stats(items)
+    stats['built_at'] = int(time.time())
+    stats_table.put_item(Item={'user_id': username, **stats})
+    logger.info(f"Rebuilt stats for {username} from {len(items)} files")
+    return {'user_id': username, **stats}
+
+
+def get_user_stats(username: str) -> dict:
+    """
+    Item delle statistiche dell'utente, ricostruito se non e' mai stato calcolato
+    da zero (es. utenti esistenti prima dell'introduzione delle statistiche)
+    """
+    item = stats_table.get_item(Key={'user_id': username}).get('Item')
+    if item is None or 'built_at' not in item:
+        item = rebuild_user_stats(username)
+    return item
+
+
+def get_language_counts(stats: dict) -> dict:
+    return {
+        name[len(LANGUAGE_PREFIX):]: int(value)
+        for name, value in stats.items()
+        if name.startswith(LANGUAGE_PREFIX) and int(value) > 0
+    }
+
+
+def get_daily_uploads(stats: dict, days: int = 30) -> dict:
+    """ Upload per giorno negli ultimi `days` giorni, dal piu' vecchio al piu' recente """
+    today = datetime.utcnow()
+    dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days - 1, -1, -1)]
+    return {date: max(int(stats.get(DAY_PREFIX + date, 0)), 0) for date in dates}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3 or sys.argv[1] != "rebuild":
+        print("Usage: python -m app.services.stats rebuild <username>... | --all")
+        sys.exit(1)
+
+    usernames = sys.argv[2:]
+    if usernames == ["--all"]:
+        users_table = get_table(USERS_TABLE)
+        usernames = []
+        scan_args = {'ProjectionExpression': 'username'}
+        while True:
+            response = users_table.scan(**scan_args)
+            usernames.extend(item['username'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    for username in usernames:
+        rebuild_user_stats(username)
@@ -0,0 +1,134 @@
+##
+
+import os
+import asyncio
+import logging
+from functools import lru_cache, partial
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from .events import completion_notifier
+from .file import get_completed_transcription, output_bucket, set_summary_status
+from .llm import ServiceLLM, get_service_llm
+from .queue import get_job_queue, jobs_enabled
+from ..utils.aws import get_client
+from ..utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Riassunto calcolato in background appena una trascrizione passa a COMPLETED
+AUTO_SUMMARIZE = os.getenv("AUTO_SUMMARIZE", "false").lower() == "true"
+# Riassunti automatici generati insieme dal processo (senza coda di job)
+AUTO_SUMMARY_CONCURRENCY = int(os.getenv("AUTO_SUMMARY_CONCURRENCY", 2))
+
+
+def _last_modified(bucket: str, key: str):
+    try:
+        return get_client('s3').head_object(Bucket=bucket, Key=key)['LastModified']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def summary_outdated(username: str, file_id: str) -> bool:
+    """
+    True se la trascrizione e' piu' recente del riassunto salvato (file
+    ritrascritto). Il riassunto copiato su un duplicato, scritto dopo la
+    trascrizione, resta valido; senza riassunto basta generarlo.
+    """
+    summaries_bucket = get_service_llm().summaries_bucket
+    if not summaries_bucket:
+        return False
+    summary_time = _last_modified(summaries_bucket, ServiceLLM.summary_key(username, file_id))
+    if summary_time is None:
+        return False
+    transcript_time = _last_modified(output_bucket, f"{username}/{file_id}.json")
+    return transcript_time is not None and transcript_time > summary_time
+
+
+def enqueue_summary(username: str, file_id: str, regenerate: bool = False) -> str:
+    set_summary_status(username, file_id, 'PENDING')
+    return get_job_queue().enqueue("summarize", {"username": username, "file_id": file_id, "regenerate": regenerate})
+
+
+async def summarize_file(username: str, file_id: str, regenerate: bool = False, llm_service=None,
+                         load_transcription=None) -> tuple:
+    """
+    (summary, cached) come get_or_create_summary, registrando l'esito in
+    summary_status. summary e' None se la trascrizione non e' ancora disponibile.
+    """
+    llm_service = llm_service or get_service_llm()
+    try:
+        summary, cached = await llm_service.get_or_create_summary(
+            username,
+            file_id,
+            load_transcription or partial(get_completed_transcription, file_id, username),
+            regenerate=regenerate
+        )
+    except Exception:
+        await run_blocking(set_summary_status, username, file_id, 'FAILED')
+        raise
+    if summary is not None:
+        # Anche un riassunto gia' esistente chiude un eventuale PENDING
+        await run_blocking(set_summary_status, username, file_id, 'COMPLETED')
+    return summary, cached
+
+
+class SummaryPipeline:
+    """
+    Listener dei passaggi a COMPLETED: segna il riassunto PENDING e lo
+    precalcola, nel processo (al piu' `concurrency` alla volta) o tramite la
+    coda di job se configurata. Il testo gia' in memoria di chi ha completato
+    il file viene riusato senza rileggere l'output di Transcribe.
+    """
+
+    def __init__(self, concurrency: int = AUTO_SUMMARY_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = None
+        self._loop = None
+        self._pending = set()
+
+    def start(self):
+        # Va chiamato dall'event loop: i listener arrivano anche da thread del pool AWS
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        completion_notifier.subscribe(self.on_completed)
+        logger.info("Automatic summaries enabled")
+
+    def stop(self):
+        completion_notifier.unsubscribe(self.on_completed)
+
+    def on_completed(self, username: str, file_id: str, transcription: str = None):
+        if self._loop is None or self._loop.is_closed():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._summarize(username, file_id, transcription), self._loop)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    async def _summarize(self, username: str, file_id: str, transcription: str = None):
+        try:
+            # Si rigenera solo se una nuova trascrizione ha reso vecchio il riassunto salvato
+            regenerate = await run_blocking(summary_outdated, username, file_id)
+            if jobs_enabled():
+                await run_blocking(enqueue_summary, username, file_id, regenerate)
+                return
+            await run_blocking(set_summary_status, username, file_id, 'PENDING')
+            async with self._slots:
+                await summarize_file(
+                    username,
+                    file_id,
+                    regenerate=regenerate,
+                    load_transcription=(lambda: transcription) if transcription else None
+                )
+            logger.info(f"Summary of {file_id} precomputed")
+        except Exception as e:
+            logger.error(f"Error precomputing summary of {file_id}: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_summary_pipeline() -> SummaryPipeline:
+    return SummaryPipeline()
@@ -0,0 +1,126 @@
+##
+
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+from ..utils.aws import get_client
+
+logger = logging.getLogger(__name__)
+
+FILES_TABLE = 'files'
+USERS_TABLE = 'users'
+USER_STATS_TABLE = 'user_stats'
+
+# GSI (user_id, hash) per riconoscere i file gia' caricati dallo stesso utente
+HASH_INDEX = 'user_id-hash-index'
+
+TABLES = {
+    FILES_TABLE: {
+        'KeySchema': [
+            {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'file_id', 'KeyType': 'RANGE'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'user_id', 'AttributeType': 'S'},
+            {'AttributeName': 'file_id', 'AttributeType': 'S'},
+            {'AttributeName': 'hash', 'AttributeType': 'S'},
+        ],
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': HASH_INDEX,
+                'KeySchema': [
+                    {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                    {'AttributeName': 'hash', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['status', 'filename', 's3_key', 'url', 'duration', 'language'],
+                },
+            },
+        ],
+    },
+    USERS_TABLE: {
+        'KeySchema': [
+            {'AttributeName': 'username', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'username', 'AttributeType': 'S'},
+        ],
+    },
+    USER_STATS_TABLE: {
+        'KeySchema': [
+            {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'user_id', 'AttributeType': 'S'},
+        ],
+    },
+}
+
+
+def query_all(table, **kwargs) -> list:
+    """
+    Esegue una query DynamoDB seguendo tutte le pagine (LastEvaluatedKey)
+    """
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def bootstrap_tables():
+    """
+    Crea le tabelle mancanti e aggiunge gli indici secondari mancanti
+    alle tabelle gia' esistenti
+    """
+    dynamodb = get_client('dynamodb')
+
+    for name, definition in TABLES.items():
+        try:
+            description = dynamodb.describe_table(TableName=name)['Table']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            logger.info(f"Creating table {name}")
+            dynamodb.create_table(TableName=name, BillingMode='PAY_PER_REQUEST', **definition)
+            dynamodb.get_waiter('table_exists').wait(TableName=name)
+            continue
+
+        existing = {index['IndexName'] for index in description.get('GlobalSecondaryIndexes', [])}
+        for index in definition.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] in existing:
+                continue
+            logger.info(f"Adding index {index['IndexName']} to table {name}")
+            index_attributes = {key['AttributeName'] for key in index['KeySchema']}
+            dynamodb.update_table(
+                TableName=name,
+                AttributeDefinitions=[
+                    attribute for attribute in definition['AttributeDefinitions']
+                    if attribute['AttributeName'] in index_attributes
+                ],
+                GlobalSecondaryIndexUpdates=[{'Create': index}],
+            )
+            # DynamoDB consente la creazione di un solo GSI alla volta per tabella
+            _wait_for_indexes(dynamodb, name)
+
+
+def _wait_for_indexes(dynamodb, name: str):
+    waiter = dynamodb.get_waiter('table_exists')
+    while True:
+        waiter.wait(TableName=name)
+        description = dynamodb.describe_table(TableName=name)['Table']
+        statuses = [index['IndexStatus'] for index in description.get('GlobalSecondaryIndexes', [])]
+        if all(status == 'ACTIVE' for status in statuses):
+            return
+        logger.info(f"Waiting for indexes of {name}: {statuses}")
+        time.sleep(5)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    bootstrap_tables()
@@ -0,0 +1,308 @@
+##
+
+import os
+import re
+import json
+import time
+import logging
+from functools import lru_cache
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from . import stats
+from .events import StatusBroker, publish_status_change
+from .file import update_file_status, get_file_transcription
+from .tables import FILES_TABLE
+from ..utils.aws import get_client, get_table
+from ..utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "lambda": invoca lambda-audio-transcribe in modo asincrono (InvocationType='Event')
+# "transcribe": avvia direttamente il job con start_transcription_job
+TRANSCRIPTION_STARTER = os.getenv("TRANSCRIPTION_STARTER", "lambda")
+# Per quanto tenere in memoria lo stato finale (COMPLETED/FAILED) di un job Transcribe
+TRANSCRIPTION_STATUS_CACHE_TTL = int(os.getenv("TRANSCRIPTION_STATUS_CACHE_TTL", 300))
+# Dopo quanti secondi un file rimasto QUEUED (avvio fallito a meta') puo' essere riavviato
+TRANSCRIPTION_CLAIM_TIMEOUT = int(os.getenv("TRANSCRIPTION_CLAIM_TIMEOUT", 900))
+# Dopo quanti secondi dall'avvio un job registrato ma inesistente su Transcribe viene segnalato
+TRANSCRIPTION_JOB_MISSING_AFTER = int(os.getenv("TRANSCRIPTION_JOB_MISSING_AFTER", 120))
+
+files_table = get_table(FILES_TABLE)
+
+TERMINAL_JOB_STATES = ('COMPLETED', 'FAILED')
+_terminal_jobs = LRUCache(max_size=10000, ttl=TRANSCRIPTION_STATUS_CACHE_TTL)
+# Job gia' segnalati come inesistenti (un warning per job)
+_missing_jobs = LRUCache(max_size=10000)
+
+
+class TranscriptionAlreadyRunning(Exception):
+    pass
+
+
+class LambdaTranscriptionStarter:
+    """
+    Avvia la trascrizione tramite lambda-audio-transcribe senza attenderne la fine.
+
+    Contratto con la lambda: il payload e' {"body": {bucket, key, username, job_name}}
+    e la lambda deve avviare il job Transcribe con TranscriptionJobName = body.job_name
+    (lo stato si legge per quel nome). Con una lambda che sceglie un proprio nome
+    lo stato non si trova e check_transcription_status lo segnala nei log.
+    """
+
+    def __init__(self, client=None, function_name: str = None):
+        self.client = client or get_client('lambda')
+        self.function_name = function_name or os.getenv("LAMBDA_FUNCTION_NAME", "lambda-audio-transcribe")
+
+    def start(self, job_name: str, bucket: str, key: str, username: str, file_id: str):
+        payload = {
+            "body": {
+                "bucket": bucket,
+                "key": key,
+                "username": username,
+                "job_name": job_name
+            }
+        }
+        response = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+        if response.get('StatusCode') != 202:
+            raise RuntimeError(f"Lambda invocation returned {response.get('StatusCode')}")
+
+
+class TranscribeTranscriptionStarter:
+    """
+    Avvia direttamente il job AWS Transcribe, scrivendo il risultato dove
+    get_file_transcription lo cerca ({username}/{file_id}.json nel bucket di output)
+    """
+
+    def __init__(self, client=None, output_bucket: str = None):
+        self.client = client or get_client('transcribe')
+        self.output_bucket = output_bucket or os.getenv("S3_OUTPUT_BUCKET", "cc-transcribe-output")
+
+    def start(self, job_name: str, bucket: str, key: str, username: str, file_id: str):
+        try:
+            self.client.start_transcription_job(
+                TranscriptionJobName=job_name,
+                Media={'MediaFileUri': f"s3://{bucket}/{key}"},
+                OutputBucketName=self.output_bucket,
+                OutputKey=f"{username}/{file_id}.json",
+                IdentifyLanguage=True
+            )
+        except ClientError as e:
+            # I nomi sono unici per avvio: il job esiste gia' perche' un tentativo
+            # precedente (es. un job ritentato dal worker) lo ha avviato
+            if e.response['Error']['Code'] != 'ConflictException':
+                raise
+            logger.info(f"Transcription job {job_name} already started")
+
+
+STARTERS = {
+    "lambda": LambdaTranscriptionStarter,
+    "transcribe": TranscribeTranscriptionStarter,
+}
+
+
+@lru_cache(maxsize=None)
+def get_transcription_starter():
+    """
+    Starter configurato con TRANSCRIPTION_STARTER; come dipendenza FastAPI
+    si puo' sostituire (dependency_overrides) con un fake locale
+    """
+    return STARTERS[TRANSCRIPTION_STARTER]()
+
+
+def transcription_job_name(file_id: str) -> str:
+    # I nomi dei job Transcribe sono unici per account: un nuovo avvio richiede un nuovo nome
+    return re.sub(r'[^0-9a-zA-Z._-]', '-', f"hearly-{file_id}-{int(time.time())}")
+
+
+def claim_transcription(username: str, file_id: str, job_name: str) -> dict:
+    """
+    Porta il file in QUEUED registrando il nome del job, solo se non c'e' gia'
+    una trascrizione in coda o in corso. Restituisce l'item precedente.
+    """
+    now = int(time.time())
+    try:
+        response = files_table.update_item(
+            Key={'user_id': username, 'file_id': file_id},
+            UpdateExpression="SET #status = :queued, job_name = :job, job_started_at = :now",
+            ConditionExpression=(
+                "attribute_exists(file_id) AND ("
+                "NOT #status IN (:queued, :in_progress) "
+                "OR (#status = :queued AND job_started_at < :stale))"
+            ),
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":queued": "QUEUED",
+                ":in_progress": "IN_PROGRESS",
+                ":job": job_name,
+                ":now": now,
+                ":stale": now - TRANSCRIPTION_CLAIM_TIMEOUT,
+            },
+            ReturnValues='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise TranscriptionAlreadyRunning(file_id)
+        raise
+
+    old_item = response.get('Attributes', {})
+    stats.record_status_change(username, old_item, {**old_item, 'status': 'QUEUED'})
+    return old_item
+
+
+def mark_in_progress(username: str, file_id: str, job_name: str):
+    # Condizionale: se il job e' gia' terminato (o e' stato riavviato) lo stato non va sovrascritto
+    try:
+        files_table.update_item(
+            Key={'user_id': username, 'file_id': file_id},
+            UpdateExpression="SET #status = :in_progress",
+            ConditionExpression="#status = :queued AND job_name = :job",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":in_progress": "IN_PROGRESS", ":queued": "QUEUED", ":job": job_name}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def release_claim(username: str, file_id: str, job_name: str, status: str):
+    """
+    Riporta allo stato `status` un file ancora QUEUED per questo job
+    (avvio fallito): se nel frattempo e' stato riavviato non cambia nulla
+    """
+    try:
+        response = files_table.update_item(
+            Key={'user_id': username, 'file_id': file_id},
+            UpdateExpression="SET #status = :status",
+            ConditionExpression="#status = :queued AND job_name = :job",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":status": status, ":queued": "QUEUED", ":job": job_name},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    item = response['Attributes']
+    stats.record_status_change(username, {**item, 'status': 'QUEUED'}, item)
+    publish_status_change(username, file_id, status)
+
+
+def launch_transcription(username: str, file_id: str, bucket: str, key: str, job_name: str, starter=None):
+    """ Avvia il job di un file gia' portato in QUEUED da claim_transcription """
+    starter = starter or get_transcription_starter()
+    starter.start(job_name, bucket, key, username, file_id)
+    mark_in_progress(username, file_id, job_name)
+    logger.info(f"Transcription job {job_name} started for file {file_id}")
+
+
+def start_transcription(username: str, file_id: str, bucket: str, key: str, starter=None) -> str:
+    """
+    Avvia la trascrizione senza attenderne la fine: QUEUED (condizionale) ->
+    avvio del job -> IN_PROGRESS. Se l'avvio fallisce il file torna allo stato precedente.
+    Restituisce il nome del job.
+    """
+    job_name = transcription_job_name(file_id)
+    old_item = claim_transcription(username, file_id, job_name)
+
+    try:
+        launch_transcription(username, file_id, bucket, key, job_name, starter)
+    except Exception:
+        logger.exception(f"Error starting transcription job {job_name}")
+        release_claim(username, file_id, job_name, old_item.get('status', 'PENDING'))
+        raise
+
+    return job_name
+
+
+def get_job_status(job_name: str) -> str:
+    """
+    Stato di un job Transcribe letto per nome (None se il job non esiste).
+    Gli stati finali restano in cache, cosi' il polling di un job concluso
+    non richiama Transcribe.
+    """
+    status = _terminal_jobs.get(job_name)
+    if status is not None:
+        return status
+
+    try:
+        job = get_client('transcribe').get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'BadRequestException':
+            return None
+        raise
+
+    status = job['TranscriptionJobStatus']
+    if status in TERMINAL_JOB_STATES:
+        _terminal_jobs.set(job_name, status)
+    return status
+
+
+def warn_missing_job(job_name: str, started_at=None):
+    """
+    Segnala (una volta per job) un job registrato sull'item che Transcribe non
+    conosce. Subito dopo l'avvio asincrono e' normale; se persiste di solito
+    lo starter ha avviato il job con un altro nome.
+    """
+    if started_at is not None and time.time() - int(started_at) < TRANSCRIPTION_JOB_MISSING_AFTER:
+        return
+    if _missing_jobs.get(job_name) is not None:
+        return
+    _missing_jobs.set(job_name, True)
+    logger.warning(
+        f"Transcription job {job_name} not found on Transcribe; "
+        f"check that the {TRANSCRIPTION_STARTER} starter uses the job_name it receives"
+    )
+
+
+def check_transcription_status(username: str, file_id: str) -> dict:
+    """
+    Stato della trascrizione di un file: usa lo stato salvato sull'item se finale,
+    altrimenti interroga il job registrato all'avvio (job_name) e salva l'esito finale
+    """
+    item = files_table.get_item(
+        Key={'user_id': username, 'file_id': file_id},
+        ProjectionExpression="#status, job_name, job_started_at",
+        ExpressionAttributeNames={"#status": "status"}
+    ).get('Item', {})
+    item_status = item.get('status')
+    job_name = item.get('job_name')
+
+    if item_status == 'FAILED':
+        return {"status": "FAILED", "message": "Transcription failed", "file_id": file_id}
+
+    job_status = item_status if item_status == 'COMPLETED' else None
+    if job_status is None and job_name:
+        job_status = get_job_status(job_name)
+        if job_status is None:
+            warn_missing_job(job_name, item.get('job_started_at'))
+        if job_status in TERMINAL_JOB_STATES:
+            update_file_status(username, file_id, job_status)
+
+    if job_status == 'FAILED':
+        return {"status": "FAILED", "message": "Transcription failed", "file_id": file_id}
+    if job_status and job_status != 'COMPLETED':
+        return {"status": job_status, "message": f"Processing in progress: {job_status}"}
+
+    transcription = get_file_transcription(file_id, username)
+    if transcription:
+        return transcription
+    if job_status == 'COMPLETED':
+        return {"status": job_status, "message": "Trascrizione in corso..."}
+    return {"status": "UNKNOWN", "message": "Trascrizione in corso..."}
+
+
+@lru_cache(maxsize=None)
+def get_status_broker() -> StatusBroker:
+    """
+    Broker condiviso dagli endpoint di attesa (SSE e long-poll): un solo
+    check_transcription_status per file, qualunque sia il numero di client
+    """
+    return StatusBroker(check_transcription_status)
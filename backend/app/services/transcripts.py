@@ -0,0 +1,283 @@
+##
+
+import os
+import sys
+import json
+import re
+import hashlib
+import logging
+import tempfile
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from ..utils.aws import get_client
+from ..utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Memoria massima (byte) per le trascrizioni estratte tenute in processo
+TRANSCRIPT_CACHE_BYTES = int(os.getenv("TRANSCRIPT_CACHE_BYTES", 64 * 1024 * 1024))
+# Directory della cache su disco (vuota = disabilitata)
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "")
+# Dimensione dei blocchi letti dall'output di Transcribe
+TRANSCRIPT_CHUNK_SIZE = int(os.getenv("TRANSCRIPT_CHUNK_SIZE", 64 * 1024))
+
+s3 = get_client('s3')
+
+
+def _entry_size(entry: dict) -> int:
+    return sys.getsizeof(entry['transcript']) + sys.getsizeof(entry['etag'])
+
+
+_memory = LRUCache(max_size=100000, max_weight=TRANSCRIPT_CACHE_BYTES, weigher=_entry_size)
+
+
+def _nested_pattern(levels: int) -> bytes:
+    # Quantificatori possessivi: il motore regex non conserva stato di backtracking
+    string = rb'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+    atom = rb'(?:[^"\[\]{}]++|' + string + rb')'
+    pattern = atom
+    for _ in range(levels):
+        pattern = rb'(?:' + atom + rb'|[\[{](?:' + pattern + rb')*+[\]}])'
+    return pattern
+
+
+class _JSONStream:
+    """
+    Tokenizer JSON incrementale: legge lo stream a blocchi e tiene in memoria
+    solo il blocco corrente (piu' il token in lettura)
+    """
+
+    # inizio di una stringa | punteggiatura | scalare
+    TOKEN = re.compile(rb'\s*(?:(")|([\[\]{}:,])|([^\s"\[\]{}:,]+))')
+    # Per saltare un valore: contenuto senza parentesi, stringhe complete e
+    # sotto-strutture annidate fino a 3 livelli (es. gli elementi di `items`)
+    # vengono consumati in un'unica match; il resto parentesi per parentesi
+    SKIP = re.compile(rb'(?:' + _nested_pattern(3) + rb')*+', re.S)
+
+    def __init__(self, body, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+        self.pushed = None
+
+    def _more(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.body.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _match(self, pattern):
+        while True:
+            m = pattern.match(self.buf, self.pos)
+            # Uno scalare che arriva a fine buffer potrebbe continuare nel blocco successivo
+            if m is not None and (self.eof or m.end() < len(self.buf)):
+                self.pos = m.end()
+                return m
+            if not self._more() and m is None:
+                raise ValueError("Truncated JSON document")
+
+    def _string(self) -> bytes:
+        """ Stringa JSON grezza (virgolette incluse) che inizia in self.pos """
+        offset = 1
+        while True:
+            end = self.buf.find(b'"', self.pos + offset)
+            if end < 0:
+                offset = len(self.buf) - self.pos
+                if not self._more():
+                    raise ValueError("Truncated JSON document")
+                continue
+            start = end
+            while self.buf[start - 1] == 0x5c:  # backslash
+                start -= 1
+            if (end - start) % 2 == 0:
+                raw = self.buf[self.pos:end + 1]
+                self.pos = end + 1
+                return raw
+            offset = end + 1 - self.pos
+
+    def token(self) -> tuple:
+        if self.pushed is not None:
+            token, self.pushed = self.pushed, None
+            return token
+        m = self._match(self.TOKEN)
+        if m.group(1) is not None:
+            self.pos = m.start(1)
+            return 'string', self._string()
+        if m.group(2) is not None:
+            return m.group(2).decode(), None
+        return 'scalar', m.group(3)
+
+    def expect(self, kind: str):
+        found, _ = self.token()
+        if found != kind:
+            raise ValueError(f"Expected {kind!r}, found {found!r}")
+
+    def skip(self):
+        kind, _ = self.token()
+        if kind not in ('{', '['):
+            return
+        depth = 1
+        while depth:
+            self.pos = self.SKIP.match(self.buf, self.pos).end()
+            # Fine del buffer o stringa troncata: serve il blocco successivo
+            if self.pos == len(self.buf) or self.buf[self.pos] == ord('"'):
+                if not self._more():
+                    raise ValueError("Truncated JSON document")
+                continue
+            depth += 1 if self.buf[self.pos] in b'[{' else -1
+            self.pos += 1
+
+    def string(self):
+        kind, raw = self.token()
+        if kind == 'string':
+            return json.loads(raw)
+        if kind in ('{', '['):
+            self.pushed = (kind, raw)
+            self.skip()
+        return None
+
+    def keys(self):
+        """ Chiavi di un oggetto: per ognuna il chiamante deve consumare il valore """
+        self.expect('{')
+        kind, raw = self.token()
+        while kind != '}':
+            if kind != 'string':
+                raise ValueError(f"Expected object key, found {kind!r}")
+            self.expect(':')
+            yield json.loads(raw)
+            kind, raw = self.token()
+            if kind == ',':
+                kind, raw = self.token()
+
+    def elements(self):
+        """ Elementi di un array: per ognuno il chiamante deve consumare il valore """
+        self.expect('[')
+        kind, raw = self.token()
+        index = 0
+        while kind != ']':
+            self.pushed = (kind, raw)
+            yield index
+            index += 1
+            kind, raw = self.token()
+            if kind == ',':
+                kind, raw = self.token()
+
+
+def parse_transcribe_output(body, chunk_size: int = TRANSCRIPT_CHUNK_SIZE) -> tuple:
+    """
+    Testo e lingua dall'output JSON di AWS Transcribe, letto in streaming:
+    l'array `items` (la quasi totalita' del documento) viene saltato senza
+    costruirne gli oggetti e la lettura si ferma appena i due campi sono noti
+    """
+    stream = _JSONStream(body, chunk_size)
+    transcript = None
+    language = None
+
+    for key in stream.keys():
+        if key != 'results':
+            stream.skip()
+            continue
+        for result_key in stream.keys():
+            if result_key == 'language_code':
+                language = stream.string()
+            elif result_key == 'transcripts':
+                for index in stream.elements():
+                    if index > 0:
+                        stream.skip()
+                        continue
+                    for transcript_key in stream.keys():
+                        if transcript_key == 'transcript':
+                            transcript = stream.string()
+                        else:
+                            stream.skip()
+            else:
+                stream.skip()
+            if transcript is not None and language is not None:
+                return transcript, language
+        break
+
+    return transcript or "", language or 'und'
+
+
+def _disk_path(bucket: str, key: str) -> str:
+    name = hashlib.sha256(f"{bucket}/{key}".encode('utf-8')).hexdigest()
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{name}.json")
+
+
+def _disk_get(bucket: str, key: str) -> dict:
+    if not TRANSCRIPT_CACHE_DIR:
+        return None
+    try:
+        with open(_disk_path(bucket, key), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Transcript cache entry for {key} unreadable: {str(e)}")
+        return None
+
+
+def _disk_set(bucket: str, key: str, entry: dict):
+    if not TRANSCRIPT_CACHE_DIR:
+        return
+    try:
+        os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+        # Scrittura atomica: chi legge vede il file vecchio o quello nuovo, mai a meta'
+        fd, tmp_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _disk_path(bucket, key))
+    except OSError as e:
+        logger.warning(f"Error writing transcript cache for {key}: {str(e)}")
+
+
+def get_transcript(bucket: str, key: str) -> tuple:
+    """
+    (transcript, language, cached) per l'output di Transcribe in bucket/key.
+    La copia in cache (memoria, poi disco) viene validata con un GET
+    condizionale sull'ETag: se l'oggetto non e' cambiato S3 risponde 304
+    senza corpo e il JSON non viene riscaricato ne' rianalizzato.
+    Solleva NoSuchKey se l'oggetto non esiste.
+    """
+    entry = _memory.get((bucket, key)) or _disk_get(bucket, key)
+
+    request = {'Bucket': bucket, 'Key': key}
+    if entry:
+        request['IfNoneMatch'] = entry['etag']
+    try:
+        response = s3.get_object(**request)
+    except ClientError as e:
+        if entry and e.response['Error']['Code'] in ('304', 'NotModified'):
+            _memory.set((bucket, key), entry)
+            return entry['transcript'], entry['language'], True
+        raise
+
+    try:
+        transcript, language = parse_transcribe_output(response['Body'])
+    finally:
+        # La lettura puo' fermarsi prima della fine del documento
+        response['Body'].close()
+    entry = {'etag': response['ETag'], 'transcript': transcript, 'language': language}
+    _memory.set((bucket, key), entry)
+    _disk_set(bucket, key, entry)
+    return transcript, language, False
+
+
+def invalidate_transcript(bucket: str, key: str):
+    _memory.pop((bucket, key))
+    if TRANSCRIPT_CACHE_DIR:
+        try:
+            os.remove(_disk_path(bucket, key))
+        except FileNotFoundError:
+            pass
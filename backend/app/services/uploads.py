@@ -0,0 +1,231 @@
+##
+
+import io
+import os
+import math
+import hashlib
+import logging
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from .audio import probe_audio_duration
+from .file import bucket_name, upload_chunk_size, find_original, register_file, save_duplicate
+from ..utils.aws import get_client
+from ..utils.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Validita' degli URL firmati per il caricamento delle parti
+UPLOAD_URL_EXPIRATION = int(os.getenv("UPLOAD_URL_EXPIRATION", 3600))
+# Byte letti per ogni GET con Range durante il probe della durata
+RANGE_READ_SIZE = int(os.getenv("RANGE_READ_SIZE", 64 * 1024))
+# Limiti S3 del multipart upload
+MAX_PARTS = 10000
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+
+s3 = get_client('s3')
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    File in sola lettura su un oggetto S3: ogni lettura diventa un GET con Range
+    (a blocchi di almeno `block_size`, l'ultimo blocco resta in memoria), cosi'
+    il probe della durata scarica solo i byte che legge davvero
+    """
+
+    def __init__(self, bucket: str, key: str, size: int = None, block_size: int = RANGE_READ_SIZE, client=None):
+        self.client = client or s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else self.client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.block_size = block_size
+        self.name = key
+        self.requests = 0
+        self._pos = 0
+        self._block_start = 0
+        self._block = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        self.requests += 1
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}")
+        return response['Body'].read()
+
+    def read(self, size=-1):
+        start = self._pos
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        if start >= end:
+            return b""
+
+        block_end = self._block_start + len(self._block)
+        if self._block_start <= start and end <= block_end:
+            data = self._block[start - self._block_start:end - self._block_start]
+        else:
+            fetch_end = min(max(end, start + self.block_size), self.size)
+            self._block = self._fetch(start, fetch_end)
+            self._block_start = start
+            data = self._block[:end - start]
+
+        self._pos = start + len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def upload_key(username: str, file_id: str, filename: str) -> str:
+    # Stessa chiave degli upload tramite /upload/: il prefisso e' sempre quello dell'utente
+    return f"{username}/{file_id}_{filename}"
+
+
+def part_size_for(size: int) -> int:
+    """ Dimensione delle parti: almeno UPLOAD_CHUNK_SIZE, al piu' MAX_PARTS parti """
+    part_size = max(upload_chunk_size, math.ceil(size / MAX_PARTS))
+    if part_size > MAX_PART_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    return part_size
+
+
+def presign_part_urls(key: str, upload_id: str, part_count: int) -> list:
+    return [
+        {
+            "part_number": part_number,
+            "url": s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': bucket_name, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+                ExpiresIn=UPLOAD_URL_EXPIRATION,
+            ),
+        }
+        for part_number in range(1, part_count + 1)
+    ]
+
+
+async def initiate_upload(username: str, filename: str, size: int) -> dict:
+    """
+    Avvia un multipart upload diretto su S3 e restituisce gli URL firmati delle
+    parti. Un hash dichiarato dal client non basta per saltare l'upload: il
+    contenuto si confronta solo dopo averlo ricevuto (complete_upload).
+    """
+    file_id = str(uuid4())
+    key = upload_key(username, file_id, filename)
+    part_size = part_size_for(size)
+
+    try:
+        upload = await run_blocking(s3.create_multipart_upload, Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        logger.error(f"Error creating multipart upload for {key}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Errore durante il caricamento su S3: {str(e)}")
+
+    parts = await run_blocking(presign_part_urls, key, upload['UploadId'], math.ceil(size / part_size))
+    logger.info(f"Direct upload {upload['UploadId']} started for {key} ({len(parts)} parts)")
+    return {
+        "file_id": file_id,
+        "upload_id": upload['UploadId'],
+        "part_size": part_size,
+        "parts": parts,
+        "expires_in": UPLOAD_URL_EXPIRATION,
+    }
+
+
+def hash_s3_object(bucket: str, key: str) -> str:
+    """ SHA-256 di un oggetto S3, letto in streaming a blocchi """
+    sha256 = hashlib.sha256()
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    try:
+        for chunk in body.iter_chunks(upload_chunk_size):
+            sha256.update(chunk)
+    finally:
+        body.close()
+    return sha256.hexdigest()
+
+
+def probe_s3_duration(key: str, filename: str) -> float:
+    """ Durata dell'audio leggendo da S3 con GET parziali solo header e coda """
+    fileobj = S3RangeFile(bucket_name, key)
+    try:
+        duration = probe_audio_duration(fileobj, filename)
+    except Exception as e:
+        logger.error(f"Errore nel calcolo della durata di {key}: {str(e)}")
+        return 0.0
+    logger.info(f"Durata di {key}: {duration:.2f}s con {fileobj.requests} GET parziali su {fileobj.size} byte")
+    return duration
+
+
+async def complete_upload(username: str, file_id: str, upload_id: str, filename: str,
+                          parts: list, sha256_hash: str = None) -> dict:
+    """
+    Chiude il multipart upload, calcola la durata con GET parziali e salva i
+    metadati del file. `parts` e' la lista di (part_number, etag) caricate dal client.
+    Con `sha256` il client chiede la deduplica: l'hash viene ricalcolato
+    sull'oggetto caricato e solo quello entra nell'indice dei duplicati.
+    """
+    key = upload_key(username, file_id, filename)
+    try:
+        await run_blocking(
+            s3.complete_multipart_upload,
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': part_number, 'ETag': etag} for part_number, etag in sorted(parts)
+            ]},
+        )
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('NoSuchUpload', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+            raise HTTPException(status_code=400, detail=f"Upload non valido: {code}")
+        raise HTTPException(status_code=500, detail=f"Errore durante il caricamento su S3: {str(e)}")
+
+    if sha256_hash:
+        declared_hash = sha256_hash.lower()
+        try:
+            sha256_hash = await run_blocking(hash_s3_object, bucket_name, key)
+        except ClientError as e:
+            # Senza hash verificato il file si salva come nuovo, fuori dall'indice
+            logger.warning(f"Error hashing {key}, skipping deduplication: {str(e)}")
+            sha256_hash = None
+        if sha256_hash and sha256_hash != declared_hash:
+            logger.warning(f"sha256 declared for {key} does not match the uploaded content, using the computed one")
+    if sha256_hash:
+        # Stesso contenuto gia' caricato: si tiene l'oggetto esistente
+        original = await run_blocking(find_original, username, sha256_hash)
+        if original:
+            await run_blocking(s3.delete_object, Bucket=bucket_name, Key=key)
+            return {"duplicate": True, **await save_duplicate(filename, username, original, sha256_hash)}
+
+    duration_seconds = await run_blocking(probe_s3_duration, key, filename)
+    return {"duplicate": False, **await register_file(username, file_id, filename, key, sha256_hash, duration_seconds)}
+
+
+async def abort_upload(username: str, file_id: str, upload_id: str, filename: str):
+    key = upload_key(username, file_id, filename)
+    try:
+        await run_blocking(s3.abort_multipart_upload, Bucket=bucket_name, Key=key, UploadId=upload_id)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            raise HTTPException(status_code=500, detail=f"Error aborting upload: {str(e)}")
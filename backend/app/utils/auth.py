@@ -1,7 +1,187 @@
-from jose import jwt
+##
+
 import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.request
+
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException
+from jose import jwk, jwt
+from jose.exceptions import JOSEError
+
+from .cache import LRUCache
+from .concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+AWS_REGION_NAME = os.getenv("AWS_REGION", "").replace('"', '')
+AWS_COGNITO_APP_CLIENT_ID = os.getenv("AWS_COGNITO_APP_CLIENT_ID", "").replace('"', '')
+AWS_COGNITO_USER_POOL_ID = os.getenv("AWS_COGNITO_USER_POOL_ID", "").replace('"', '')
+# "false" solo in sviluppo locale senza user pool: i claim vengono letti senza verificare la firma
+AUTH_VERIFY_TOKENS = os.getenv("AUTH_VERIFY_TOKENS", "true").lower() != "false"
+# Numero massimo di token gia' verificati tenuti in memoria (fino alla loro scadenza)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+# Intervallo minimo tra due download del JWKS causati da kid sconosciuti
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", 60))
+
+ALGORITHMS = ['RS256']
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def cognito_issuer(region: str = AWS_REGION_NAME, user_pool_id: str = AWS_COGNITO_USER_POOL_ID) -> str:
+    return f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+
+
+def fetch_jwks(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+class JWKSCache:
+    """
+    Chiavi pubbliche dello user pool, scaricate una volta sola. Un kid
+    sconosciuto (rotazione delle chiavi) provoca un nuovo download, al piu'
+    uno ogni `min_refresh_interval` secondi.
+    """
+
+    def __init__(self, url: str, fetch=fetch_jwks, min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.fetch = fetch
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        jwks = self.fetch(self.url)
+        self.keys = {key['kid']: jwk.construct(key, key.get('alg', 'RS256')) for key in jwks.get('keys', [])}
+        self.refreshed_at = time.monotonic()
+        logger.info(f"JWKS loaded from {self.url} ({len(self.keys)} keys)")
+
+    def get_key(self, kid: str):
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        with self._lock:
+            key = self.keys.get(kid)
+            if key is None and (self.refreshed_at is None or
+                                time.monotonic() - self.refreshed_at >= self.min_refresh_interval):
+                self.refresh()
+                key = self.keys.get(kid)
+        if key is None:
+            raise InvalidToken(f"Unknown signing key {kid}")
+        return key
+
+
+class TokenVerifier:
+    """
+    Verifica firma, issuer, scadenza e client dei token Cognito (access o id).
+    I claim dei token gia' verificati restano in una LRU indicizzata
+    dall'hash del token fino a `exp`: le richieste successive non rifanno
+    la verifica RSA.
+    """
+
+    def __init__(self, jwks: JWKSCache, issuer: str, client_id: str = None,
+                 cache_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.jwks = jwks
+        self.issuer = issuer
+        self.client_id = client_id
+        self._verified = LRUCache(max_size=cache_size)
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def cached(self, token: str) -> dict:
+        return self._verified.get(self.token_key(token))
+
+    def verify(self, token: str) -> dict:
+        key = self.token_key(token)
+        claims = self._verified.get(key)
+        if claims is not None:
+            return claims
+
+        try:
+            header = jwt.get_unverified_header(token)
+            claims = jwt.decode(
+                token,
+                self.jwks.get_key(header.get('kid')),
+                algorithms=ALGORITHMS,
+                issuer=self.issuer,
+                # L'access token di Cognito non ha `aud`: il client si controlla sotto.
+                # Senza `exp` il token non scadrebbe mai: va rifiutato
+                options={'verify_aud': False, 'verify_at_hash': False, 'require_exp': True},
+            )
+        except JOSEError as e:
+            raise InvalidToken(str(e))
+
+        token_use = claims.get('token_use')
+        if token_use not in ('access', 'id'):
+            raise InvalidToken(f"Unexpected token_use {token_use!r}")
+        client_id = claims.get('client_id') if token_use == 'access' else claims.get('aud')
+        if self.client_id and client_id != self.client_id:
+            raise InvalidToken("Token issued for another client")
+
+        ttl = claims['exp'] - time.time()
+        if ttl > 0:
+            self._verified.set(key, claims, ttl=ttl)
+        return claims
+
+
+_verifier = None
+
+
+def get_token_verifier() -> TokenVerifier:
+    global _verifier
+    if _verifier is None:
+        issuer = cognito_issuer()
+        _verifier = TokenVerifier(JWKSCache(f"{issuer}/.well-known/jwks.json"), issuer, AWS_COGNITO_APP_CLIENT_ID)
+    return _verifier
+
+
+def set_token_verifier(verifier: TokenVerifier):
+    # Per sostituire lo user pool (es. una coppia di chiavi locale)
+    global _verifier
+    _verifier = verifier
+
+
+def username_from_claims(claims: dict) -> str:
+    return claims.get("username") or claims.get("cognito:username")
+
+
+async def get_current_username(authorization: str = Header(None)) -> str:
+    """
+    Dipendenza FastAPI: utente del bearer token verificato (401 se assente o non valido).
+    Un token gia' verificato viene risolto dalla cache senza lasciare l'event loop.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing token")
+    token = authorization.split(" ")[1]
 
-def get_username_from_token(token: str) -> str:
+    try:
+        if not AUTH_VERIFY_TOKENS:
+            claims = jwt.get_unverified_claims(token)
+        else:
+            verifier = get_token_verifier()
+            # Alla prima verifica puo' servire il download del JWKS
+            claims = verifier.cached(token) or await run_blocking(verifier.verify, token)
+    except (InvalidToken, JOSEError) as e:
+        logger.warning(f"Rejected token: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading JWKS: {str(e)}")
+        raise HTTPException(status_code=503, detail="Authentication unavailable")
 
-    payload = jwt.get_unverified_claims(token)
-    return payload.get("username") or payload.get("cognito:username")
\ No newline at end of file
+    username = username_from_claims(claims)
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return username
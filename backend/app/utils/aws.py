@@ -0,0 +1,88 @@
+##
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Un solo client (thread-safe) per coppia (servizio, regione) per tutto il processo:
+# costruire un client boto3 carica i modelli di botocore e costa millisecondi.
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50))
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", 5))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_resources = {}
+
+
+def default_region() -> str:
+    return os.getenv("AWS_REGION", "").replace('"', '')
+
+
+def client_config() -> Config:
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": AWS_RETRY_MODE},
+        tcp_keepalive=True,
+    )
+
+
+def _get_session():
+    # boto3.Session non e' thread-safe: va usata solo sotto _lock
+    global _session
+    if _session is None:
+        _session = boto3.session.Session(
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID") or None,
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY") or None,
+        )
+    return _session
+
+
+def get_client(service: str, region: str = None):
+    """
+    Restituisce il client condiviso per il servizio AWS, creandolo alla prima richiesta
+    """
+    key = (service, region or default_region())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _get_session().client(service, region_name=key[1], config=client_config())
+                _clients[key] = client
+    return client
+
+
+def get_resource(service: str, region: str = None):
+    """
+    Restituisce la resource boto3 condivisa per il servizio AWS (es. dynamodb)
+    """
+    key = (service, region or default_region())
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = _get_session().resource(service, region_name=key[1], config=client_config())
+                _resources[key] = resource
+    return resource
+
+
+def get_table(name: str, region: str = None):
+    return get_resource("dynamodb", region).Table(name)
+
+
+
+def get_credentials():
+    """
+    Credenziali correnti della sessione condivisa (per firmare URL in locale)
+    """
+    with _lock:
+        credentials = _get_session().get_credentials()
+    return credentials.get_frozen_credentials() if credentials else None
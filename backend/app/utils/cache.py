@@ -0,0 +1,70 @@
+##
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe a dimensione limitata, con scadenza opzionale per elemento.
+    Con `max_weight` e `weigher` il limite e' anche sul peso totale (es. byte).
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None, max_weight: int = None, weigher=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weigh(self, value) -> int:
+        return self.weigher(value) if self.weigher else 0
+
+    def _remove(self, key):
+        value, _ = self._data.pop(key)
+        self.weight -= self._weigh(value)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        weight = self._weigh(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+            self._data[key] = (value, expires_at)
+            self.weight += weight
+            while len(self._data) > self.max_size or (
+                    self.max_weight is not None and self.weight > self.max_weight):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
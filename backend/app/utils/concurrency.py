@@ -0,0 +1,47 @@
+##
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool dedicato alle chiamate bloccanti (boto3) fatte dagli endpoint async:
+# l'event loop resta libero mentre la richiesta AWS e' in volo
+AWS_IO_WORKERS = int(os.getenv("AWS_IO_WORKERS", 32))
+
+_executor = ThreadPoolExecutor(max_workers=AWS_IO_WORKERS, thread_name_prefix="aws-io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Esegue una funzione sincrona nel pool AWS e ne attende il risultato
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class SingleFlight:
+    """
+    Esecuzioni concorrenti con la stessa chiave condividono un'unica coroutine:
+    chi arriva mentre e' in corso ne attende il risultato
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: se un client si disconnette l'esecuzione continua per gli altri
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
@@ -0,0 +1,33 @@
+##
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket asincrono: `rate` unita' al secondo fino a `capacity`.
+    acquire(n) attende finche' le n unita' sono disponibili (in ordine di arrivo).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float):
+        # Una richiesta piu' grande della capacita' aspetta il bucket pieno
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
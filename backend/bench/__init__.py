@@ -0,0 +1,13 @@
+##
+"""
+Micro-benchmark da lanciare dalla cartella backend: python -m bench.<nome>
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# I moduli di app creano i client AWS all'import: senza .env basta una regione
+os.environ.setdefault("AWS_REGION", "eu-west-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION"])
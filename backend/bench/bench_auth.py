@@ -0,0 +1,89 @@
+##
+"""
+Costo per richiesta della dipendenza get_current_username: claim letti
+senza verifica (comportamento precedente), verifica RSA di un token mai
+visto e token gia' verificato servito dalla cache.
+
+    python -m bench.bench_auth [--requests 2000]
+
+Lo user pool e' sostituito da una coppia di chiavi locale: nessuna rete.
+"""
+
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from app.utils import auth
+from app.utils.auth import JWKSCache, TokenVerifier, get_current_username, set_token_verifier
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_bench"
+CLIENT_ID = "client-bench"
+KID = "bench-key"
+
+
+def local_verifier(public_pem: str) -> TokenVerifier:
+    public_jwk = {**jwk.construct(public_pem, 'RS256').to_dict(), 'kid': KID, 'use': 'sig'}
+    return TokenVerifier(JWKSCache("https://jwks.bench", fetch=lambda url: {'keys': [public_jwk]}), ISSUER, CLIENT_ID)
+
+
+def make_tokens(private_pem: str, count: int) -> list:
+    now = int(time.time())
+    return [
+        jwt.encode(
+            {'iss': ISSUER, 'token_use': 'access', 'client_id': CLIENT_ID, 'username': f"user{i}",
+             'iat': now, 'exp': now + 3600, 'jti': str(uuid.uuid4())},
+            private_pem, algorithm='RS256', headers={'kid': KID},
+        )
+        for i in range(count)
+    ]
+
+
+async def measure(tokens: list) -> list:
+    times = []
+    for token in tokens:
+        start = time.perf_counter()
+        await get_current_username(f"Bearer {token}")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    tokens = make_tokens(private_pem, args.requests)
+
+    results = []
+    auth.AUTH_VERIFY_TOKENS = False
+    results.append(('non verificato', asyncio.run(measure(tokens))))
+    auth.AUTH_VERIFY_TOKENS = True
+    # Verificatore nuovo: ogni token e' visto per la prima volta (il JWKS e' gia' caricato)
+    verifier = local_verifier(public_pem)
+    verifier.jwks.refresh()
+    set_token_verifier(verifier)
+    results.append(('verifica a freddo', asyncio.run(measure(tokens))))
+    results.append(('cache', asyncio.run(measure(tokens))))
+
+    print(f"{'metodo':>20}{'mediana us':>14}{'p99 us':>12}{'req/s':>12}")
+    for name, times in results:
+        times.sort()
+        p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+        print(f"{name:>20}{statistics.median(times) * 1e6:>14.1f}{p99 * 1e6:>12.1f}{len(times) / sum(times):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
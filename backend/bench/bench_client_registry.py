@@ -0,0 +1,78 @@
+##
+"""
+Costo della lista file al variare del numero di file: URL firmati con un
+client boto3 nuovo per file (comportamento precedente), con il client
+condiviso del registry e con la firma in blocco di app.services.presign.
+
+    python -m bench.bench_client_registry [--counts 10 100 500] [--repeat 3]
+
+La firma e' locale: non servono rete ne' un bucket reale.
+"""
+
+import os
+import time
+import argparse
+import statistics
+
+import boto3
+
+# Credenziali fittizie se l'ambiente non ne ha: la firma non le verifica
+if not os.getenv("AWS_ACCESS_KEY_ID"):
+    os.environ["AWS_ACCESS_KEY_ID"] = "AKIDBENCHMARK"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "benchmark-secret"
+
+from app.services.presign import sign_get_urls
+from app.utils.aws import default_region, get_client
+
+BUCKET = "hearly-bench"
+
+
+def client_per_file(keys):
+    # Prima: generate_presigned_url costruiva un boto3.client('s3') a ogni chiamata
+    return [
+        boto3.client('s3', region_name=default_region()).generate_presigned_url(
+            'get_object', Params={'Bucket': BUCKET, 'Key': key}, ExpiresIn=7200
+        )
+        for key in keys
+    ]
+
+
+def shared_client(keys):
+    s3 = get_client('s3')
+    return [
+        s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET, 'Key': key}, ExpiresIn=7200)
+        for key in keys
+    ]
+
+
+def batch_signing(keys):
+    return sign_get_urls(BUCKET, keys, 7200)
+
+
+def measure(func, keys, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(keys)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Il primo client paga il caricamento dei modelli di botocore per tutti
+    get_client('s3')
+    methods = (('client per file', client_per_file), ('shared client', shared_client), ('batch', batch_signing))
+    print(f"{'file':>6}" + "".join(f"{name + ' ms':>20}" for name, _ in methods))
+    for count in args.counts:
+        keys = [f"user/{i:08d}-bench_{i}.mp3" for i in range(count)]
+        row = [measure(func, keys, args.repeat) * 1000 for _, func in methods]
+        print(f"{count:>6}" + "".join(f"{value:>20.2f}" for value in row))
+
+
+if __name__ == "__main__":
+    main()
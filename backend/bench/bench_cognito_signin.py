@@ -0,0 +1,116 @@
+##
+"""
+Throughput del signin (ServiceAuth.signin) contro un cognito-idp finto:
+un AWSCognito nuovo, con il suo client boto3, a ogni richiesta e HMAC
+costruito a ogni chiamata (comportamento precedente); istanza unica con
+HMAC per chiamata; istanza unica con HMAC pre-inizializzato (attuale).
+
+    python -m bench.bench_cognito_signin [--requests 2000] [--concurrency 1 16] [--latency-ms 0]
+
+Il client finto risponde da memoria dopo --latency-ms: con 0 si misura
+solo il costo locale della richiesta, senza rete.
+"""
+
+import os
+import time
+import hmac
+import base64
+import asyncio
+import hashlib
+import argparse
+
+import boto3
+
+# Client id e secret fittizi se l'ambiente non ne ha: AWSCognito li legge all'import
+os.environ.setdefault("AWS_COGNITO_APP_CLIENT_ID", "benchclientid0000000000000")
+os.environ.setdefault("AWS_COGNITO_CLIENT_SECRET", "bench-secret-" + "x" * 40)
+
+from app.controllers import cognito
+from app.controllers.cognito import AWSCognito
+from app.models.user import UserSignin
+from app.services.auth import ServiceAuth
+from app.utils.aws import default_region
+
+AUTH_RESULT = {
+    'AuthenticationResult': {
+        'AccessToken': "access", 'RefreshToken': "refresh", 'IdToken': "id",
+        'ExpiresIn': 3600, 'TokenType': "Bearer",
+    }
+}
+
+
+class StubCognitoIdp:
+    """ cognito-idp locale: accetta ogni credenziale con SECRET_HASH """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def initiate_auth(self, ClientId, AuthFlow, AuthParameters):
+        if not AuthParameters.get('SECRET_HASH'):
+            raise ValueError("SECRET_HASH missing")
+        if self.latency:
+            time.sleep(self.latency)
+        return AUTH_RESULT
+
+
+class PerCallHmacCognito(AWSCognito):
+    def _calculate_secret_hash(self, username):
+        # Prima: hmac.new con la chiave a ogni signin
+        message = (username + self.client_id).encode('utf-8')
+        mac = hmac.new(self.client_secret.encode('utf-8'), message, digestmod=hashlib.sha256)
+        return base64.b64encode(mac.digest()).decode()
+
+
+def make_factories(stub: StubCognitoIdp):
+    def per_request():
+        # Prima: get_aws_cognito costruiva un client cognito-idp a ogni richiesta
+        instance = PerCallHmacCognito()
+        boto3.client('cognito-idp', region_name=default_region())
+        instance.client = stub
+        return instance
+
+    per_call_hmac = PerCallHmacCognito()
+    pre_keyed = AWSCognito()
+    return (
+        ('per richiesta', per_request),
+        ('hmac per chiamata', lambda: per_call_hmac),
+        ('hmac pre-chiave', lambda: pre_keyed),
+    )
+
+
+async def run_signins(factory, requests: int, concurrency: int) -> float:
+    users = [UserSignin(username=f"user{i:05d}", password="Password1!") for i in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def signin(data):
+        async with semaphore:
+            response = await ServiceAuth.signin(data, factory())
+            assert response.status_code == 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(signin(data) for data in users))
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = StubCognitoIdp(args.latency_ms / 1000)
+    # Le istanze condivise ricevono lo stub da get_client
+    cognito.get_client = lambda service, region=None: stub
+    factories = make_factories(stub)
+    # Il primo client paga il caricamento dei modelli di botocore per tutti
+    boto3.client('cognito-idp', region_name=default_region())
+
+    print(f"{'concorrenza':>12}" + "".join(f"{name + ' req/s':>24}" for name, _ in factories))
+    for concurrency in args.concurrency:
+        row = [asyncio.run(run_signins(factory, args.requests, concurrency)) for _, factory in factories]
+        print(f"{concurrency:>12}" + "".join(f"{value:>24.0f}" for value in row))
+
+
+if __name__ == "__main__":
+    main()
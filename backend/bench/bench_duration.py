@@ -0,0 +1,98 @@
+##
+"""
+Durata di un upload: probe sugli header (app.services.audio) contro la
+vecchia copia su file temporaneo letta da mutagen.
+
+    python -m bench.bench_duration [--sizes 10 100 500] [--repeat 5]
+
+Per ogni formato e dimensione (MB) riporta il tempo medio e i byte letti.
+"""
+
+import io
+import os
+import time
+import wave
+import argparse
+import tempfile
+import statistics
+
+from mutagen import File as MutagenFile
+
+from app.services.audio import probe_audio_duration
+
+# Frame MPEG-1 Layer III, 128 kbps, 44.1 kHz, senza padding: 1152 campioni, 417 byte
+MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+def make_wav(size: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b'\x00' * (size - 44))
+    return buffer.getvalue()
+
+
+def make_mp3(size: int) -> bytes:
+    return MP3_FRAME * (size // len(MP3_FRAME))
+
+
+class CountingStream(io.BytesIO):
+    """ BytesIO che conta i byte letti, come lo SpooledTemporaryFile dell'upload """
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def temp_file_duration(fileobj, filename: str) -> float:
+    # Comportamento precedente: tutto l'upload copiato su disco e riaperto da mutagen
+    fileobj.seek(0)
+    path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as temp_file:
+            temp_file.write(fileobj.read())
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            path = temp_file.name
+        audio_file = MutagenFile(path)
+        return float(audio_file.info.length) if audio_file is not None else 0.0
+    finally:
+        if path:
+            os.unlink(path)
+
+
+def measure(probe, data: bytes, filename: str, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        stream = CountingStream(data)
+        start = time.perf_counter()
+        duration = probe(stream, filename)
+        times.append(time.perf_counter() - start)
+    return duration, statistics.mean(times), stream.bytes_read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100], help="dimensioni in MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'file':<14}{'metodo':<12}{'durata s':>10}{'tempo ms':>12}{'letti MB':>11}")
+    for size_mb in args.sizes:
+        for extension, make in (('.wav', make_wav), ('.mp3', make_mp3)):
+            data = make(size_mb * 1024 * 1024)
+            filename = f"{size_mb}MB{extension}"
+            for name, probe in (('temp file', temp_file_duration), ('header', probe_audio_duration)):
+                duration, elapsed, read = measure(probe, data, filename, args.repeat)
+                print(f"{filename:<14}{name:<12}{duration:>10.1f}{elapsed * 1000:>12.2f}{read / 2**20:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
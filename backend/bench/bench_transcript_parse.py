@@ -0,0 +1,85 @@
+##
+"""
+Memoria e tempo per estrarre testo e lingua da un output di AWS Transcribe
+sintetico di piu' ore: json.loads sull'intero documento (comportamento
+precedente) contro parse_transcribe_output in streaming.
+
+    python -m bench.bench_transcript_parse [--hours 1 4 8]
+
+L'output viene scritto su un file temporaneo e letto come il body di S3;
+la memoria e' il picco misurato da tracemalloc durante il parsing.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from app.services.transcripts import parse_transcribe_output
+
+# Parole al secondo di un parlato normale
+WORDS_PER_SECOND = 2.5
+WORDS = ["buongiorno", "trascrizione", "riunione", "progetto", "quindi", "allora",
+         "domani", "budget", "cliente", "prossima", "settimana", "va", "bene", "ok"]
+
+
+def write_output(path: str, hours: float):
+    """ Output nel formato di Transcribe, con language_code dopo `items` (caso peggiore) """
+    words = int(hours * 3600 * WORDS_PER_SECOND)
+    rng = random.Random(42)
+    with open(path, 'w') as out:
+        out.write('{"jobName":"hearly-bench","accountId":"123456789012","status":"COMPLETED","results":{')
+        text = " ".join(rng.choice(WORDS) for _ in range(words))
+        out.write('"transcripts":[{"transcript":' + json.dumps(text) + '}],"items":[')
+        for i in range(words):
+            start = i / WORDS_PER_SECOND
+            item = {
+                "id": i,
+                "type": "pronunciation",
+                "alternatives": [{"confidence": "0.987", "content": rng.choice(WORDS)}],
+                "start_time": f"{start:.3f}",
+                "end_time": f"{start + 0.3:.3f}",
+            }
+            out.write(("," if i else "") + json.dumps(item))
+        out.write('],"language_code":"it-IT","language_identification":[{"code":"it-IT","score":"0.99"}]}}')
+
+
+def json_loads(body) -> tuple:
+    # Prima: tutto il documento in memoria come oggetti Python
+    data = json.loads(body.read())
+    return data['results']['transcripts'][0]['transcript'], data['results'].get('language_code', 'und')
+
+
+def measure(parse, path: str) -> tuple:
+    with open(path, 'rb') as body:
+        tracemalloc.start()
+        start = time.perf_counter()
+        transcript, language = parse(body)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return len(transcript), language, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    print(f"{'ore':>5}{'output MB':>11}{'metodo':>12}{'testo':>10}{'lingua':>8}{'tempo s':>10}{'picco MB':>11}")
+    for hours in args.hours:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "output.json")
+            write_output(path, hours)
+            size = os.path.getsize(path)
+            for name, parse in (('json.loads', json_loads), ('streaming', parse_transcribe_output)):
+                chars, language, elapsed, peak = measure(parse, path)
+                print(f"{hours:>5g}{size / 2**20:>11.1f}{name:>12}{chars:>10}{language:>8}"
+                      f"{elapsed:>10.2f}{peak / 2**20:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
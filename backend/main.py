@@ -2,8 +2,13 @@ from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import asyncio
 from app.controllers import files
 from app.routes.auth import auth_router
+from app.services import get_service_llm
+from app.services.jobs import Worker
+from app.services.queue import JOB_QUEUE_BACKEND
+from app.services.summaries import AUTO_SUMMARIZE, get_summary_pipeline
 import uvicorn
 import logging
 
@@ -34,6 +39,26 @@ async def health_check():
 async def root():
     return {"message": "Hearly API is running"}
 
+@app.on_event("startup")
+async def start_background_tasks():
+    # Con la coda in memoria i job li esegue un worker nello stesso processo
+    if JOB_QUEUE_BACKEND == "memory":
+        app.state.worker = Worker(poll_wait=1)
+        app.state.worker_task = asyncio.create_task(app.state.worker.run())
+    if AUTO_SUMMARIZE:
+        get_summary_pipeline().start()
+
+@app.on_event("shutdown")
+async def close_clients():
+    if AUTO_SUMMARIZE:
+        get_summary_pipeline().stop()
+    if getattr(app.state, "worker", None):
+        app.state.worker.stop()
+        await app.state.worker_task
+    # Il client LLM asincrono tiene aperta una sessione HTTP per tutta la vita del processo
+    if get_service_llm.cache_info().currsize:
+        await get_service_llm().close()
+
 # Includi i router dei controller
 app.include_router(files.router)
 app.include_router(auth_router)
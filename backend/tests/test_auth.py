@@ -0,0 +1,140 @@
+##
+
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from app.utils.auth import InvalidToken, JWKSCache, TokenVerifier
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_test"
+CLIENT_ID = "client-test"
+KID = "test-key"
+
+
+def generate_key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode()
+    return private_pem, public_pem
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return generate_key_pair()
+
+
+@pytest.fixture
+def fetches():
+    return []
+
+
+@pytest.fixture
+def verifier(keys, fetches):
+    _, public_pem = keys
+    public_jwk = {**jwk.construct(public_pem, 'RS256').to_dict(), 'kid': KID, 'use': 'sig'}
+
+    def fetch(url):
+        fetches.append(url)
+        return {'keys': [public_jwk]}
+
+    return TokenVerifier(JWKSCache("https://jwks.test", fetch=fetch), ISSUER, CLIENT_ID)
+
+
+def make_claims(token_use='access', **overrides):
+    now = int(time.time())
+    claims = {'iss': ISSUER, 'token_use': token_use, 'iat': now, 'exp': now + 3600}
+    if token_use == 'access':
+        claims.update({'client_id': CLIENT_ID, 'username': 'mario'})
+    else:
+        claims.update({'aud': CLIENT_ID, 'cognito:username': 'mario'})
+    claims.update(overrides)
+    return {name: value for name, value in claims.items() if value is not None}
+
+
+def sign(keys, claims, kid=KID):
+    private_pem, _ = keys
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+def test_access_token(keys, verifier):
+    claims = verifier.verify(sign(keys, make_claims('access')))
+    assert claims['username'] == 'mario'
+
+
+def test_id_token(keys, verifier):
+    claims = verifier.verify(sign(keys, make_claims('id')))
+    assert claims['cognito:username'] == 'mario'
+
+
+def test_verified_token_is_cached(keys, verifier, fetches):
+    token = sign(keys, make_claims())
+    assert verifier.cached(token) is None
+    claims = verifier.verify(token)
+    assert verifier.cached(token) == claims
+    assert len(fetches) == 1
+
+
+def test_expired_token(keys, verifier):
+    now = int(time.time())
+    with pytest.raises(InvalidToken):
+        verifier.verify(sign(keys, make_claims(iat=now - 7200, exp=now - 3600)))
+
+
+def test_missing_exp(keys, verifier):
+    with pytest.raises(InvalidToken):
+        verifier.verify(sign(keys, make_claims(exp=None)))
+
+
+@pytest.mark.parametrize("token_use, claim", [('access', 'client_id'), ('id', 'aud')])
+def test_other_client(keys, verifier, token_use, claim):
+    with pytest.raises(InvalidToken):
+        verifier.verify(sign(keys, make_claims(token_use, **{claim: 'another-client'})))
+
+
+def test_wrong_issuer(keys, verifier):
+    with pytest.raises(InvalidToken):
+        verifier.verify(sign(keys, make_claims(iss="https://issuer.example")))
+
+
+def test_unexpected_token_use(keys, verifier):
+    with pytest.raises(InvalidToken):
+        verifier.verify(sign(keys, make_claims(token_use='refresh', client_id=CLIENT_ID)))
+
+
+def test_hs256_with_public_key(keys, verifier):
+    # Alg confusion: la chiave pubblica usata come segreto HMAC
+    # (costruito a mano: jose non firma HS256 con una chiave PEM)
+    _, public_pem = keys
+    encode = lambda data: base64.urlsafe_b64encode(data).rstrip(b'=')
+    signing_input = b'.'.join([
+        encode(json.dumps({'alg': 'HS256', 'typ': 'JWT', 'kid': KID}).encode()),
+        encode(json.dumps(make_claims()).encode()),
+    ])
+    signature = hmac.new(public_pem.encode(), signing_input, hashlib.sha256).digest()
+    token = (signing_input + b'.' + encode(signature)).decode()
+    with pytest.raises(InvalidToken):
+        verifier.verify(token)
+
+
+def test_unknown_kid(keys, verifier, fetches):
+    token = sign(keys, make_claims(), kid="rotated-key")
+    with pytest.raises(InvalidToken):
+        verifier.verify(token)
+    # Un secondo kid sconosciuto non riscarica il JWKS prima di min_refresh_interval
+    with pytest.raises(InvalidToken):
+        verifier.verify(token)
+    assert len(fetches) == 1
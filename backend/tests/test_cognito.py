@@ -0,0 +1,38 @@
+##
+
+import hmac
+import base64
+import hashlib
+
+import pytest
+
+from app.controllers import cognito
+
+
+@pytest.fixture
+def aws_cognito(monkeypatch):
+    monkeypatch.setattr(cognito, "get_client", lambda *args, **kwargs: None)
+    monkeypatch.setattr(cognito, "AWS_COGNITO_APP_CLIENT_ID", "client-test")
+    monkeypatch.setattr(cognito, "AWS_COGNITO_CLIENT_SECRET", "s3cr3t-àè")
+    return cognito.AWSCognito()
+
+
+def reference_secret_hash(username: str, client_id: str, client_secret: str) -> str:
+    # Formula della documentazione Cognito, con un HMAC nuovo per ogni chiamata
+    message = (username + client_id).encode('utf-8')
+    digest = hmac.new(client_secret.encode('utf-8'), message, digestmod=hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+@pytest.mark.parametrize("username", ["mario", "Mario.Rossi@example.com", "ùtente", ""])
+def test_cached_hmac_matches_per_call_digest(aws_cognito, username):
+    assert aws_cognito._calculate_secret_hash(username) == reference_secret_hash(
+        username, "client-test", "s3cr3t-àè"
+    )
+
+
+def test_cached_hmac_is_not_consumed(aws_cognito):
+    # Ogni hash parte da una copia: chiamate ripetute non si influenzano
+    first = aws_cognito._calculate_secret_hash("mario")
+    aws_cognito._calculate_secret_hash("luigi")
+    assert aws_cognito._calculate_secret_hash("mario") == first
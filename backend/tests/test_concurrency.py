@@ -0,0 +1,139 @@
+##
+
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from app.utils.concurrency import AWS_IO_WORKERS, SingleFlight, run_blocking
+
+# Latenza della chiamata AWS simulata dagli stub bloccanti
+STUB_LATENCY = 0.5
+
+
+def test_run_blocking_overlaps_calls():
+    # Chiamate bloccanti concorrenti vanno in parallelo sul pool, senza fermare il loop
+    calls = min(8, AWS_IO_WORKERS)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticking = asyncio.create_task(ticker())
+        start = time.monotonic()
+        await asyncio.gather(*(run_blocking(time.sleep, 0.2) for _ in range(calls)))
+        elapsed = time.monotonic() - start
+        ticking.cancel()
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    assert elapsed < 0.2 * calls / 2
+    assert len(ticks) >= 5
+
+
+class SlowCognito:
+    """ AWSCognito bloccante: sign_in tiene occupato il thread come una chiamata di rete """
+
+    def sign_in(self, username: str, password: str):
+        time.sleep(STUB_LATENCY)
+        return {'AuthenticationResult': {'AccessToken': "a", 'IdToken': "i", 'ExpiresIn': 3600, 'TokenType': "Bearer"}}
+
+
+def slow_user_stats(username: str) -> dict:
+    time.sleep(STUB_LATENCY)
+    return {}
+
+
+@pytest.fixture
+def slow_routes(monkeypatch):
+    from main import app
+    from app.controllers import files
+    from app.routes.auth import get_aws_cognito
+
+    monkeypatch.setattr(files, "get_user_stats", slow_user_stats)
+    app.dependency_overrides[get_aws_cognito] = SlowCognito
+    yield app
+    app.dependency_overrides.pop(get_aws_cognito, None)
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("GET", "/users/mario/recent-activity", None),
+    ("POST", "/api/v1/auth/signin", {"username": "mario", "password": "Password1!"}),
+])
+def test_concurrent_requests_overlap(slow_routes, auth_headers, method, path, body):
+    # Due richieste insieme sullo stesso event loop: con la chiamata bloccante
+    # fuori dal loop durano quanto una sola, non il doppio
+    async def main():
+        transport = httpx.ASGITransport(app=slow_routes)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=auth_headers) as client:
+            start = time.monotonic()
+            responses = await asyncio.gather(*(client.request(method, path, json=body) for _ in range(2)))
+            return responses, time.monotonic() - start
+
+    responses, elapsed = asyncio.run(main())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert elapsed < STUB_LATENCY * 1.5
+
+
+def test_run_blocking_passes_arguments_and_errors():
+    async def main():
+        assert await run_blocking(int, "ff", base=16) == 255
+        with pytest.raises(ZeroDivisionError):
+            await run_blocking(divmod, 1, 0)
+
+    asyncio.run(main())
+
+
+def test_single_flight_shares_one_execution():
+    calls = []
+
+    async def main():
+        flight = SingleFlight()
+
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("key", factory) for _ in range(10)))
+        # Finita l'esecuzione la chiave si libera: una nuova chiamata riesegue
+        again = await flight.do("key", factory)
+        return results, again
+
+    results, again = asyncio.run(main())
+    assert results == ["value"] * 10
+    assert again == "value"
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_errors_and_survives_cancellation():
+    calls = []
+
+    async def main():
+        flight = SingleFlight()
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise RuntimeError("boom")
+
+        results = await asyncio.gather(*(flight.do("err", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        # Un chiamante cancellato (client disconnesso) non interrompe gli altri
+        first = asyncio.create_task(flight.do("slow", slow))
+        second = asyncio.create_task(flight.do("slow", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
+    assert len(calls) == 1
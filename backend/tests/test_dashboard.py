@@ -0,0 +1,54 @@
+##
+
+import itertools
+
+import boto3
+import pytest
+
+from app.controllers import files as files_controller
+from app.services.tables import FILES_TABLE
+
+
+@pytest.fixture
+def resigning(monkeypatch):
+    # Ogni firma produce un URL diverso, come quando scade la cache degli URL
+    counter = itertools.count()
+
+    def presign_get_urls(bucket, keys, expiration):
+        return {key: f"https://signed.test/{key}?sig={next(counter)}" for key in keys}
+
+    monkeypatch.setattr(files_controller, "presign_get_urls", presign_get_urls)
+
+
+def put_file(file_id: str, status: str = 'COMPLETED'):
+    boto3.resource('dynamodb').Table(FILES_TABLE).put_item(Item={
+        'user_id': "mario", 'file_id': file_id, 'filename': f"{file_id}.wav", 'status': status,
+        'upload_time': 1760000000, 'extension': "wav", 'duration': 60,
+        'url': f"https://hearly-audio.s3.amazonaws.com/mario/{file_id}.wav",
+    })
+
+
+def test_etag_ignores_signed_urls(client, auth_headers, resigning):
+    put_file("a")
+    put_file("b", 'IN_PROGRESS')
+
+    first = client.get("/users/mario/dashboard", headers=auth_headers)
+    second = client.get("/users/mario/dashboard", headers=auth_headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json()["files"][0]["url"] != second.json()["files"][0]["url"]
+    assert first.headers["ETag"] == second.headers["ETag"]
+
+    cached = client.get("/users/mario/dashboard", headers={**auth_headers, "If-None-Match": first.headers["ETag"]})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+
+def test_etag_changes_with_file_status(client, auth_headers, resigning):
+    put_file("a", 'IN_PROGRESS')
+    etag = client.get("/users/mario/dashboard", headers=auth_headers).headers["ETag"]
+
+    put_file("a", 'COMPLETED')
+    response = client.get("/users/mario/dashboard", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["files"][0]["status"] == 'COMPLETED'
@@ -0,0 +1,126 @@
+##
+
+import time
+import asyncio
+
+from app.services.events import InMemoryNotifier, StatusBroker, is_final
+
+
+class FakeStatus:
+    """ Stato dei file in memoria al posto di check_transcription_status """
+
+    def __init__(self, status: str = 'IN_PROGRESS', delay: float = 0):
+        self.status = status
+        self.delay = delay
+        self.calls = 0
+
+    def check(self, username: str, file_id: str) -> dict:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return {"status": self.status, "file_id": file_id}
+
+
+def make_broker(status: FakeStatus, interval: float = 60):
+    notifier = InMemoryNotifier()
+    # Intervallo lungo: i controlli partono solo dalle notifiche
+    return StatusBroker(status.check, notifier=notifier, interval=interval), notifier
+
+
+def test_completed_and_failed_are_final_on_status_alone():
+    assert is_final({"status": "COMPLETED"})
+    assert is_final({"status": "FAILED"})
+    assert is_final({"status": "ERROR"})
+    assert not is_final({"status": "IN_PROGRESS"})
+    assert not is_final({"status": "UNKNOWN"})
+
+
+def test_subscribers_share_one_watcher():
+    status = FakeStatus()
+    broker, notifier = make_broker(status)
+
+    async def main():
+        first = broker.subscribe("mario", "f")
+        second = broker.subscribe("mario", "f")
+        assert await asyncio.wait_for(first.get(), 1) == {"status": "IN_PROGRESS", "file_id": "f"}
+        assert await asyncio.wait_for(second.get(), 1) == {"status": "IN_PROGRESS", "file_id": "f"}
+        assert status.calls == 1
+
+        # Chi arriva dopo riceve subito l'ultimo stato, senza un nuovo controllo
+        late = broker.subscribe("mario", "f")
+        assert late.get_nowait()["status"] == "IN_PROGRESS"
+
+        status.status = 'COMPLETED'
+        notifier.publish("mario", "f", 'COMPLETED')
+        for queue in (first, second, late):
+            assert (await asyncio.wait_for(queue.get(), 1))["status"] == 'COMPLETED'
+        assert status.calls == 2
+
+        for queue in (first, second, late):
+            broker.unsubscribe("mario", "f", queue)
+
+    asyncio.run(main())
+
+
+def test_notifications_for_other_files_do_not_trigger_checks():
+    status = FakeStatus()
+    broker, notifier = make_broker(status)
+
+    async def main():
+        queue = broker.subscribe("mario", "f")
+        await asyncio.wait_for(queue.get(), 1)
+        notifier.publish("mario", "other", 'COMPLETED')
+        await asyncio.sleep(0.1)
+        assert status.calls == 1
+        broker.unsubscribe("mario", "f", queue)
+
+    asyncio.run(main())
+
+
+def test_final_event_stops_the_watcher():
+    status = FakeStatus()
+    broker, notifier = make_broker(status, interval=0.05)
+
+    async def main():
+        waiter = asyncio.create_task(broker.wait("mario", "f", since='IN_PROGRESS', timeout=5))
+        # Come uno stream SSE: resta iscritto anche dopo l'evento finale
+        stream = broker.subscribe("mario", "f")
+        await asyncio.sleep(0.1)
+        status.status = 'COMPLETED'
+        notifier.publish("mario", "f", 'COMPLETED')
+        # COMPLETED chiude l'attesa anche senza il testo della trascrizione
+        assert await waiter == {"status": 'COMPLETED', "file_id": "f"}
+
+        calls = status.calls
+        await asyncio.sleep(0.2)
+        assert status.calls == calls
+        assert broker._watches == {}
+        broker.unsubscribe("mario", "f", stream)
+
+    asyncio.run(main())
+
+
+def test_wait_times_out_with_last_known_status():
+    status = FakeStatus()
+    broker, _ = make_broker(status)
+
+    async def main():
+        start = time.monotonic()
+        event = await broker.wait("mario", "f", since='IN_PROGRESS', timeout=0.3)
+        assert 0.25 < time.monotonic() - start < 1
+        return event
+
+    assert asyncio.run(main()) == {"status": "IN_PROGRESS", "file_id": "f"}
+
+
+def test_wait_times_out_before_the_first_check():
+    status = FakeStatus(delay=0.5)
+    broker, _ = make_broker(status)
+
+    async def main():
+        event = await broker.wait("mario", "f", timeout=0.1)
+        # Lascia finire il controllo in corso prima di chiudere il loop
+        await asyncio.sleep(0.5)
+        return event
+
+    assert asyncio.run(main()) is None
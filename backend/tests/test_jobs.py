@@ -0,0 +1,244 @@
+##
+
+import time
+import asyncio
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from app.services import jobs
+from app.services.jobs import JobFailed, Worker, retry_delay
+from app.services.queue import MemoryJobQueue, SQLiteJobQueue
+from app.services.tables import FILES_TABLE
+from app.services.transcription import (
+    TranscribeTranscriptionStarter, claim_transcription, release_claim,
+)
+
+
+@pytest.fixture
+def sqlite_queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"), visibility_timeout=1, poll_interval=0.05)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(jobs, "JOB_RETRY_MAX_DELAY", 0.05)
+
+
+def run_worker(worker: Worker, until, timeout: float = 5):
+    """ Esegue il worker finche' `until()` e' vero (o fino al timeout) """
+    async def main():
+        task = asyncio.create_task(worker.run())
+        deadline = time.monotonic() + timeout
+        while not until() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        worker.stop()
+        await task
+
+    asyncio.run(main())
+
+
+# Code
+
+@pytest.mark.parametrize("make_queue", [MemoryJobQueue, "sqlite"])
+def test_queue_delivers_in_order_and_respects_delay(make_queue, sqlite_queue):
+    queue = sqlite_queue if make_queue == "sqlite" else make_queue()
+    first = queue.enqueue("transcribe", {"n": 1})
+    second = queue.enqueue("summarize", {"n": 2})
+    queue.enqueue("summarize", {"n": 3}, delay=0.3)
+
+    jobs_received = queue.receive(max_jobs=5)
+    assert [(job.id, job.type, job.payload, job.attempts) for job in jobs_received] == [
+        (first, "transcribe", {"n": 1}, 0), (second, "summarize", {"n": 2}, 0),
+    ]
+    for job in jobs_received:
+        queue.ack(job)
+    assert queue.receive(wait=0) == []
+    # Il job ritardato arriva entro l'attesa della receive
+    assert [job.payload for job in queue.receive(wait=1)] == [{"n": 3}]
+
+
+@pytest.mark.parametrize("make_queue", [MemoryJobQueue, "sqlite"])
+def test_queue_retry_counts_attempts(make_queue, sqlite_queue):
+    queue = sqlite_queue if make_queue == "sqlite" else make_queue()
+    queue.enqueue("summarize", {})
+    job = queue.receive()[0]
+
+    queue.retry(job, delay=0.2, error="boom")
+    assert queue.receive(wait=0) == []
+    again = queue.receive(wait=1)[0]
+    assert again.id == job.id
+    assert again.attempts == 1
+
+
+def test_sqlite_job_returns_after_visibility_timeout(sqlite_queue):
+    sqlite_queue.enqueue("summarize", {})
+    job = sqlite_queue.receive()[0]
+    assert sqlite_queue.receive(wait=0.5) == []
+    # Worker morto a meta': il job torna ricevibile
+    assert sqlite_queue.receive(wait=1.5)[0].id == job.id
+
+
+def test_sqlite_extend_keeps_job_invisible(sqlite_queue):
+    sqlite_queue.enqueue("summarize", {})
+    job = sqlite_queue.receive()[0]
+    time.sleep(0.6)
+    sqlite_queue.extend(job, 1)
+    assert sqlite_queue.receive(wait=0.8) == []
+
+
+def test_sqlite_dead_letter_is_kept_out_of_the_queue(sqlite_queue):
+    sqlite_queue.enqueue("summarize", {"file_id": "f"})
+    job = sqlite_queue.receive()[0]
+    sqlite_queue.dead_letter(job, "boom")
+    assert sqlite_queue.receive(wait=1.2) == []
+    row = sqlite_queue._db.execute("SELECT status, error FROM jobs WHERE id = ?", (job.id,)).fetchone()
+    assert row == ('dead', 'boom')
+
+
+def test_sqlite_queue_is_shared_between_instances(tmp_path):
+    # API e worker aprono lo stesso file da processi diversi
+    path = str(tmp_path / "jobs.db")
+    SQLiteJobQueue(path).enqueue("summarize", {"n": 1})
+    assert [job.payload for job in SQLiteJobQueue(path).receive()] == [{"n": 1}]
+
+
+# Worker
+
+def test_retry_delay_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 10)
+    monkeypatch.setattr(jobs, "JOB_RETRY_MAX_DELAY", 600)
+    assert [retry_delay(attempts) for attempts in range(8)] == [10, 20, 40, 80, 160, 320, 600, 600]
+
+
+def test_worker_retries_until_success():
+    queue = MemoryJobQueue()
+    calls = []
+
+    async def flaky(payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise RuntimeError("temporary")
+
+    queue.enqueue("flaky", {"n": 1})
+    worker = Worker(queue, {"flaky": (flaky, None)}, concurrency=2, max_attempts=5, poll_wait=0.05)
+    run_worker(worker, lambda: len(calls) == 3)
+
+    assert len(calls) == 3
+    assert queue.dead == []
+    assert queue.receive(wait=0.1) == []
+
+
+def test_worker_dead_letters_after_max_attempts():
+    queue = MemoryJobQueue()
+    failures = []
+
+    async def broken(payload):
+        raise RuntimeError("always")
+
+    async def on_failure(payload, error):
+        failures.append((payload, error))
+
+    queue.enqueue("broken", {"n": 1})
+    worker = Worker(queue, {"broken": (broken, on_failure)}, max_attempts=3, poll_wait=0.05)
+    run_worker(worker, lambda: failures)
+
+    assert [(job.attempts, error) for job, error in queue.dead] == [(2, "always")]
+    assert failures == [({"n": 1}, "always")]
+
+
+def test_worker_job_failed_skips_retries():
+    queue = MemoryJobQueue()
+    calls = []
+
+    async def rejected(payload):
+        calls.append(payload)
+        raise JobFailed("bad request")
+
+    queue.enqueue("rejected", {})
+    queue.enqueue("unknown", {})
+    worker = Worker(queue, {"rejected": (rejected, None)}, max_attempts=5, poll_wait=0.05)
+    run_worker(worker, lambda: len(queue.dead) == 2)
+
+    assert len(calls) == 1
+    assert sorted(error for _, error in queue.dead) == ["Unknown job type unknown", "bad request"]
+
+
+def test_worker_extends_visibility_of_long_jobs(sqlite_queue):
+    done = []
+
+    async def long_job(payload):
+        # Piu' lungo della visibilita' (1s): senza rinnovo verrebbe riconsegnato
+        await asyncio.sleep(1.6)
+        done.append(payload)
+
+    sqlite_queue.enqueue("long", {"n": 1})
+    worker = Worker(sqlite_queue, {"long": (long_job, None)}, concurrency=2, poll_wait=0.1)
+    run_worker(worker, lambda: done)
+
+    assert done == [{"n": 1}]
+    assert sqlite_queue.receive(wait=1.2) == []
+
+
+# Avvio delle trascrizioni
+
+def put_file(file_id: str, status: str = 'PENDING'):
+    boto3.resource('dynamodb').Table(FILES_TABLE).put_item(Item={
+        'user_id': "mario", 'file_id': file_id, 'filename': "a.wav", 'status': status,
+    })
+
+
+def file_status(file_id: str) -> str:
+    return boto3.resource('dynamodb').Table(FILES_TABLE).get_item(
+        Key={'user_id': "mario", 'file_id': file_id}
+    )['Item']['status']
+
+
+def test_release_claim_restores_previous_status(aws):
+    put_file("f", 'COMPLETED')
+    old_item = claim_transcription("mario", "f", "job-1")
+    assert file_status("f") == 'QUEUED'
+
+    release_claim("mario", "f", "job-1", old_item['status'])
+    assert file_status("f") == 'COMPLETED'
+
+
+def test_release_claim_ignores_a_newer_claim(aws):
+    put_file("f")
+    claim_transcription("mario", "f", "job-1")
+    release_claim("mario", "f", "job-1", 'PENDING')
+    claim_transcription("mario", "f", "job-2")
+
+    # Il fallimento tardivo del primo avvio non tocca il job successivo
+    release_claim("mario", "f", "job-1", 'PENDING')
+    assert file_status("f") == 'QUEUED'
+
+
+def test_transcribe_job_failed_releases_the_claim(aws):
+    put_file("f")
+    claim_transcription("mario", "f", "job-1")
+    payload = {"username": "mario", "file_id": "f", "job_name": "job-1", "previous_status": "PENDING"}
+
+    asyncio.run(jobs.transcribe_job_failed(payload, "boom"))
+    assert file_status("f") == 'PENDING'
+
+
+class ConflictingTranscribe:
+    """ Transcribe finto: il job e' gia' stato avviato da un tentativo precedente """
+
+    def start_transcription_job(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ConflictException', 'Message': 'exists'}}, 'StartTranscriptionJob')
+
+
+def test_retried_transcribe_job_treats_conflict_as_started(aws, monkeypatch):
+    put_file("f")
+    claim_transcription("mario", "f", "job-1")
+    starter = TranscribeTranscriptionStarter(client=ConflictingTranscribe(), output_bucket="hearly-output")
+    monkeypatch.setattr("app.services.transcription.get_transcription_starter", lambda: starter)
+    payload = {"username": "mario", "file_id": "f", "bucket": "hearly-audio", "key": "mario/f_a.wav",
+               "job_name": "job-1", "previous_status": "PENDING"}
+
+    asyncio.run(jobs.run_transcribe_job(payload))
+    assert file_status("f") == 'IN_PROGRESS'
@@ -0,0 +1,77 @@
+##
+
+import random
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm as llm_module
+from app.services.llm import CHUNK_PROMPT, ServiceLLM, chunk_transcription, estimate_tokens
+
+CHUNK_TOKENS = 300
+WORDS = ("riunione progetto budget cliente domani settimana quindi allora bene "
+         "consegna fattura contratto revisione priorita' rischio").split()
+
+
+class MapCountingClient:
+    """ Client chat-completions finto che conta le richieste sui singoli blocchi """
+
+    def __init__(self):
+        self.chunk_calls = 0
+
+    async def complete(self, messages, **kwargs):
+        if messages[0].content == CHUNK_PROMPT:
+            self.chunk_calls += 1
+        text = messages[-1].content
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text[:40]))])
+
+
+def sentences(seed: int, count: int = 200) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))).capitalize() + "."
+            for _ in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def empty_chunk_cache():
+    llm_module._chunk_cache.clear()
+    yield
+    llm_module._chunk_cache.clear()
+
+
+def summarize(service: ServiceLLM, text: str) -> int:
+    before = service.client.chunk_calls
+    asyncio.run(service.summarize(text))
+    return service.client.chunk_calls - before
+
+
+def test_chunks_respect_the_budget():
+    chunks = chunk_transcription(" ".join(sentences(0)), CHUNK_TOKENS)
+    assert len(chunks) > 3
+    assert all(estimate_tokens(chunk) <= CHUNK_TOKENS for chunk in chunks)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_insertion_near_the_start_resummarizes_few_chunks(seed):
+    service = ServiceLLM(client=MapCountingClient(), chunk_tokens=CHUNK_TOKENS)
+    original = sentences(seed)
+    total = summarize(service, " ".join(original))
+    assert total == len(chunk_transcription(" ".join(original), CHUNK_TOKENS))
+
+    # Un paragrafo aggiunto all'inizio: con blocchi "greedy" tutti i confini
+    # successivi si spostano e quasi nessun blocco resta in cache; con i confini
+    # ancorati al contenuto tornano al modello solo i blocchi vicini
+    edited = original[:2] + sentences(100 + seed, 5) + original[2:]
+    assert summarize(service, " ".join(edited)) <= 4 < total // 4
+
+
+def test_in_place_edit_resummarizes_one_chunk():
+    service = ServiceLLM(client=MapCountingClient(), chunk_tokens=CHUNK_TOKENS)
+    original = sentences(42)
+    summarize(service, " ".join(original))
+
+    edited = list(original)
+    edited[len(edited) // 2] = "Frase corretta a meta' del testo."
+    assert summarize(service, " ".join(edited)) <= 2
+    assert summarize(service, " ".join(edited)) == 0
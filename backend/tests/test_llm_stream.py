@@ -0,0 +1,97 @@
+##
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.llm import LLMUnavailable, ServiceLLM
+from azure.core.exceptions import ServiceResponseError
+
+
+def update(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeStream:
+    def __init__(self, fragments, error=None):
+        self.fragments = fragments
+        self.error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for fragment in self.fragments:
+            await asyncio.sleep(0)
+            yield update(fragment)
+        if self.error:
+            raise self.error
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, stream: FakeStream):
+        self.stream = stream
+
+    async def complete(self, **kwargs):
+        assert kwargs["stream"] is True
+        return self.stream
+
+
+def service(stream: FakeStream) -> ServiceLLM:
+    return ServiceLLM(client=FakeClient(stream))
+
+
+def test_slot_released_before_slow_client_finishes():
+    stream = FakeStream(["Uno ", "due ", "tre."])
+
+    async def main():
+        llm = service(stream)
+        slots = llm._in_flight._value
+        received = []
+        async for fragment in llm._stream("prompt", "testo"):
+            received.append(fragment)
+            # Client lento: il modello ha finito mentre il primo frammento e' ancora in consegna
+            await asyncio.sleep(0.01)
+            if len(received) == 1:
+                assert llm._in_flight._value == slots
+        return received
+
+    assert asyncio.run(main()) == ["Uno ", "due ", "tre."]
+    assert stream.closed
+
+
+def test_upstream_error_reaches_the_client():
+    stream = FakeStream(["Uno "], error=ServiceResponseError("connection reset"))
+
+    async def main():
+        llm = service(stream)
+        received = []
+        with pytest.raises(LLMUnavailable):
+            async for fragment in llm._stream("prompt", "testo"):
+                received.append(fragment)
+        return received
+
+    received = asyncio.run(main())
+    assert received == ["Uno "]
+    assert stream.closed
+
+
+def test_disconnect_cancels_the_completion():
+    stream = FakeStream(["x"] * 1000)
+
+    async def main():
+        llm = service(stream)
+        slots = llm._in_flight._value
+        fragments = llm._stream("prompt", "testo")
+        await anext(fragments)
+        await fragments.aclose()
+        await asyncio.sleep(0.01)
+        return llm._in_flight._value == slots
+
+    assert asyncio.run(main())
+    assert stream.closed
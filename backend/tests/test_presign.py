@@ -0,0 +1,51 @@
+##
+
+from datetime import datetime, timezone
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import boto3
+import pytest
+from botocore.auth import S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from app.services import presign
+from app.utils.aws import client_config
+
+CREDENTIALS = Credentials("AKIDEXAMPLE", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY").get_frozen_credentials()
+NOW = datetime(2026, 10, 17, 12, 30, 0, tzinfo=timezone.utc)
+KEYS = ["mario/0f3e-intervista.mp3", "mario/a b+c%d (1).wav", "mario/èàù.m4a"]
+
+
+@pytest.fixture(params=["us-east-1", "eu-west-1"])
+def s3_client(request, monkeypatch):
+    client = boto3.session.Session(
+        aws_access_key_id=CREDENTIALS.access_key,
+        aws_secret_access_key=CREDENTIALS.secret_key,
+    ).client('s3', region_name=request.param, config=client_config())
+    monkeypatch.setattr(presign, "get_client", lambda service, region=None: client)
+    presign._bucket_endpoint.cache_clear()
+    yield client
+    presign._bucket_endpoint.cache_clear()
+
+
+@pytest.mark.parametrize("bucket", ["hearly-audio", "hearly.audio"])
+def test_urls_use_the_client_endpoint(s3_client, bucket):
+    urls = presign.sign_get_urls(bucket, KEYS, 3600, credentials=CREDENTIALS, now=NOW)
+    for key in KEYS:
+        expected = urlsplit(s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key}))
+        url = urlsplit(urls[key])
+        assert (url.scheme, url.netloc, url.path) == (expected.scheme, expected.netloc, expected.path)
+
+
+@pytest.mark.parametrize("bucket", ["hearly-audio", "hearly.audio"])
+def test_signature_matches_botocore(s3_client, bucket):
+    urls = presign.sign_get_urls(bucket, KEYS, 3600, credentials=CREDENTIALS, now=NOW)
+    region = s3_client.meta.region_name
+    for key in KEYS:
+        url = urlsplit(urls[key])
+        request = AWSRequest(method='GET', url=f"{url.scheme}://{url.netloc}{url.path}")
+        with mock.patch("botocore.auth.get_current_datetime", return_value=NOW.replace(tzinfo=None)):
+            S3SigV4QueryAuth(CREDENTIALS, 's3', region, expires=3600).add_auth(request)
+        assert parse_qs(url.query) == parse_qs(urlsplit(request.url).query)
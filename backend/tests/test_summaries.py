@@ -0,0 +1,110 @@
+##
+
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+import boto3
+import pytest
+
+from app.services import summaries
+from app.services.events import publish_completion
+from app.services.file import reuse_original_results
+from app.services.llm import ServiceLLM
+from app.services.tables import FILES_TABLE
+from app.utils.concurrency import run_blocking
+
+USERNAME = "mario"
+
+
+class CountingClient:
+    """ Client chat-completions finto che conta le richieste """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, messages, **kwargs):
+        self.calls += 1
+        text = messages[-1].content
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"Riassunto: {text}"))])
+
+
+@pytest.fixture
+def llm(aws, monkeypatch):
+    service = ServiceLLM(client=CountingClient())
+    monkeypatch.setattr(summaries, "get_service_llm", lambda: service)
+    return service
+
+
+def put_transcript(file_id: str, text: str):
+    body = json.dumps({"results": {"transcripts": [{"transcript": text}], "language_code": "it-IT"}})
+    boto3.client('s3').put_object(Bucket="hearly-output", Key=f"{USERNAME}/{file_id}.json", Body=body)
+
+
+def put_file(file_id: str, **attributes):
+    boto3.resource('dynamodb').Table(FILES_TABLE).put_item(Item={
+        'user_id': USERNAME, 'file_id': file_id, 'filename': f"{file_id}.mp3", **attributes,
+    })
+
+
+def get_file(file_id: str) -> dict:
+    return boto3.resource('dynamodb').Table(FILES_TABLE).get_item(
+        Key={'user_id': USERNAME, 'file_id': file_id}
+    )['Item']
+
+
+async def run_pipeline(trigger):
+    pipeline = summaries.SummaryPipeline()
+    pipeline.start()
+    try:
+        await trigger()
+        while pipeline._pending:
+            await asyncio.sleep(0.01)
+    finally:
+        pipeline.stop()
+
+
+def test_duplicate_keeps_the_copied_summary(llm):
+    put_file("originale", status='COMPLETED', hash="abc")
+    put_transcript("originale", "Testo originale.")
+    llm.save_summary(USERNAME, "originale", "Riassunto originale")
+    put_file("copia", status='PENDING', hash="abc", origin_file_id="originale")
+
+    async def trigger():
+        await run_blocking(reuse_original_results, USERNAME, "copia", {'file_id': "originale"})
+
+    asyncio.run(run_pipeline(trigger))
+
+    assert llm.client.calls == 0
+    assert llm.get_saved_summary(USERNAME, "copia") == "Riassunto originale"
+    assert get_file("copia")['summary_status'] == 'COMPLETED'
+
+
+def test_new_file_is_summarized(llm):
+    put_file("nuovo", status='COMPLETED')
+    put_transcript("nuovo", "Testo nuovo.")
+
+    async def trigger():
+        await run_blocking(publish_completion, USERNAME, "nuovo")
+
+    asyncio.run(run_pipeline(trigger))
+
+    assert llm.client.calls == 1
+    assert llm.get_saved_summary(USERNAME, "nuovo") == "Riassunto: Testo nuovo."
+
+
+def test_retranscribed_file_gets_a_new_summary(llm):
+    put_file("ritrascritto", status='COMPLETED')
+    llm.save_summary(USERNAME, "ritrascritto", "Riassunto vecchio")
+    # LastModified di S3 ha la risoluzione del secondo
+    time.sleep(1.1)
+    put_transcript("ritrascritto", "Testo ritrascritto.")
+
+    async def trigger():
+        await run_blocking(publish_completion, USERNAME, "ritrascritto")
+
+    asyncio.run(run_pipeline(trigger))
+
+    assert llm.client.calls == 1
+    assert llm.get_saved_summary(USERNAME, "ritrascritto") == "Riassunto: Testo ritrascritto."
@@ -0,0 +1,145 @@
+##
+
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from app.services.tables import FILES_TABLE
+from app.services.transcription import (
+    LambdaTranscriptionStarter, TranscribeTranscriptionStarter, get_transcription_starter,
+)
+
+
+class FakeStarter:
+    """ Starter locale: registra gli avvii, o fallisce con `error` """
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.started = []
+
+    def start(self, job_name: str, bucket: str, key: str, username: str, file_id: str):
+        if self.error:
+            raise self.error
+        self.started.append({"job_name": job_name, "bucket": bucket, "key": key,
+                             "username": username, "file_id": file_id})
+
+
+class FakeLambda:
+    def __init__(self, status_code: int = 202):
+        self.status_code = status_code
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        self.invocations.append(kwargs)
+        return {'StatusCode': self.status_code}
+
+
+class FakeTranscribe:
+    def __init__(self, error_code: str = None):
+        self.error_code = error_code
+        self.jobs = []
+
+    def start_transcription_job(self, **kwargs):
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': 'error'}}, 'StartTranscriptionJob')
+        self.jobs.append(kwargs)
+
+
+@pytest.fixture
+def audio_file(aws):
+    boto3.resource('dynamodb').Table(FILES_TABLE).put_item(Item={
+        'user_id': "mario", 'file_id': "f", 'filename': "a.wav", 'status': 'PENDING',
+    })
+    boto3.client('s3').put_object(Bucket="hearly-audio", Key="mario/f_a.wav", Body=b"RIFF")
+    return "f"
+
+
+@pytest.fixture
+def use_starter(client):
+    from main import app
+
+    def use(starter):
+        app.dependency_overrides[get_transcription_starter] = lambda: starter
+        return starter
+
+    yield use
+    app.dependency_overrides.pop(get_transcription_starter, None)
+
+
+def file_item(file_id: str) -> dict:
+    return boto3.resource('dynamodb').Table(FILES_TABLE).get_item(
+        Key={'user_id': "mario", 'file_id': file_id}
+    )['Item']
+
+
+def test_kickoff_returns_202_then_409(client, auth_headers, audio_file, use_starter):
+    starter = use_starter(FakeStarter())
+
+    response = client.post("/transcribe/f", headers=auth_headers)
+    assert response.status_code == 202
+    body = response.json()
+    assert body["status"] == "IN_PROGRESS"
+    assert starter.started == [{"job_name": body["job_name"], "bucket": "hearly-audio",
+                                "key": "mario/f_a.wav", "username": "mario", "file_id": "f"}]
+    item = file_item("f")
+    assert (item['status'], item['job_name']) == ('IN_PROGRESS', body["job_name"])
+
+    # Job gia' in corso: nessun secondo avvio
+    assert client.post("/transcribe/f", headers=auth_headers).status_code == 409
+    assert len(starter.started) == 1
+
+
+def test_failed_start_releases_the_claim(client, auth_headers, audio_file, use_starter):
+    use_starter(FakeStarter(error=RuntimeError("lambda down")))
+    response = client.post("/transcribe/f", headers=auth_headers)
+    assert response.status_code == 500
+    assert file_item("f")['status'] == 'PENDING'
+
+    # Il file non resta bloccato in QUEUED: un nuovo avvio riesce
+    starter = use_starter(FakeStarter())
+    assert client.post("/transcribe/f", headers=auth_headers).status_code == 202
+    assert len(starter.started) == 1
+
+
+def test_kickoff_with_lambda_starter(client, auth_headers, audio_file, use_starter):
+    fake_lambda = FakeLambda()
+    use_starter(LambdaTranscriptionStarter(client=fake_lambda, function_name="transcribe-fn"))
+
+    response = client.post("/transcribe/f", headers=auth_headers)
+    assert response.status_code == 202
+    [invocation] = fake_lambda.invocations
+    assert invocation['FunctionName'] == "transcribe-fn"
+    # Invocazione asincrona: la risposta non attende la fine della lambda
+    assert invocation['InvocationType'] == 'Event'
+    assert json.loads(invocation['Payload']) == {"body": {
+        "bucket": "hearly-audio", "key": "mario/f_a.wav", "username": "mario", "job_name": response.json()["job_name"],
+    }}
+
+
+def test_lambda_starter_rejects_unexpected_status():
+    starter = LambdaTranscriptionStarter(client=FakeLambda(status_code=500), function_name="transcribe-fn")
+    with pytest.raises(RuntimeError):
+        starter.start("job-1", "hearly-audio", "mario/f_a.wav", "mario", "f")
+
+
+def test_kickoff_with_transcribe_starter(client, auth_headers, audio_file, use_starter):
+    fake_transcribe = FakeTranscribe()
+    use_starter(TranscribeTranscriptionStarter(client=fake_transcribe, output_bucket="hearly-output"))
+
+    response = client.post("/transcribe/f", headers=auth_headers)
+    assert response.status_code == 202
+    assert fake_transcribe.jobs == [{
+        'TranscriptionJobName': response.json()["job_name"],
+        'Media': {'MediaFileUri': "s3://hearly-audio/mario/f_a.wav"},
+        'OutputBucketName': "hearly-output",
+        'OutputKey': "mario/f.json",
+        'IdentifyLanguage': True,
+    }]
+
+
+def test_transcribe_starter_raises_other_errors():
+    starter = TranscribeTranscriptionStarter(client=FakeTranscribe("LimitExceededException"), output_bucket="hearly-output")
+    with pytest.raises(ClientError):
+        starter.start("job-1", "hearly-audio", "mario/f_a.wav", "mario", "f")
@@ -0,0 +1,113 @@
+##
+
+import io
+import wave
+import hashlib
+
+import boto3
+import pytest
+import requests
+
+from app.services.tables import FILES_TABLE
+
+AUDIO_BUCKET = "hearly-audio"
+
+
+def make_wav(size: int, seed: int = 0) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(bytes([seed % 256]) * (size - 44))
+    return buffer.getvalue()
+
+
+def direct_upload(client, headers, filename: str, data: bytes, sha256: str = None) -> dict:
+    """ initiate -> PUT delle parti sugli URL firmati -> complete, come farebbe il browser """
+    response = client.post("/upload/initiate", json={"filename": filename, "size": len(data)}, headers=headers)
+    assert response.status_code == 200
+    upload = response.json()
+
+    parts = []
+    for part in upload["parts"]:
+        start = (part["part_number"] - 1) * upload["part_size"]
+        put = requests.put(part["url"], data=data[start:start + upload["part_size"]])
+        assert put.status_code == 200
+        parts.append({"part_number": part["part_number"], "etag": put.headers["ETag"]})
+
+    response = client.post("/upload/complete", json={
+        "file_id": upload["file_id"],
+        "upload_id": upload["upload_id"],
+        "filename": filename,
+        "parts": parts,
+        "sha256": sha256,
+    }, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_item(file_id: str) -> dict:
+    return boto3.resource('dynamodb').Table(FILES_TABLE).get_item(
+        Key={'user_id': "mario", 'file_id': file_id}
+    )['Item']
+
+
+def audio_keys() -> list:
+    return [obj['Key'] for obj in boto3.client('s3').list_objects_v2(Bucket=AUDIO_BUCKET).get('Contents', [])]
+
+
+@pytest.fixture
+def audio():
+    # Piu' di una parte (minimo 5 MiB): 6 MiB di WAV a 16 kHz mono, ~196 secondi
+    return make_wav(6 * 1024 * 1024)
+
+
+def test_direct_upload_stores_object_and_metadata(client, auth_headers, audio):
+    result = direct_upload(client, auth_headers, "riunione.wav", audio)
+
+    assert result["duplicate"] is False
+    item = get_item(result["id"])
+    assert item['status'] == 'PENDING'
+    assert int(item['duration']) == len(audio) // 32000
+    assert 'hash' not in item
+    body = boto3.client('s3').get_object(Bucket=AUDIO_BUCKET, Key=f"mario/{result['id']}_riunione.wav")['Body']
+    assert body.read() == audio
+
+
+def test_same_content_becomes_a_duplicate(client, auth_headers, audio):
+    sha256 = hashlib.sha256(audio).hexdigest()
+    first = direct_upload(client, auth_headers, "riunione.wav", audio, sha256)
+    second = direct_upload(client, auth_headers, "copia.wav", audio, sha256.upper())
+
+    assert first["duplicate"] is False
+    assert get_item(first["id"])['hash'] == sha256
+    assert second["duplicate"] is True
+    assert second["origin_file_id"] == first["id"]
+    # L'oggetto appena caricato viene cancellato: resta solo quello dell'originale
+    assert audio_keys() == [f"mario/{first['id']}_riunione.wav"]
+
+
+def test_declared_hash_is_not_trusted(client, auth_headers, audio):
+    sha256 = hashlib.sha256(audio).hexdigest()
+    original = direct_upload(client, auth_headers, "riunione.wav", audio, sha256)
+
+    # Contenuto diverso dichiarato con l'hash dell'originale
+    other = make_wav(6 * 1024 * 1024, seed=7)
+    result = direct_upload(client, auth_headers, "altro.wav", other, sha256)
+
+    assert result["duplicate"] is False
+    assert get_item(result["id"])['hash'] == hashlib.sha256(other).hexdigest()
+    assert sorted(audio_keys()) == sorted([
+        f"mario/{original['id']}_riunione.wav", f"mario/{result['id']}_altro.wav",
+    ])
+
+
+def test_abort_removes_the_pending_upload(client, auth_headers):
+    upload = client.post("/upload/initiate", json={"filename": "a.wav", "size": 1024}, headers=auth_headers).json()
+    response = client.post("/upload/abort", json={
+        "file_id": upload["file_id"], "upload_id": upload["upload_id"], "filename": "a.wav",
+    }, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert boto3.client('s3').list_multipart_uploads(Bucket=AUDIO_BUCKET).get('Uploads', []) == []
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+from app.services import get_service_llm
+from app.services.jobs import Worker
+from app.services.queue import JOB_QUEUE_BACKEND
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    worker = Worker()
+    loop = asyncio.get_running_loop()
+    # SIGTERM (rollout/scale down su Kubernetes): si finiscono i job in corso e si esce
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        if get_service_llm.cache_info().currsize:
+            await get_service_llm().close()
+
+
+if __name__ == "__main__":
+    if JOB_QUEUE_BACKEND in ("inline", "memory"):
+        logger.error(f"JOB_QUEUE_BACKEND={JOB_QUEUE_BACKEND}: il worker separato richiede la coda sqlite o sqs")
+        sys.exit(1)
+    asyncio.run(main())